@@ -1,26 +1,56 @@
+import atexit
+import io
 import json
+import mimetypes
 import os
+import threading
 import time
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 
-from flask import Flask, flash, redirect, render_template, request, url_for, send_from_directory, jsonify
+import numpy as np
 from PIL import Image
-from werkzeug.utils import secure_filename
+from flask import Flask, Response, abort, flash, redirect, render_template, request, url_for, send_file, send_from_directory, jsonify, stream_with_context
+from werkzeug.security import safe_join
 
+from cache import ResultCache
 from database import (
+    get_daily_stats,
     get_label_counts,
+    get_model_stats,
+    get_perceptual_hashes,
+    get_prediction_ids_for_file,
+    get_predictions_by_ids,
     get_recent_predictions,
+    get_writer_stats,
     initialize_database,
     insert_prediction,
+    insert_predictions,
+    rebuild_aggregates,
 )
-from model import classify_image, list_available_models, get_model_info
+from imaging import decode_for_inference, dhash, get_decode_stats
+from jobs import JobQueue, QueueFullError, create_jobs_blueprint
+import metrics
+from metrics import collect, current_timings, stage, timed
+from near_duplicates import NearDuplicateIndex
+from model import _resolve_model_name, classify_ensemble, classify_image, classify_prepared_async, list_available_models, get_model_info, get_batching_stats, get_target_size, prepare_image, warmup_models
+from persistence import BackgroundPersister
+from registry import registry
+from workers import get_pool, start_pool
+from thumbnails import THUMBNAIL_DIR, ThumbnailStore, snap_width, thumbnail_filename
+from storage import StoredUpload, get_staged_bytes, is_content_addressed, open_upload_image, persist_upload, save_upload, stage_bytes, stage_upload
 from utils import allowed_file, ensure_directories
-from detector import detect_objects
+from detector import DETECTOR_NAME, detect_objects, warmup_detector
+from embeddings import get_index, list_indexes
 
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
-DATABASE_PATH = os.path.join(BASE_DIR, "db.sqlite3")
+UPLOAD_DIR = os.environ.get("UPLOAD_DIR", os.path.join(BASE_DIR, "uploads"))
+DATABASE_PATH = os.environ.get("DATABASE_PATH", os.path.join(BASE_DIR, "db.sqlite3"))
+UPLOAD_CACHE_MAX_AGE = 365 * 24 * 3600
 
 app = Flask(__name__)
 app.config["SECRET_KEY"] = "dev-secret-key"
@@ -28,6 +58,22 @@ app.config["UPLOAD_FOLDER"] = UPLOAD_DIR
 app.config["MAX_CONTENT_LENGTH"] = 10 * 1024 * 1024  # 10MB
 app.config["ASSET_VERSION"] = str(int(time.time()))
 app.config["SEND_FILE_MAX_AGE_DEFAULT"] = 0
+# Decode uploads from memory and write file + DB row from a background worker
+app.config["PERSIST_IN_BACKGROUND"] = os.environ.get("PERSIST_IN_BACKGROUND", "1") == "1"
+# Batch API limits: number of images per request, decode threads, and rows per DB transaction
+app.config["BATCH_MAX_ITEMS"] = int(os.environ.get("BATCH_MAX_ITEMS", "1000"))
+app.config["BATCH_DECODE_WORKERS"] = int(os.environ.get("BATCH_DECODE_WORKERS", str(min(8, os.cpu_count() or 1))))
+app.config["BATCH_DB_CHUNK"] = int(os.environ.get("BATCH_DB_CHUNK", "64"))
+# Upper bound on the decompressed size of all zip members accepted in one batch request
+app.config["BATCH_MAX_UNZIPPED_BYTES"] = int(os.environ.get("BATCH_MAX_UNZIPPED_MB", "256")) * 1024 * 1024
+# Comma-separated models to load and trace at startup ("detector" for object detection).
+# WARMUP_MODELS is the older name of the same setting.
+app.config["PRELOAD_MODELS"] = os.environ.get("PRELOAD_MODELS", os.environ.get("WARMUP_MODELS", "efficientnet_v2_b3"))
+# Generate thumbnails in the background right after an upload instead of on first view
+app.config["THUMBNAILS_ON_UPLOAD"] = os.environ.get("THUMBNAILS_ON_UPLOAD", "1") == "1"
+# Reuse the cached result of an earlier upload whose perceptual hash is within this many bits (of 64);
+# a negative value turns near-duplicate reuse off
+app.config["NEAR_DUPLICATE_DISTANCE"] = int(os.environ.get("NEAR_DUPLICATE_DISTANCE", "4"))
 
 
 @app.context_processor
@@ -35,8 +81,44 @@ def inject_asset_version():
     return {"ASSET_VERSION": app.config.get("ASSET_VERSION", "0")}
 
 
-ensure_directories([UPLOAD_DIR, os.path.join(BASE_DIR, "templates"), os.path.join(BASE_DIR, "static")])
+# Per-request stage timings and the Prometheus /metrics endpoint
+metrics.init_app(app)
+
+
+ensure_directories([UPLOAD_DIR, THUMBNAIL_DIR, os.path.join(BASE_DIR, "templates"), os.path.join(BASE_DIR, "static")])
 initialize_database(DATABASE_PATH)
+result_cache = ResultCache(DATABASE_PATH, capacity=int(os.environ.get("RESULT_CACHE_SIZE", "1024")))
+persister = BackgroundPersister(name="upload-persistence")
+thumbnail_store = ThumbnailStore()
+near_duplicates = NearDuplicateIndex()
+near_duplicates.load(get_perceptual_hashes(DATABASE_PATH))
+atexit.register(persister.close)
+job_queue = JobQueue(
+    DATABASE_PATH,
+    workers=int(os.environ.get("JOB_WORKERS", "2")),
+    max_pending=int(os.environ.get("JOB_MAX_PENDING", "100")),
+)
+decode_executor = ThreadPoolExecutor(max_workers=app.config["BATCH_DECODE_WORKERS"], thread_name_prefix="decode")
+
+
+_preload_names = [n.strip() for n in app.config["PRELOAD_MODELS"].split(",") if n.strip()]
+# With INFERENCE_PROCESSES > 0 the models live in worker processes, which preload them themselves
+inference_pool = start_pool(_preload_names)
+
+
+def _warmup():
+    names = _preload_names
+    try:
+        timings = warmup_models([n for n in names if n != "detector"])
+        if "detector" in names or DETECTOR_NAME in names:
+            timings["detector"] = warmup_detector()
+        app.logger.info("Model preload finished: %s", {k: round(v, 1) for k, v in timings.items()})
+    except Exception:
+        app.logger.exception("Model preload failed")
+
+
+if _preload_names and inference_pool is None:
+    threading.Thread(target=_warmup, name="model-warmup", daemon=True).start()
 
 
 @app.route("/", methods=["GET"])
@@ -46,24 +128,178 @@ def index():
 
 @app.route("/uploads/<path:filename>")
 def uploaded_file(filename: str):
+    if is_content_addressed(filename):
+        if not os.path.exists(os.path.join(UPLOAD_DIR, filename)):
+            # Still queued for the background writer; serve the in-memory copy
+            staged = get_staged_bytes(filename)
+            if staged is not None:
+                mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+                return send_file(io.BytesIO(staged), mimetype=mimetype, max_age=0)
+        # Content-addressed names never change content, so browsers may cache forever
+        response = send_from_directory(UPLOAD_DIR, filename, max_age=UPLOAD_CACHE_MAX_AGE)
+        response.cache_control.immutable = True
+        return response
     return send_from_directory(UPLOAD_DIR, filename)
 
 
-def _save_upload(file_storage):
-    original_filename = secure_filename(file_storage.filename)
-    timestamp = int(time.time())
-    name, ext = os.path.splitext(original_filename)
-    stored_filename = f"{name}-{timestamp}{ext.lower()}"
-    stored_path = os.path.join(app.config["UPLOAD_FOLDER"], stored_filename)
-    file_storage.save(stored_path)
-    return stored_filename, stored_path
+def _open_upload(filename: str):
+    staged = get_staged_bytes(filename)
+    if staged is not None:
+        return Image.open(io.BytesIO(staged))
+    path = safe_join(UPLOAD_DIR, filename)
+    if path is None:
+        raise FileNotFoundError(filename)
+    return Image.open(path)
 
 
-def _perform_prediction(file_storage, model_name: str, top_k: int, min_prob: float):
-    stored_filename, stored_path = _save_upload(file_storage)
+@app.route("/thumbs/<int:width>/<filename>")
+def upload_thumbnail(width: int, filename: str):
+    """WebP thumbnail of an upload, `width` snapped to THUMBNAIL_WIDTHS; generated on first request."""
+    width = snap_width(width)
+    try:
+        with stage("thumbnail"):
+            thumbnail_store.get(filename, width, lambda: _open_upload(filename))
+    except FileNotFoundError:
+        abort(404)
+    except OSError:
+        # Not an image Pillow can read; fall back to the original
+        return redirect(url_for("uploaded_file", filename=filename))
+    if not is_content_addressed(filename):
+        return send_from_directory(THUMBNAIL_DIR, thumbnail_filename(filename, width), max_age=0)
+    # Derived from immutable content: cache for a year, ETag for revalidation
+    response = send_from_directory(THUMBNAIL_DIR, thumbnail_filename(filename, width), max_age=UPLOAD_CACHE_MAX_AGE)
+    response.cache_control.immutable = True
+    return response
+
+
+def _queue_thumbnails(upload) -> None:
+    if app.config["THUMBNAILS_ON_UPLOAD"]:
+        persister.submit(_make_thumbnails, upload)
+
+
+def _make_thumbnails(upload) -> None:
+    try:
+        thumbnail_store.ensure(upload.stored_filename, lambda: open_upload_image(upload))
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        # Not a readable image; the request itself reports the decode error
+        app.logger.warning("No thumbnails for %s: %s", upload.stored_filename, e)
+
 
-    with Image.open(stored_path) as image:
-        predictions = classify_image(image, model_name=model_name, top_k=top_k)
+def _save_upload(file_storage):
+    with stage("save"):
+        return _store_upload(file_storage)
+
+
+def _store_upload(file_storage):
+    if app.config["PERSIST_IN_BACKGROUND"]:
+        upload = stage_upload(file_storage, app.config["UPLOAD_FOLDER"], DATABASE_PATH)
+        persister.submit(persist_upload, upload, DATABASE_PATH)
+    else:
+        upload = save_upload(file_storage, app.config["UPLOAD_FOLDER"], DATABASE_PATH)
+    _queue_thumbnails(upload)
+    return upload
+
+
+def _save_bytes(data: bytes, filename: str):
+    with stage("save"):
+        upload = stage_bytes(data, filename, app.config["UPLOAD_FOLDER"], DATABASE_PATH)
+    if app.config["PERSIST_IN_BACKGROUND"]:
+        persister.submit(persist_upload, upload, DATABASE_PATH)
+    else:
+        persist_upload(upload, DATABASE_PATH)
+    _queue_thumbnails(upload)
+    return upload
+
+
+def _insert_prediction(embedding=None, **kwargs):
+    # The row carries the stage timings collected so far for this request
+    timings = current_timings()
+    kwargs.setdefault("timings", timings.as_dict() if timings is not None else None)
+    endpoint = timings.endpoint if timings is not None else ""
+    model_name = kwargs.get("model_name", "")
+    insert = timed("db_write", insert_prediction, model=model_name, endpoint=endpoint)
+
+    def write():
+        row_id = insert(DATABASE_PATH, **kwargs)
+        if embedding is not None:
+            _index_embeddings(model_name, [row_id], [embedding], endpoint)
+
+    if app.config["PERSIST_IN_BACKGROUND"]:
+        persister.submit(write)
+    else:
+        write()
+
+
+def _insert_predictions(rows, endpoint: str = ""):
+    insert = timed("db_write", insert_predictions, endpoint=endpoint)
+
+    def write():
+        row_ids = insert(DATABASE_PATH, rows)
+        by_model = {}
+        for row_id, row in zip(row_ids, rows):
+            if row.get("embedding") is not None:
+                ids, vectors = by_model.setdefault(row["model_name"], ([], []))
+                ids.append(row_id)
+                vectors.append(row["embedding"])
+        for model_name, (ids, vectors) in by_model.items():
+            _index_embeddings(model_name, ids, vectors, endpoint)
+
+    if app.config["PERSIST_IN_BACKGROUND"]:
+        persister.submit(write)
+    else:
+        write()
+
+
+def _index_embeddings(model_name: str, row_ids, vectors, endpoint: str = "") -> None:
+    # Rows are indexed only after their prediction ids exist, so every id resolves
+    model_name = _resolve_model_name(model_name)
+    add = timed("embedding_index", get_index(model_name).add, model=model_name, endpoint=endpoint)
+    add(row_ids, np.stack(vectors))
+
+
+def _requested_model():
+    # Model names become index file names and DB keys, so only known classifiers are accepted
+    name = request.form.get("model") or request.args.get("model") or "efficientnet_v2_b3"
+    return _resolve_model_name(name) if name in list_available_models() else None
+
+
+def _perform_prediction(file_storage, model_name: str, top_k: int, min_prob: float, reuse: bool = True):
+    upload = _save_upload(file_storage)
+    predictions, reused = _classify_upload(upload, model_name, top_k, min_prob, reuse)
+    return upload.stored_filename, predictions, reused
+
+
+def _near_duplicate_result(upload, phash: int, model_name: str, top_k: int):
+    # Closest earlier upload that already has a result for this model and top_k
+    for _, digest in near_duplicates.find(phash, app.config["NEAR_DUPLICATE_DISTANCE"], exclude=upload.digest):
+        cached = result_cache.get(digest, model_name, top_k)
+        if cached is not None:
+            return cached
+    return None
+
+
+def _classify_upload(upload, model_name: str, top_k: int, min_prob: float, reuse: bool = True):
+    """Predictions for a stored upload and whether they were reused from a near-duplicate image."""
+    cached = result_cache.get(upload.digest, model_name, top_k)
+    embedding = phash = None
+    reused = False
+    if cached is not None:
+        predictions = [(l, float(p)) for (l, p) in cached]
+    else:
+        with stage("decode", model_name), open_upload_image(upload) as source:
+            image = decode_for_inference(source, [get_target_size(model_name)])
+        with stage("phash", model_name):
+            phash = dhash(image)
+        reuse = reuse and app.config["NEAR_DUPLICATE_DISTANCE"] >= 0
+        similar = _near_duplicate_result(upload, phash, model_name, top_k) if reuse else None
+        if similar is not None:
+            predictions = [(l, float(p)) for (l, p) in similar]
+            reused = True
+        else:
+            predictions, embedding = classify_image(image, model_name=model_name, top_k=top_k, return_embedding=True)
+            # Only model output is cached, so an exact-hash hit never serves a borrowed result
+            result_cache.put(upload.digest, model_name, top_k, predictions)
+            near_duplicates.add(phash, upload.digest)
 
     if min_prob > 0:
         predictions = [(l, p) for (l, p) in predictions if p >= min_prob]
@@ -71,23 +307,135 @@ def _perform_prediction(file_storage, model_name: str, top_k: int, min_prob: flo
             predictions = [("No result above threshold", 0.0)]
 
     top1_label, top1_prob = predictions[0]
-    insert_prediction(
-        DATABASE_PATH,
-        filename=stored_filename,
+    _insert_prediction(
+        filename=upload.stored_filename,
         top1_label=top1_label,
         top1_confidence=float(top1_prob),
         predictions=predictions,
         model_name=model_name,
+        original_filename=upload.original_filename,
+        embedding=embedding,
+        phash=phash,
+    )
+
+    return predictions, reused
+
+
+def _perform_detection(file_storage, min_score: float = 0.4, max_results: int = 50, tiled: bool = False):
+    upload = _save_upload(file_storage)
+    return upload.stored_filename, _detect_upload(upload, min_score, max_results, tiled)
+
+
+def _detect_upload(upload, min_score: float, max_results: int, tiled: bool = False):
+    cache_model = f"{DETECTOR_NAME}@{min_score:g}" + ("+tiled" if tiled else "")
+    det = result_cache.get(upload.digest, cache_model, max_results)
+    if det is None:
+        with open_upload_image(upload) as image:
+            det = detect_objects(image, score_threshold=min_score, max_results=max_results, tiled=tiled)
+        result_cache.put(upload.digest, cache_model, max_results, det)
+    return det
+
+
+def _prediction_response(filename: str, model_name: str, predictions, reused: bool = False):
+    return {
+        "filename": filename,
+        "model": model_name,
+        "predictions": [{"label": l, "prob": p} for (l, p) in predictions],
+        "top1": {"label": predictions[0][0], "prob": predictions[0][1]},
+        "reused": reused,
+    }
+
+
+# ---------- Background jobs ----------
+
+
+def _job_upload(payload):
+    return StoredUpload(
+        digest=payload["digest"],
+        stored_filename=payload["filename"],
+        stored_path=os.path.join(app.config["UPLOAD_FOLDER"], payload["filename"]),
+        original_filename=payload["original_filename"],
+        size_bytes=payload["size_bytes"],
+        is_new=False,
     )
 
-    return stored_filename, predictions
+
+def _run_predict_job(payload):
+    upload = _job_upload(payload)
+    with collect("job:predict"):
+        predictions, reused = _classify_upload(
+            upload, payload["model"], payload["top_k"], payload["min_prob"], payload.get("reuse", True)
+        )
+    return _prediction_response(upload.stored_filename, payload["model"], predictions, reused)
+
+
+def _run_detect_job(payload):
+    upload = _job_upload(payload)
+    with collect("job:detect"):
+        det = _detect_upload(upload, payload["min_score"], payload.get("max_results", 50), payload.get("tiled", False))
+    return {"filename": upload.stored_filename, **det}
+
+
+job_queue.register("predict", _run_predict_job)
+job_queue.register("detect", _run_detect_job)
+app.register_blueprint(create_jobs_blueprint(job_queue))
+job_queue.start()
+
+
+def _submit_job(kind: str, payload):
+    # Queued work must survive a restart, so the upload is written synchronously here
+    upload = save_upload(request.files["image"], app.config["UPLOAD_FOLDER"], DATABASE_PATH)
+    _queue_thumbnails(upload)
+    payload = {
+        "digest": upload.digest,
+        "filename": upload.stored_filename,
+        "original_filename": upload.original_filename,
+        "size_bytes": upload.size_bytes,
+        **payload,
+    }
+    try:
+        job_id = job_queue.submit(kind, payload)
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify({
+        "job_id": job_id,
+        "status": "queued",
+        "status_url": url_for("jobs.job_status", job_id=job_id),
+        "events_url": url_for("jobs.job_events", job_id=job_id),
+    }), 202
+
+
+@app.route("/api/jobs/predict", methods=["POST"])
+def api_jobs_predict():
+    if "image" not in request.files:
+        return jsonify({"error": "missing image"}), 400
+    file = request.files["image"]
+    if file.filename == "" or not allowed_file(file.filename):
+        return jsonify({"error": "invalid file"}), 400
+    model_name = _requested_model()
+    if model_name is None:
+        return jsonify({"error": "unknown model", "available": list_available_models()}), 400
+    top_k = int(request.form.get("top_k") or request.args.get("top_k") or 5)
+    min_prob = float(request.form.get("min_prob") or request.args.get("min_prob") or 0)
+    reuse = (request.form.get("reuse") or request.args.get("reuse") or "1") not in ("0", "false", "no")
+    return _submit_job("predict", {
+        "model": model_name,
+        "top_k": max(1, min(top_k, 5)),
+        "min_prob": max(0.0, min(min_prob, 1.0)),
+        "reuse": reuse,
+    })
 
 
-def _perform_detection(file_storage, min_score: float = 0.4):
-    stored_filename, stored_path = _save_upload(file_storage)
-    with Image.open(stored_path) as image:
-        det = detect_objects(image, score_threshold=min_score)
-    return stored_filename, det
+@app.route("/api/jobs/detect", methods=["POST"])
+def api_jobs_detect():
+    if "image" not in request.files:
+        return jsonify({"error": "missing image"}), 400
+    file = request.files["image"]
+    if file.filename == "" or not allowed_file(file.filename):
+        return jsonify({"error": "invalid file"}), 400
+    min_score = float(request.form.get("min_score") or request.args.get("min_score") or 0.35)
+    tiled = (request.form.get("tiled") or request.args.get("tiled")) == "1"
+    return _submit_job("detect", {"min_score": max(0.0, min(min_score, 1.0)), "tiled": tiled})
 
 
 @app.route("/predict", methods=["POST"])
@@ -109,7 +457,7 @@ def predict():
 
     if mode == "detect":
         try:
-            stored_filename, det = _perform_detection(file, min_score=0.35)
+            stored_filename, det = _perform_detection(file, min_score=0.35, tiled=request.form.get("tiled") == "1")
         except Exception:
             flash("Không thể phát hiện vật thể. Vui lòng thử ảnh khác.")
             return redirect(url_for("index"))
@@ -134,7 +482,10 @@ def predict():
             },
         )
 
-    model_name = request.form.get("model") or "efficientnet_v2_b3"
+    model_name = _requested_model()
+    if model_name is None:
+        flash("Mô hình không hợp lệ.")
+        return redirect(url_for("index"))
     try:
         top_k = int(request.form.get("top_k") or 5)
     except Exception:
@@ -145,7 +496,7 @@ def predict():
         min_prob = 0.0
 
     try:
-        stored_filename, predictions = _perform_prediction(file, model_name, max(1, min(top_k, 5)), max(0.0, min(min_prob, 1.0)))
+        stored_filename, predictions, reused = _perform_prediction(file, model_name, max(1, min(top_k, 5)), max(0.0, min(min_prob, 1.0)))
     except Exception:
         flash("Không thể xử lý ảnh. Vui lòng thử ảnh khác.")
         return redirect(url_for("index"))
@@ -160,6 +511,7 @@ def predict():
             "top1_prob": round(float(predictions[0][1]) * 100.0, 2),
             "predictions": [{"label": l, "prob": round(float(p) * 100.0, 2)} for (l, p) in predictions],
             "model": model_name,
+            "reused": reused,
         },
     )
 
@@ -173,7 +525,21 @@ def stats():
             item["predictions"] = json.loads(item.get("predictions_json") or "[]")
         except Exception:
             item["predictions"] = []
-    return render_template("stats.html", label_counts=label_counts, recent=recent)
+        item["timings"] = json.loads(item["timings_json"]) if item.get("timings_json") else None
+    return render_template(
+        "stats.html",
+        label_counts=label_counts,
+        model_stats=get_model_stats(DATABASE_PATH),
+        daily_stats=get_daily_stats(DATABASE_PATH, days=14),
+        recent=recent,
+    )
+
+
+@app.cli.command("rebuild-stats")
+def rebuild_stats_command():
+    """Recompute the /stats aggregate tables from the predictions history."""
+    counts = rebuild_aggregates(DATABASE_PATH)
+    print(", ".join(f"{table}: {n} rows" for table, n in counts.items()))
 
 
 # Simple JSON API
@@ -182,6 +548,112 @@ def api_models():
     return jsonify({"models": list_available_models(), "info": get_model_info()})
 
 
+@app.route("/api/models/resident", methods=["GET"])
+def api_models_resident():
+    return jsonify({"resident": registry.resident(), **registry.stats()})
+
+
+@app.route("/api/workers", methods=["GET"])
+def api_workers():
+    pool = get_pool()
+    return jsonify(pool.stats() if pool is not None else {"processes": 0, "workers": []})
+
+
+@app.route("/api/batching", methods=["GET"])
+def api_batching():
+    return jsonify({"batchers": get_batching_stats()})
+
+
+@app.route("/api/persistence", methods=["GET"])
+def api_persistence():
+    return jsonify({"background": persister.stats(), "db_writers": get_writer_stats()})
+
+
+@app.route("/api/decode", methods=["GET"])
+def api_decode():
+    return jsonify({"formats": get_decode_stats()})
+
+
+@app.route("/api/cache", methods=["GET"])
+def api_cache():
+    return jsonify(result_cache.stats())
+
+
+@app.route("/api/near-duplicates", methods=["GET"])
+def api_near_duplicates():
+    return jsonify({**near_duplicates.stats(), "max_distance": app.config["NEAR_DUPLICATE_DISTANCE"]})
+
+
+@app.route("/api/thumbnails", methods=["GET"])
+def api_thumbnails():
+    return jsonify(thumbnail_store.stats())
+
+
+@app.route("/api/embeddings", methods=["GET"])
+def api_embeddings():
+    return jsonify(list_indexes())
+
+
+@app.route("/api/similar", methods=["GET"])
+def api_similar():
+    """Past uploads nearest to a classified one, searched over stored embeddings only.
+
+    Query: `id` (prediction id) or `filename` (stored upload name), optional
+    `model` to pick the index when looking up by filename, and `k`.
+    """
+    k = max(1, min(request.args.get("k", 10, type=int), 100))
+    prediction_id = request.args.get("id", type=int)
+    filename = request.args.get("filename")
+    if prediction_id is not None:
+        candidates = [prediction_id]
+    elif filename:
+        candidates = get_prediction_ids_for_file(DATABASE_PATH, filename, request.args.get("model"))
+    else:
+        return jsonify({"error": "pass id or filename"}), 400
+    query_rows = get_predictions_by_ids(DATABASE_PATH, candidates)
+
+    # Cached results and ensemble rows have no embedding; use the newest row that has one
+    query, vector = None, None
+    for candidate in candidates:
+        row = query_rows.get(candidate)
+        if row is not None and row["model_name"] in list_available_models():
+            vector = get_index(row["model_name"]).vector(candidate)
+            if vector is not None:
+                query = row
+                break
+    if query is None:
+        return jsonify({"error": "no embedding stored for this upload"}), 404
+
+    model_name = query["model_name"]
+    with stage("similar_search", model_name):
+        # Over-fetch: several hits can be repeat predictions of the same upload
+        hits = get_index(model_name).search(vector, k=k * 4, exclude=[query["id"]])
+    rows = get_predictions_by_ids(DATABASE_PATH, [row_id for row_id, _ in hits])
+    seen = {query["filename"]}
+    results = []
+    for row_id, score in hits:
+        row = rows.get(row_id)
+        if row is None or row["filename"] in seen:
+            continue
+        seen.add(row["filename"])
+        results.append({
+            "id": row_id,
+            "filename": row["filename"],
+            "original_filename": row["original_filename"],
+            "top1_label": row["top1_label"],
+            "score": round(score, 4),
+            "url": url_for("uploaded_file", filename=row["filename"]),
+            "thumbnail_url": url_for("upload_thumbnail", width=snap_width(160), filename=row["filename"]),
+        })
+        if len(results) >= k:
+            break
+    return jsonify({
+        "model": model_name,
+        "query": {"id": query["id"], "filename": query["filename"]},
+        "results": results,
+    })
+
+
 @app.route("/api/predict", methods=["POST"])
 def api_predict():
     if "image" not in request.files:
@@ -190,22 +662,237 @@ def api_predict():
     if file.filename == "" or not allowed_file(file.filename):
         return jsonify({"error": "invalid file"}), 400
 
-    model_name = request.form.get("model") or request.args.get("model") or "efficientnet_v2_b3"
+    model_name = _requested_model()
+    if model_name is None:
+        return jsonify({"error": "unknown model", "available": list_available_models()}), 400
     top_k = int(request.form.get("top_k") or request.args.get("top_k") or 5)
     min_prob = float(request.form.get("min_prob") or request.args.get("min_prob") or 0)
+    # reuse=0 always runs the model, even for a near-duplicate of an earlier upload
+    reuse = (request.form.get("reuse") or request.args.get("reuse") or "1") not in ("0", "false", "no")
 
     try:
-        stored_filename, predictions = _perform_prediction(file, model_name, max(1, min(top_k, 5)), max(0.0, min(min_prob, 1.0)))
+        stored_filename, predictions, reused = _perform_prediction(
+            file, model_name, max(1, min(top_k, 5)), max(0.0, min(min_prob, 1.0)), reuse
+        )
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-    return jsonify({
-        "filename": stored_filename,
-        "model": model_name,
-        "predictions": [{"label": l, "prob": p} for (l, p) in predictions],
-        "top1": {"label": predictions[0][0], "prob": predictions[0][1]},
-    })
+    return jsonify(_prediction_response(stored_filename, model_name, predictions, reused))
+
+
+@app.route("/api/predict/ensemble", methods=["POST"])
+def api_predict_ensemble():
+    if "image" not in request.files:
+        return jsonify({"error": "missing image"}), 400
+    file = request.files["image"]
+    if file.filename == "" or not allowed_file(file.filename):
+        return jsonify({"error": "invalid file"}), 400
+
+    available = list_available_models()
+    requested = request.form.get("models") or request.args.get("models") or ",".join(available)
+    model_names = [m.strip() for m in requested.split(",") if m.strip() in available]
+    if not model_names:
+        return jsonify({"error": "no valid models", "available": available}), 400
+    top_k = max(1, min(int(request.form.get("top_k") or request.args.get("top_k") or 5), 5))
+    merge = (request.form.get("merge") or request.args.get("merge") or "1") not in ("0", "false", "no")
+
+    t0 = time.perf_counter()
+    try:
+        upload = _save_upload(file)
+        with stage("decode"), open_upload_image(upload) as source:
+            image = decode_for_inference(source, [get_target_size(m) for m in model_names])
+        result = classify_ensemble(image, model_names, top_k=top_k, merge=merge)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    shared = current_timings().as_dict()
+    for name, entry in result["models"].items():
+        top1_label, top1_prob = entry["predictions"][0]
+        _insert_prediction(
+            filename=upload.stored_filename,
+            top1_label=top1_label,
+            top1_confidence=float(top1_prob),
+            predictions=entry["predictions"],
+            model_name=name,
+            original_filename=upload.original_filename,
+            timings={**shared, **entry["timings"]},
+        )
+
+    response = {
+        "filename": upload.stored_filename,
+        "models": {
+            name: {
+                "predictions": [{"label": l, "prob": p} for (l, p) in entry["predictions"]],
+                "latency_ms": round(entry["latency_ms"], 2),
+            }
+            for name, entry in result["models"].items()
+        },
+        "total_ms": round((time.perf_counter() - t0) * 1000.0, 2),
+    }
+    if "merged" in result:
+        response["merged"] = [{"label": l, "prob": p} for (l, p) in result["merged"]]
+    return jsonify(response)
+
+
+def _collect_batch_items():
+    """(filename, read) for every image part and every image inside uploaded zip archives.
+
+    `read()` returns the bytes and is called on the decode pool, so zip
+    members are only decompressed while in flight. The request's uploaded
+    files (compressed, within MAX_CONTENT_LENGTH) are copied to memory here
+    because they are closed once the streamed response starts. Zip members
+    are selected by their declared size, which zipfile also enforces when
+    extracting, so no member exceeds MAX_CONTENT_LENGTH and all of them
+    together stay under BATCH_MAX_UNZIPPED_BYTES.
+    """
+    limit = app.config["BATCH_MAX_ITEMS"]
+    max_member = app.config["MAX_CONTENT_LENGTH"]
+    unzipped_budget = app.config["BATCH_MAX_UNZIPPED_BYTES"]
+    items = []
+    for file in request.files.getlist("images") + request.files.getlist("image") + request.files.getlist("archive"):
+        if not file or file.filename == "":
+            continue
+        if file.filename.lower().endswith(".zip"):
+            archive = zipfile.ZipFile(io.BytesIO(file.stream.read()))
+            for info in archive.infolist():
+                if info.is_dir() or not allowed_file(info.filename) or info.file_size > max_member:
+                    continue
+                if info.file_size > unzipped_budget:
+                    return items
+                unzipped_budget -= info.file_size
+                items.append((os.path.basename(info.filename), partial(archive.read, info)))
+                if len(items) >= limit:
+                    return items
+        elif allowed_file(file.filename):
+            items.append((file.filename, io.BytesIO(file.stream.read()).read))
+        if len(items) >= limit:
+            return items
+    return items
+
+
+def _decode_batch_item(item, model_name: str, top_k: int):
+    # Runs on the decode pool: read, store, check the cache, decode and preprocess
+    filename, read = item
+    with collect("api_predict_batch") as timings:
+        upload = _save_bytes(read(), filename)
+        cached = result_cache.get(upload.digest, model_name, top_k)
+        if cached is not None:
+            return upload, None, [(l, float(p)) for (l, p) in cached], timings, None
+        with stage("decode", model_name), open_upload_image(upload) as source:
+            image = decode_for_inference(source, [get_target_size(model_name)])
+        with stage("phash", model_name):
+            phash = dhash(image)
+        return upload, prepare_image(image, model_name), None, timings, phash
+
+
+def _prefetch(fn, items, window: int):
+    # Keep at most `window` decodes in flight so memory stays bounded
+    pending = deque()
+    for item in items:
+        pending.append(decode_executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft()
+    while pending:
+        yield pending.popleft()
+
+
+@app.route("/api/predict/batch", methods=["POST"])
+def api_predict_batch():
+    try:
+        items = _collect_batch_items()
+    except zipfile.BadZipFile:
+        return jsonify({"error": "invalid zip archive"}), 400
+    if not items:
+        return jsonify({"error": "no images"}), 400
+
+    model_name = _requested_model()
+    if model_name is None:
+        return jsonify({"error": "unknown model", "available": list_available_models()}), 400
+    top_k = max(1, min(int(request.form.get("top_k") or request.args.get("top_k") or 5), 5))
+    window = max(1, app.config["BATCH_DECODE_WORKERS"] * 2)
+    db_chunk = max(1, app.config["BATCH_DB_CHUNK"])
+
+    def generate():
+        t0 = time.perf_counter()
+        in_flight = deque()
+        rows = []
+        errors = 0
+
+        def _emit(index, filename, upload, pending, cached, timings, phash, failure=None):
+            nonlocal errors
+            if failure is not None:
+                errors += 1
+                return {"index": index, "filename": filename, "error": str(failure)}
+            embedding = None
+            try:
+                if cached is None:
+                    with collect("api_predict_batch") as result_timings:
+                        predictions = pending.result()
+                    for name, ms in result_timings.stages.items():
+                        timings.add(name, ms)
+                    result_cache.put(upload.digest, model_name, top_k, predictions)
+                    near_duplicates.add(phash, upload.digest)
+                    embedding = pending.embedding
+                else:
+                    predictions = cached
+            except Exception as e:
+                errors += 1
+                return {"index": index, "filename": filename, "error": str(e)}
+            rows.append({
+                "filename": upload.stored_filename,
+                "top1_label": predictions[0][0],
+                "top1_confidence": float(predictions[0][1]),
+                "predictions": predictions,
+                "model_name": model_name,
+                "original_filename": upload.original_filename,
+                "timings": timings.as_dict(),
+                "embedding": embedding,
+                "phash": phash,
+            })
+            if len(rows) >= db_chunk:
+                _insert_predictions(rows[:], endpoint="api_predict_batch")
+                rows.clear()
+            return {
+                "index": index,
+                "filename": filename,
+                "stored_filename": upload.stored_filename,
+                "model": model_name,
+                "cached": cached is not None,
+                "predictions": [{"label": l, "prob": p} for (l, p) in predictions],
+                "top1": {"label": predictions[0][0], "prob": predictions[0][1]},
+            }
+
+        def _drain(max_in_flight: int):
+            # Emit finished results in upload order; block only to stay under max_in_flight
+            while in_flight and (
+                len(in_flight) > max_in_flight or in_flight[0][3] is None or in_flight[0][3].done()
+            ):
+                yield json.dumps(_emit(*in_flight.popleft())) + "\n"
+
+        decoded = _prefetch(lambda item: _decode_batch_item(item, model_name, top_k), items, window)
+        for index, ((filename, _), future) in enumerate(zip(items, decoded)):
+            try:
+                upload, array, cached, timings, phash = future.result()
+                pending = classify_prepared_async(array, model_name=model_name, top_k=top_k) if cached is None else None
+            except Exception as e:
+                # Queued as already finished so it is still emitted in upload order
+                in_flight.append((index, filename, None, None, None, None, None, e))
+            else:
+                in_flight.append((index, filename, upload, pending, cached, timings, phash))
+            yield from _drain(window)
+        yield from _drain(0)
+
+        _insert_predictions(rows, endpoint="api_predict_batch")
+        yield json.dumps({
+            "done": True,
+            "count": len(items),
+            "errors": errors,
+            "model": model_name,
+            "total_ms": round((time.perf_counter() - t0) * 1000.0, 2),
+        }) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5050, debug=True) 
\ No newline at end of file
+    app.run(host="0.0.0.0", port=5050, debug=True) 
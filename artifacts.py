@@ -0,0 +1,39 @@
+import os
+from typing import Optional
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Local model store: "<name>.keras" / "<name>.h5" files or "<name>/" SavedModel directories
+ARTIFACT_DIR = os.environ.get("MODEL_ARTIFACT_DIR", os.path.join(BASE_DIR, "models"))
+# Refuse to download weights when a model has no local artifact (air-gapped nodes)
+OFFLINE = os.environ.get("MODEL_OFFLINE", "0") == "1"
+
+
+class ArtifactMissingError(FileNotFoundError):
+    pass
+
+
+def artifact_path(name: str) -> Optional[str]:
+    """Path of the local artifact for `name`, or None when the store has none."""
+    for candidate in (f"{name}.keras", f"{name}.h5"):
+        path = os.path.join(ARTIFACT_DIR, candidate)
+        if os.path.isfile(path):
+            return path
+    path = os.path.join(ARTIFACT_DIR, name)
+    if os.path.isfile(os.path.join(path, "saved_model.pb")):
+        return path
+    return None
+
+
+def require_download(name: str, source: str) -> None:
+    """Raise instead of fetching `source` when running offline."""
+    if OFFLINE:
+        raise ArtifactMissingError(
+            f"No local artifact for {name!r} in {ARTIFACT_DIR} and MODEL_OFFLINE=1 forbids downloading {source}"
+        )
+
+
+def data_file(filename: str) -> Optional[str]:
+    """Auxiliary file (e.g. the ImageNet class index) shipped alongside the artifacts."""
+    path = os.path.join(ARTIFACT_DIR, filename)
+    return path if os.path.isfile(path) else None
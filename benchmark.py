@@ -0,0 +1,301 @@
+"""Offline benchmark of the prediction and detection pipelines.
+
+Drives app._perform_prediction / app._perform_detection, so requests go
+through the same upload store, result cache, near-duplicate lookup,
+micro-batcher and persister as the HTTP endpoints. Models are stubs
+(default) or randomly initialised, so it needs neither network access nor
+downloaded weights. Stage times are the ones the app itself records; writes
+run inline by default so ``db_write`` is part of each request's stages.
+Results are written as JSON and can be compared against an earlier run with
+--compare.
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+# Set before importing the app: everything below runs against a throwaway
+# artifact store, upload dir, thumbnail/embedding dirs and DB
+_WORKDIR = tempfile.mkdtemp(prefix="image-ai-bench-")
+os.environ["MODEL_ARTIFACT_DIR"] = os.path.join(_WORKDIR, "models")
+os.environ["MODEL_OFFLINE"] = "1"
+os.environ["INFERENCE_PROCESSES"] = "0"
+os.environ["PRELOAD_MODELS"] = ""
+os.environ["UPLOAD_DIR"] = os.path.join(_WORKDIR, "uploads")
+os.environ["DATABASE_PATH"] = os.path.join(_WORKDIR, "bench.sqlite3")
+os.environ["THUMBNAIL_DIR"] = os.path.join(_WORKDIR, "thumbnails")
+os.environ["EMBEDDING_DIR"] = os.path.join(_WORKDIR, "embeddings")
+
+import app
+from detector import DETECTOR_NAME
+from metrics import collect
+from model import _MODEL_SPECS, _compile, _compile_embed, _efficientnet_v2, _mobilenet_v2
+from registry import LoadedModel, registry
+from utils import lazy_import
+
+tf = lazy_import("tensorflow")
+
+FORMATS = {"jpeg": ("JPEG", "jpg"), "png": ("PNG", "png"), "webp": ("WEBP", "webp"), "gif": ("GIF", "gif")}
+
+
+class _StubClassifier:
+    """Deterministic 1000-way classifier; sleeps to emulate a forward pass that releases the GIL."""
+
+    variables: List[Any] = []
+
+    def __init__(self, latency_ms: float) -> None:
+        self._latency_s = latency_ms / 1000.0
+        self._projection = np.random.default_rng(0).standard_normal((3, 1000)).astype(np.float32)
+
+    def __call__(self, batch, training: bool = False) -> np.ndarray:
+        time.sleep(self._latency_s)
+        logits = np.asarray(batch, dtype=np.float32).mean(axis=(1, 2)) @ self._projection
+        exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        return exp / exp.sum(axis=-1, keepdims=True)
+
+
+class _StubDetector:
+    """Returns the TF-Hub detector's output dict with random boxes."""
+
+    variables: List[Any] = []
+
+    def __init__(self, latency_ms: float, detections: int = 100) -> None:
+        self._latency_s = latency_ms / 1000.0
+        self._detections = detections
+
+    def __call__(self, batch) -> Dict[str, Any]:
+        time.sleep(self._latency_s)
+        rng = np.random.default_rng(int(np.asarray(batch)[0, 0, 0, 0]))
+        corners = np.sort(rng.random((1, self._detections, 2, 2)), axis=2).reshape(1, self._detections, 4)
+        scores = np.sort(rng.random((1, self._detections)))[:, ::-1].astype(np.float32)
+        classes = rng.integers(1, 91, (1, self._detections)).astype(np.float32)
+        return {
+            "detection_boxes": tf.constant(corners.astype(np.float32)),
+            "detection_scores": tf.constant(scores),
+            "detection_classes": tf.constant(classes),
+            "num_detections": tf.constant([float(self._detections)]),
+        }
+
+
+def _random_classifier(name: str) -> LoadedModel:
+    builders = {
+        "mobilenet_v2": lambda: _mobilenet_v2.MobileNetV2(weights=None),
+        "efficientnet_v2_b0": lambda: _efficientnet_v2.EfficientNetV2B0(weights=None),
+        "efficientnet_v2_b3": lambda: _efficientnet_v2.EfficientNetV2B3(weights=None),
+    }
+    model = builders[name]()
+    return LoadedModel(model=model, infer=_compile(name, model), embed=_compile_embed(name, model))
+
+
+def _install_models(names: List[str], backend: str, latency_ms: float) -> None:
+    """Point the registry at offline models."""
+    for name in names:
+        if backend == "stub":
+            stub = _StubClassifier(latency_ms)
+            registry.register(name, lambda stub=stub: LoadedModel(model=stub, infer=stub))
+        else:
+            registry.register(name, lambda name=name: _random_classifier(name))
+    # TF-Hub detectors cannot be built without their weights, so detection always uses the stub
+    detector = _StubDetector(latency_ms)
+    registry.register(DETECTOR_NAME, lambda: LoadedModel(model=detector, infer=detector))
+
+
+def _write_class_index() -> None:
+    os.makedirs(os.environ["MODEL_ARTIFACT_DIR"], exist_ok=True)
+    index = {str(i): [f"n{i:08d}", f"class_{i}"] for i in range(1000)}
+    with open(os.path.join(os.environ["MODEL_ARTIFACT_DIR"], "imagenet_class_index.json"), "w") as fh:
+        json.dump(index, fh)
+
+
+def synthetic_image(size: Tuple[int, int], fmt: str, seed: int) -> bytes:
+    """Gradient plus noise, so encoders and decoders do realistic work."""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(0, 255, width, dtype=np.float32)[np.newaxis, :, np.newaxis]
+    pixels = np.clip(gradient + rng.normal(0, 40, (height, width, 3)), 0, 255).astype(np.uint8)
+    image = Image.fromarray(pixels, "RGB")
+    if fmt == "gif":
+        image = image.convert("P", palette=Image.ADAPTIVE)
+    buf = io.BytesIO()
+    image.save(buf, FORMATS[fmt][0])
+    return buf.getvalue()
+
+
+def _unique(data: bytes, n: int) -> bytes:
+    # Trailing bytes are ignored by every decoder but give each request its own
+    # digest, so neither the content-addressed store nor the result cache
+    # short-circuits the pipeline.
+    return data + n.to_bytes(8, "little")
+
+
+def run_classification(data: bytes, filename: str, model_name: str) -> Dict[str, float]:
+    with collect("benchmark") as timings:
+        app._perform_prediction(FileStorage(io.BytesIO(data), filename=filename), model_name, 5, 0.0)
+    return timings.as_dict()
+
+
+def run_detection(data: bytes, filename: str) -> Dict[str, float]:
+    with collect("benchmark") as timings:
+        app._perform_detection(FileStorage(io.BytesIO(data), filename=filename), 0.4, 50)
+    return timings.as_dict()
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "mean": float(np.mean(samples))}
+
+
+def _run_level(task: Callable[[int], Dict[str, float]], requests: int, concurrency: int) -> Dict[str, Any]:
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(task, range(requests)))
+    elapsed = time.perf_counter() - started
+    # Writes queued on the background persister, so they do not leak into the next level
+    drain_started = time.perf_counter()
+    app.persister.drain()
+    drain_ms = (time.perf_counter() - drain_started) * 1000.0
+    # Stages in the order the app recorded them; reused results have no inference stage
+    stages = list(dict.fromkeys(stage for r in results for stage in r if stage != "total"))
+    summary = {stage: _percentiles([r[stage] for r in results if stage in r]) for stage in stages}
+    summary["total"] = _percentiles([r["total"] for r in results])
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "throughput_rps": requests / elapsed,
+        "persist_drain_ms": drain_ms,
+        "stages": summary,
+    }
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    _write_class_index()
+    models = [m for m in args.models.split(",") if m]
+    _install_models(models, args.backend, args.stub_latency_ms)
+    app.app.config["NEAR_DUPLICATE_DISTANCE"] = args.near_duplicate_distance
+    # Background writes are timed on the persister thread, outside the request's Timings
+    app.app.config["PERSIST_IN_BACKGROUND"] = args.persist == "background"
+    sizes = [tuple(int(v) for v in s.split("x")) for s in args.sizes.split(",") if s]
+    formats = [f for f in args.formats.split(",") if f]
+    levels = [int(c) for c in args.concurrency.split(",") if c]
+
+    results: List[Dict[str, Any]] = []
+    counter = itertools.count()
+    for size in sizes:
+        for fmt in formats:
+            data = synthetic_image(size, fmt, seed=size[0] * 31 + size[1])
+            filename = f"bench.{FORMATS[fmt][1]}"
+            pipelines: List[Tuple[str, Callable[[bytes], Dict[str, float]]]] = [
+                (m, lambda d, m=m: run_classification(d, filename, m)) for m in models
+            ]
+            if not args.skip_detector:
+                pipelines.append((DETECTOR_NAME, lambda d: run_detection(d, filename)))
+            for name, pipeline in pipelines:
+                pipeline(_unique(data, next(counter)))  # warm caches and lazy loads outside the measurement
+                for concurrency in levels:
+                    level = _run_level(lambda _i: pipeline(_unique(data, next(counter))), args.requests, concurrency)
+                    level.update({"pipeline": name, "format": fmt, "size": f"{size[0]}x{size[1]}", "bytes": len(data)})
+                    results.append(level)
+                    _print_level(level)
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "backend": args.backend,
+        "stub_latency_ms": args.stub_latency_ms,
+        "near_duplicate_distance": args.near_duplicate_distance,
+        "persist": args.persist,
+        "requests_per_level": args.requests,
+        "results": results,
+    }
+
+
+def _key(level: Dict[str, Any]) -> Tuple[str, str, str, int]:
+    return (level["pipeline"], level["format"], level["size"], level["concurrency"])
+
+
+def _print_level(level: Dict[str, Any]) -> None:
+    stages = level["stages"]
+    parts = "  ".join(f"{s}={v['p50']:.1f}/{v['p95']:.1f}" for s, v in stages.items() if s != "total")
+    print(
+        f"{level['pipeline']:<30}{level['format']:<6}{level['size']:>11} c={level['concurrency']:<3}"
+        f"{level['throughput_rps']:>8.1f} rps  total p50/p95/p99="
+        f"{stages['total']['p50']:.1f}/{stages['total']['p95']:.1f}/{stages['total']['p99']:.1f} ms  [{parts}]"
+        f"  drain={level['persist_drain_ms']:.1f} ms"
+    )
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> int:
+    """Print p50/p95 changes per stage; returns the number of regressions above `threshold` (fraction)."""
+    previous = {_key(level): level for level in baseline["results"]}
+    regressions = 0
+    for level in current["results"]:
+        before = previous.get(_key(level))
+        if before is None:
+            continue
+        for stage, now in level["stages"].items():
+            then = before["stages"].get(stage)
+            if not then or then["p50"] <= 0:
+                continue
+            change = now["p50"] / then["p50"] - 1.0
+            flag = ""
+            if change > threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            if flag or abs(change) > threshold:
+                print(
+                    f"{'/'.join(map(str, _key(level))):<50}{stage:<20}"
+                    f"p50 {then['p50']:.2f} -> {now['p50']:.2f} ms ({change:+.0%}){flag}"
+                )
+    print(f"{regressions} regression(s) above {threshold:.0%}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline per-stage benchmark of the prediction and detection pipelines.")
+    parser.add_argument("--models", default=",".join(_MODEL_SPECS), help="comma-separated classifier names")
+    parser.add_argument("--backend", choices=["stub", "random"], default="stub",
+                        help="stub: numpy classifier; random: Keras architectures with random weights")
+    parser.add_argument("--stub-latency-ms", type=float, default=20.0, help="simulated forward pass time for stub models")
+    parser.add_argument("--skip-detector", action="store_true")
+    parser.add_argument("--near-duplicate-distance", type=int, default=-1,
+                        help="NEAR_DUPLICATE_DISTANCE for the run; the default -1 runs inference for every request")
+    parser.add_argument("--persist", choices=["inline", "background"], default="inline",
+                        help="inline: uploads and DB rows are written in the request, so db_write gets percentiles; "
+                             "background: the app default, reported only as the per-level drain time")
+    parser.add_argument("--sizes", default="320x240,1280x960,4032x3024")
+    parser.add_argument("--formats", default="jpeg,png,webp,gif")
+    parser.add_argument("--concurrency", default="1,4,8")
+    parser.add_argument("--requests", type=int, default=40, help="requests per concurrency level")
+    parser.add_argument("--out", default="benchmark_results.json")
+    parser.add_argument("--compare", help="earlier results file to diff against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative p50 slowdown reported as a regression")
+    args = parser.parse_args()
+
+    try:
+        report = run(args)
+    finally:
+        shutil.rmtree(_WORKDIR, ignore_errors=True)
+    with open(args.out, "w", encoding="utf-8") as fh:
+        json.dump(report, fh, indent=2)
+    print(f"wrote {args.out}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        sys.exit(1 if compare(report, baseline, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import math
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+def tile_grid(width: int, height: int, tile: int, overlap: float) -> np.ndarray:
+    """[T, 4] integer (x0, y0, x1, y1) windows of side `tile` covering a width x height image.
+
+    Neighbouring tiles share `overlap` (a fraction of `tile`); the last row and
+    column are shifted back to end exactly at the image edge rather than padded.
+    A side shorter than `tile` gets a single window spanning it.
+    """
+    stride = max(1, int(round(tile * (1.0 - overlap))))
+
+    def starts(size: int) -> np.ndarray:
+        if size <= tile:
+            return np.zeros(1, dtype=np.int64)
+        count = math.ceil((size - tile) / stride) + 1
+        return np.minimum(np.arange(count, dtype=np.int64) * stride, size - tile)
+
+    xs, ys = starts(width), starts(height)
+    x0, y0 = np.meshgrid(xs, ys)
+    x0, y0 = x0.ravel(), y0.ravel()
+    return np.stack([x0, y0, np.minimum(x0 + tile, width), np.minimum(y0 + tile, height)], axis=1)
+
+
+def batched(windows: np.ndarray, size: int) -> Iterator[np.ndarray]:
+    for start in range(0, len(windows), max(1, size)):
+        yield windows[start:start + size]
+
+
+def nms(
+    boxes: np.ndarray,
+    scores: np.ndarray,
+    iou_threshold: float,
+    classes: Optional[np.ndarray] = None,
+    max_output: Optional[int] = None,
+) -> np.ndarray:
+    """Indices of the boxes kept by greedy non-maximum suppression, highest score first.
+
+    `boxes` is [N, 4] (x0, y0, x1, y1). When `classes` is given, boxes only
+    suppress boxes of the same class: each class is shifted to its own disjoint
+    region so one pass handles every class. Each step computes the IoU of the
+    current best box against all remaining boxes at once.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float64).reshape(-1)
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    if classes is not None:
+        span = boxes.max() - min(boxes.min(), 0.0) + 1.0
+        boxes = boxes + (np.asarray(classes, dtype=np.float64).reshape(-1, 1) * span)
+    areas = np.clip(boxes[:, 2] - boxes[:, 0], 0, None) * np.clip(boxes[:, 3] - boxes[:, 1], 0, None)
+    order = np.argsort(-scores, kind="stable")
+    keep: List[int] = []
+    while order.size:
+        best = order[0]
+        keep.append(int(best))
+        if max_output is not None and len(keep) >= max_output:
+            break
+        rest = order[1:]
+        ix0 = np.maximum(boxes[best, 0], boxes[rest, 0])
+        iy0 = np.maximum(boxes[best, 1], boxes[rest, 1])
+        ix1 = np.minimum(boxes[best, 2], boxes[rest, 2])
+        iy1 = np.minimum(boxes[best, 3], boxes[rest, 3])
+        inter = np.clip(ix1 - ix0, 0, None) * np.clip(iy1 - iy0, 0, None)
+        iou = inter / np.maximum(areas[best] + areas[rest] - inter, 1e-9)
+        order = rest[iou <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def capped_size(width: int, height: int, max_side: int) -> Tuple[int, int]:
+    """(width, height) scaled down, keeping aspect ratio, so neither side exceeds `max_side`."""
+    longest = max(width, height)
+    if max_side <= 0 or longest <= max_side:
+        return width, height
+    scale = max_side / longest
+    return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
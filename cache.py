@@ -0,0 +1,76 @@
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from database import get_cached_result, put_cached_result
+
+
+CacheKey = Tuple[str, str, int]
+
+
+class ResultCache:
+    """Two-level cache of inference results keyed by (sha256 of upload, model_name, top_k).
+
+    The first level is an in-process LRU; misses fall through to the
+    ``prediction_cache`` table so results survive restarts. Writes update the
+    LRU immediately and reach the table through the background writer.
+    """
+
+    def __init__(self, db_path: str, capacity: int = 1024) -> None:
+        self._db_path = db_path
+        self._capacity = max(0, int(capacity))
+        self._entries: "OrderedDict[CacheKey, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+
+    def get(self, digest: str, model_name: str, top_k: int) -> Optional[Any]:
+        key = (digest, model_name, int(top_k))
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._memory_hits += 1
+                return self._entries[key]
+
+        raw = get_cached_result(self._db_path, *key)
+        if raw is None:
+            with self._lock:
+                self._misses += 1
+            return None
+
+        value = json.loads(raw)
+        with self._lock:
+            self._disk_hits += 1
+            self._remember(key, value)
+        return value
+
+    def put(self, digest: str, model_name: str, top_k: int, value: Any) -> None:
+        key = (digest, model_name, int(top_k))
+        raw = json.dumps(value)
+        # Store the JSON round-tripped form so memory and disk hits look the same
+        with self._lock:
+            self._remember(key, json.loads(raw))
+        put_cached_result(self._db_path, *key, raw)
+
+    def _remember(self, key: CacheKey, value: Any) -> None:
+        if self._capacity == 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._capacity:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self._memory_hits + self._disk_hits
+            lookups = hits + self._misses
+            return {
+                "capacity": self._capacity,
+                "size": len(self._entries),
+                "memory_hits": self._memory_hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "hit_rate": (hits / lookups) if lookups else 0.0,
+            }
@@ -0,0 +1,32 @@
+import argparse
+import os
+from collections import defaultdict
+
+from imaging import measure_decode_savings
+from utils import allowed_file
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare full-resolution decoding with decode-time downscaling per image format.")
+    parser.add_argument("directory", nargs="?", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads"))
+    parser.add_argument("--size", type=int, default=300, help="largest model input side (e.g. 224 or 300)")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    per_format = defaultdict(list)
+    for name in sorted(os.listdir(args.directory)):
+        if not allowed_file(name):
+            continue
+        r = measure_decode_savings(os.path.join(args.directory, name), [(args.size, args.size)], runs=args.runs)
+        per_format[r["format"]].append(r)
+
+    print(f"{'format':<8}{'files':>7}{'full (ms)':>12}{'reduced (ms)':>14}{'saved':>9}")
+    for fmt, rows in sorted(per_format.items()):
+        full = sum(r["full_ms"] for r in rows) / len(rows)
+        reduced = sum(r["reduced_ms"] for r in rows) / len(rows)
+        saved = (1.0 - reduced / full) * 100.0 if full > 0 else 0.0
+        print(f"{fmt:<8}{len(rows):>7}{full:>12.2f}{reduced:>14.2f}{saved:>8.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+import argparse
+
+from detector import compare_detector_latency
+from model import compare_inference_latency, list_available_models
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare model.predict/eager latency against the compiled inference path.")
+    parser.add_argument("--models", default=",".join(list_available_models()), help="comma-separated model names")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--skip-detector", action="store_true")
+    args = parser.parse_args()
+
+    print(f"{'model':<22}{'before (ms)':>14}{'after (ms)':>14}{'speedup':>10}")
+    rows = [(name, compare_inference_latency(name, runs=args.runs)) for name in args.models.split(",") if name]
+    if not args.skip_detector:
+        rows.append(("ssd_mobilenet_v2", compare_detector_latency(runs=args.runs)))
+    for name, r in rows:
+        print(f"{name:<22}{r['before_ms']:>14.2f}{r['after_ms']:>14.2f}{r['speedup']:>9.2f}x")
+
+
+if __name__ == "__main__":
+    main()
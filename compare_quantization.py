@@ -0,0 +1,26 @@
+import argparse
+
+from model import _MODEL_SPECS, compare_engines
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare quantized TFLite engines against the Keras model per classifier.")
+    parser.add_argument("--models", default=",".join(_MODEL_SPECS), help="comma-separated model names")
+    parser.add_argument("--engines", default="tflite_dynamic,tflite_int8")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--images", type=int, default=200, help="max stored uploads used for calibration + evaluation")
+    args = parser.parse_args()
+
+    engines = tuple(e for e in args.engines.split(",") if e)
+    print(f"{'model':<22}{'engine':<16}{'latency (ms)':>14}{'size (MB)':>12}{'RSS +MB':>10}{'top-1 agree':>13}")
+    for name in [n for n in args.models.split(",") if n]:
+        report = compare_engines(name, engines, runs=args.runs, eval_limit=args.images)
+        images = report.pop("images")
+        for engine, r in report.items():
+            rss = "n/a" if r["rss_mb"] is None else f"{r['rss_mb']:.1f}"
+            print(f"{name:<22}{engine:<16}{r['latency_ms']:>14.2f}{r['model_mb']:>12.1f}{rss:>10}{r['top1_agreement'] * 100:>12.1f}%")
+        print(f"{'':<22}({images['calibration']} calibration / {images['evaluation']} evaluation images)")
+
+
+if __name__ == "__main__":
+    main()
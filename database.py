@@ -1,15 +1,267 @@
+import atexit
 import json
+import logging
+import os
+import queue
 import sqlite3
+import threading
+from concurrent.futures import Future
 from datetime import datetime
-from typing import List, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 
-def _connect(db_path: str) -> sqlite3.Connection:
-    connection = sqlite3.connect(db_path)
+logger = logging.getLogger(__name__)
+
+# Applied to every connection. WAL lets readers proceed while the writer
+# commits; synchronous=NORMAL is durable across app crashes in WAL mode.
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+WRITER_MAX_BATCH = int(os.environ.get("DB_WRITER_MAX_BATCH", "256"))
+
+_local = threading.local()
+
+
+def _open(db_path: str, isolation_level: Optional[str] = "") -> sqlite3.Connection:
+    connection = sqlite3.connect(db_path, timeout=5.0, isolation_level=isolation_level)
     connection.row_factory = sqlite3.Row
+    for pragma in _PRAGMAS:
+        connection.execute(pragma)
+    return connection
+
+
+def get_connection(db_path: str) -> sqlite3.Connection:
+    """Connection owned by the calling thread, opened once per (thread, database)."""
+    connections: Dict[str, sqlite3.Connection] = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    connection = connections.get(db_path)
+    if connection is None:
+        connection = connections[db_path] = _open(db_path)
     return connection
 
 
+def _connect(db_path: str) -> sqlite3.Connection:
+    return get_connection(db_path)
+
+
+_STOP = object()
+
+
+class DatabaseWriter:
+    """Single thread that owns all writes to one database file.
+
+    Operations are callables taking a connection. Whatever is queued when the
+    thread wakes up (up to WRITER_MAX_BATCH) runs in one transaction, each
+    inside its own savepoint so one failing operation does not undo the rest.
+    """
+
+    def __init__(self, db_path: str, max_batch: int = WRITER_MAX_BATCH) -> None:
+        self._db_path = db_path
+        self._max_batch = max(1, int(max_batch))
+        self._queue: "queue.Queue[Any]" = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=f"db-writer-{os.path.basename(db_path)}", daemon=True)
+        self._stats_lock = threading.Lock()
+        self._transactions = 0
+        self._operations = 0
+        self._closed = False
+        self._thread.start()
+
+    def submit(self, op: Callable[[sqlite3.Connection], Any]) -> "Future[Any]":
+        future: "Future[Any]" = Future()
+        if self._closed:
+            # Late writes during interpreter shutdown run inline on the caller's connection
+            try:
+                with get_connection(self._db_path) as conn:
+                    future.set_result(op(conn))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        self._queue.put((op, future))
+        return future
+
+    def run(self, op: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Queue an operation and wait for its transaction to commit; returns the op's result."""
+        return self.submit(op).result()
+
+    def execute(self, sql: str, params: tuple = ()) -> int:
+        return self.run(lambda conn: conn.execute(sql, params).lastrowid)
+
+    def executemany(self, sql: str, seq_of_params: List[tuple]) -> None:
+        self.run(lambda conn: conn.executemany(sql, seq_of_params))
+
+    def _run(self) -> None:
+        # Autocommit mode: transactions are opened and committed explicitly below
+        conn = _open(self._db_path, isolation_level=None)
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while len(batch) < self._max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if any(item is _STOP for item in batch):
+                batch = [item for item in batch if item is not _STOP]
+                stopping = True
+            self._apply(conn, batch)
+        conn.close()
+
+    def _apply(self, conn: sqlite3.Connection, batch: List[Any]) -> None:
+        if not batch:
+            return
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for op, _ in batch:
+                conn.execute("SAVEPOINT op")
+                try:
+                    outcomes.append((True, op(conn)))
+                    conn.execute("RELEASE op")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    outcomes.append((False, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            logger.exception("Write transaction on %s failed", self._db_path)
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            outcomes = [(False, e)] * len(batch)
+        for (_, future), (ok, value) in zip(batch, outcomes):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+        with self._stats_lock:
+            self._transactions += 1
+            self._operations += len(batch)
+
+    def close(self, timeout: float = 10.0) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "queued": self._queue.qsize(),
+                "transactions": self._transactions,
+                "operations": self._operations,
+                "mean_ops_per_transaction": (self._operations / self._transactions) if self._transactions else 0.0,
+            }
+
+
+_writers: Dict[str, DatabaseWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(db_path: str) -> DatabaseWriter:
+    writer = _writers.get(db_path)
+    if writer is None:
+        with _writers_lock:
+            writer = _writers.get(db_path)
+            if writer is None:
+                writer = _writers[db_path] = DatabaseWriter(db_path)
+    return writer
+
+
+def get_writer_stats() -> Dict[str, Dict[str, Any]]:
+    with _writers_lock:
+        return {os.path.basename(path): writer.stats() for path, writer in _writers.items()}
+
+
+@atexit.register
+def _close_writers() -> None:
+    with _writers_lock:
+        writers = list(_writers.values())
+    for writer in writers:
+        writer.close()
+
+
+# Aggregate tables maintained by triggers on predictions: (table, key column, expression over a predictions row)
+_AGGREGATES = (
+    ("label_stats", "label", "{row}.top1_label"),
+    ("model_stats", "model_name", "COALESCE({row}.model_name, 'unknown')"),
+    ("daily_stats", "day", "substr({row}.created_at, 1, 10)"),
+)
+
+
+def _create_aggregates(conn: sqlite3.Connection) -> bool:
+    """Create aggregate tables and their triggers; True if the tables did not exist yet."""
+    existing = {
+        row[0]
+        for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+    }
+    created = False
+    for table, key, expr in _AGGREGATES:
+        created = created or table not in existing
+        conn.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                {key} TEXT PRIMARY KEY,
+                count INTEGER NOT NULL,
+                confidence_sum REAL NOT NULL
+            )
+            """
+        )
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_count ON {table}(count DESC, {key})")
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_insert AFTER INSERT ON predictions
+            BEGIN
+                INSERT INTO {table} ({key}, count, confidence_sum)
+                VALUES ({expr.format(row="NEW")}, 1, NEW.top1_confidence)
+                ON CONFLICT({key}) DO UPDATE SET
+                    count = count + 1,
+                    confidence_sum = confidence_sum + excluded.confidence_sum;
+            END
+            """
+        )
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_delete AFTER DELETE ON predictions
+            BEGIN
+                UPDATE {table}
+                SET count = count - 1, confidence_sum = confidence_sum - OLD.top1_confidence
+                WHERE {key} = {expr.format(row="OLD")};
+                DELETE FROM {table} WHERE {key} = {expr.format(row="OLD")} AND count <= 0;
+            END
+            """
+        )
+    return created
+
+
+def _backfill_aggregates(conn: sqlite3.Connection) -> None:
+    for table, key, expr in _AGGREGATES:
+        conn.execute(f"DELETE FROM {table}")
+        conn.execute(
+            f"""
+            INSERT INTO {table} ({key}, count, confidence_sum)
+            SELECT {expr.format(row="p")}, COUNT(*), SUM(p.top1_confidence)
+            FROM predictions AS p
+            GROUP BY 1
+            """
+        )
+
+
+def rebuild_aggregates(db_path: str) -> Dict[str, int]:
+    """Recompute every aggregate table from the predictions history; returns row counts per table."""
+    get_writer(db_path).run(_backfill_aggregates)
+    with _connect(db_path) as conn:
+        return {
+            table: int(conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0])
+            for table, _, _ in _AGGREGATES
+        }
+
+
 def initialize_database(db_path: str) -> None:
     with _connect(db_path) as conn:
         conn.execute(
@@ -29,6 +281,43 @@ def initialize_database(db_path: str) -> None:
         col_names = {c[1] for c in cols}
         if "model_name" not in col_names:
             conn.execute("ALTER TABLE predictions ADD COLUMN model_name TEXT DEFAULT 'unknown'")
+        if "original_filename" not in col_names:
+            conn.execute("ALTER TABLE predictions ADD COLUMN original_filename TEXT")
+        if "timings_json" not in col_names:
+            conn.execute("ALTER TABLE predictions ADD COLUMN timings_json TEXT")
+        if "phash" not in col_names:
+            conn.execute("ALTER TABLE predictions ADD COLUMN phash INTEGER")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS uploads (
+                digest TEXT PRIMARY KEY,
+                stored_filename TEXT NOT NULL,
+                original_filename TEXT NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                upload_count INTEGER NOT NULL DEFAULT 1,
+                created_at TEXT NOT NULL,
+                last_seen_at TEXT NOT NULL
+            );
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS prediction_cache (
+                digest TEXT NOT NULL,
+                model_name TEXT NOT NULL,
+                top_k INTEGER NOT NULL,
+                result_json TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                PRIMARY KEY (digest, model_name, top_k)
+            );
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_predictions_created_at ON predictions(created_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_predictions_model_name ON predictions(model_name)")
+        # Similar-image lookups start from an upload's latest prediction
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_predictions_filename ON predictions(filename, id)")
+        if _create_aggregates(conn):
+            _backfill_aggregates(conn)
         conn.commit()
 
 
@@ -39,43 +328,213 @@ def insert_prediction(
     top1_confidence: float,
     predictions: List[Tuple[str, float]],
     model_name: str,
-) -> None:
+    original_filename: Optional[str] = None,
+    timings: Optional[Dict[str, float]] = None,
+    phash: Optional[int] = None,
+) -> int:
+    return insert_predictions(
+        db_path,
+        [
+            {
+                "filename": filename,
+                "top1_label": top1_label,
+                "top1_confidence": top1_confidence,
+                "predictions": predictions,
+                "model_name": model_name,
+                "original_filename": original_filename,
+                "timings": timings,
+                "phash": phash,
+            }
+        ],
+    )[0]
+
+
+def insert_predictions(db_path: str, rows: List[dict]) -> List[int]:
+    """Insert many prediction rows (insert_prediction keyword dicts) in one transaction; returns their ids."""
+    if not rows:
+        return []
     created_at = datetime.utcnow().isoformat(timespec="seconds") + "Z"
-    predictions_json = json.dumps([{"label": l, "prob": p} for (l, p) in predictions])
+    params = [
+        (
+            row["filename"],
+            row["top1_label"],
+            float(row["top1_confidence"]),
+            json.dumps([{"label": l, "prob": p} for (l, p) in row["predictions"]]),
+            created_at,
+            row["model_name"],
+            row.get("original_filename"),
+            json.dumps(row["timings"]) if row.get("timings") else None,
+            _to_signed64(row["phash"]) if row.get("phash") is not None else None,
+        )
+        for row in rows
+    ]
+    sql = """
+        INSERT INTO predictions (
+            filename, top1_label, top1_confidence, predictions_json, created_at, model_name, original_filename,
+            timings_json, phash
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+
+    def insert(conn: sqlite3.Connection) -> List[int]:
+        conn.executemany(sql, params)
+        # Rows of one executemany inside the writer's transaction get consecutive ids
+        last = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        return list(range(last - len(params) + 1, last + 1))
+
+    return get_writer(db_path).run(insert)
+
+
+def _to_signed64(value: int) -> int:
+    # SQLite integers are signed 64-bit; 64-bit hashes are stored two's-complement
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def get_perceptual_hashes(db_path: str) -> List[Tuple[int, str]]:
+    """Distinct (perceptual hash, upload digest) pairs of past predictions."""
     with _connect(db_path) as conn:
-        conn.execute(
+        rows = conn.execute(
             """
-            INSERT INTO predictions (filename, top1_label, top1_confidence, predictions_json, created_at, model_name)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            (filename, top1_label, float(top1_confidence), predictions_json, created_at, model_name),
-        )
-        conn.commit()
+            SELECT DISTINCT p.phash, u.digest
+            FROM predictions p
+            JOIN uploads u ON u.stored_filename = p.filename
+            WHERE p.phash IS NOT NULL
+            """
+        ).fetchall()
+        return [(int(row[0]) & 0xFFFFFFFFFFFFFFFF, row[1]) for row in rows]
 
 
 def get_label_counts(db_path: str) -> List[Tuple[str, int]]:
     with _connect(db_path) as conn:
         rows = conn.execute(
             """
-            SELECT top1_label, COUNT(*) AS cnt
-            FROM predictions
-            GROUP BY top1_label
-            ORDER BY cnt DESC, top1_label ASC
+            SELECT label, count
+            FROM label_stats
+            ORDER BY count DESC, label ASC
             LIMIT 50
             """
         ).fetchall()
-        return [(row["top1_label"], int(row["cnt"])) for row in rows]
+        return [(row["label"], int(row["count"])) for row in rows]
+
+
+def get_model_stats(db_path: str) -> List[dict]:
+    with _connect(db_path) as conn:
+        rows = conn.execute(
+            """
+            SELECT model_name, count, confidence_sum / count AS mean_confidence
+            FROM model_stats
+            ORDER BY count DESC, model_name ASC
+            """
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def get_daily_stats(db_path: str, days: int = 30) -> List[dict]:
+    with _connect(db_path) as conn:
+        rows = conn.execute(
+            """
+            SELECT day, count, confidence_sum / count AS mean_confidence
+            FROM daily_stats
+            ORDER BY day DESC
+            LIMIT ?
+            """,
+            (days,),
+        ).fetchall()
+        return [dict(row) for row in rows]
 
 
 def get_recent_predictions(db_path: str, limit: int = 20):
     with _connect(db_path) as conn:
         rows = conn.execute(
             """
-            SELECT filename, top1_label, top1_confidence, predictions_json, created_at, model_name
+            SELECT filename, original_filename, top1_label, top1_confidence, predictions_json, created_at, model_name,
+                   timings_json
             FROM predictions
             ORDER BY id DESC
             LIMIT ?
             """,
             (limit,),
         ).fetchall()
-        return [dict(row) for row in rows] 
\ No newline at end of file
+        return [dict(row) for row in rows] 
+
+
+def get_predictions_by_ids(db_path: str, ids: List[int]) -> Dict[int, dict]:
+    if not ids:
+        return {}
+    with _connect(db_path) as conn:
+        rows = conn.execute(
+            f"""
+            SELECT id, filename, original_filename, top1_label, top1_confidence, created_at, model_name
+            FROM predictions
+            WHERE id IN ({",".join("?" * len(ids))})
+            """,
+            [int(i) for i in ids],
+        ).fetchall()
+        return {int(row["id"]): dict(row) for row in rows}
+
+
+def get_prediction_ids_for_file(db_path: str, filename: str, model_name: Optional[str] = None, limit: int = 50) -> List[int]:
+    """Ids of the predictions made for a stored upload, newest first."""
+    with _connect(db_path) as conn:
+        if model_name:
+            rows = conn.execute(
+                "SELECT id FROM predictions WHERE filename = ? AND model_name = ? ORDER BY id DESC LIMIT ?",
+                (filename, model_name, limit),
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT id FROM predictions WHERE filename = ? ORDER BY id DESC LIMIT ?", (filename, limit)
+            ).fetchall()
+        return [int(row["id"]) for row in rows]
+
+
+def get_cached_result(db_path: str, digest: str, model_name: str, top_k: int) -> Optional[str]:
+    with _connect(db_path) as conn:
+        row = conn.execute(
+            "SELECT result_json FROM prediction_cache WHERE digest = ? AND model_name = ? AND top_k = ?",
+            (digest, model_name, int(top_k)),
+        ).fetchone()
+        return row["result_json"] if row is not None else None
+
+
+def put_cached_result(db_path: str, digest: str, model_name: str, top_k: int, result_json: str) -> "Future[Any]":
+    """Queue the cache row on the writer without waiting for it to commit."""
+    created_at = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+    params = (digest, model_name, int(top_k), result_json, created_at)
+    future = get_writer(db_path).submit(
+        lambda conn: conn.execute(
+            """
+            INSERT OR REPLACE INTO prediction_cache (digest, model_name, top_k, result_json, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            params,
+        )
+    )
+    future.add_done_callback(_log_cache_write_failure)
+    return future
+
+
+def _log_cache_write_failure(future: "Future[Any]") -> None:
+    if future.exception() is not None:
+        logger.warning("Could not store cached result: %s", future.exception())
+
+
+def get_upload(db_path: str, digest: str) -> Optional[dict]:
+    with _connect(db_path) as conn:
+        row = conn.execute("SELECT * FROM uploads WHERE digest = ?", (digest,)).fetchone()
+        return dict(row) if row is not None else None
+
+
+def record_upload(db_path: str, digest: str, stored_filename: str, original_filename: str, size_bytes: int) -> None:
+    now = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+    get_writer(db_path).execute(
+        """
+        INSERT INTO uploads (digest, stored_filename, original_filename, size_bytes, created_at, last_seen_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT(digest) DO UPDATE SET
+            stored_filename = excluded.stored_filename,
+            upload_count = upload_count + 1,
+            last_seen_at = excluded.last_seen_at
+        """,
+        (digest, stored_filename, original_filename, int(size_bytes), now, now),
+    )
@@ -1,15 +1,42 @@
-from typing import List, Dict
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Dict, Sequence, Tuple
 
 import numpy as np
-import tensorflow as tf
-import tensorflow_hub as hub
 from PIL import Image
 
+from artifacts import artifact_path, require_download
+from boxes import batched, capped_size, nms, tile_grid
+from imaging import decode_for_inference
+from metrics import observe_stage, stage
+from registry import LoadedModel, registry
+from utils import lazy_import
+from workers import get_pool
+
+tf = lazy_import("tensorflow")
+hub = lazy_import("tensorflow_hub")
+
 
 # COCO labels for SSD MobileNet V2 from TF Hub (91 indexed to 90; model returns indices)
 # We'll load from the model signature's class labels when possible; fallback hardcoded short list.
 
-_DETECTOR = None
+DETECTOR_NAME = "ssd_mobilenet_v2_fpnlite_640"
+DETECTOR_URL = "https://tfhub.dev/tensorflow/ssd_mobilenet_v2/fpnlite_640x640/1"
+# The FPNLite preprocessor resizes every input to a fixed 640x640 without
+# keeping aspect ratio, so feeding it exactly that loses nothing.
+DETECTOR_INPUT_SIZE = (640, 640)
+
+# Tiled mode: overlapping TILE_SIZE windows of the source, decoded at most
+# TILE_MAX_SIDE on its longest side, with TILE_BATCH tiles in memory at a time.
+# Only JPEGs decode at reduced size; sources that would decode to more than
+# TILE_MAX_PIXELS are refused, which bounds peak memory.
+TILE_SIZE = int(os.environ.get("DETECT_TILE_SIZE", "640"))
+TILE_OVERLAP = float(os.environ.get("DETECT_TILE_OVERLAP", "0.2"))
+TILE_BATCH = int(os.environ.get("DETECT_TILE_BATCH", "8"))
+TILE_MAX_SIDE = int(os.environ.get("DETECT_TILE_MAX_SIDE", "4096"))
+TILE_NMS_IOU = float(os.environ.get("DETECT_TILE_NMS_IOU", "0.5"))
+TILE_MAX_PIXELS = int(os.environ.get("DETECT_TILE_MAX_PIXELS", str(80_000_000)))
 
 # COCO 2017 label map (subset with holes kept as dict)
 _COCO_LABELS: Dict[int, str] = {
@@ -27,46 +54,277 @@ _COCO_LABELS: Dict[int, str] = {
 }
 
 
+# Vectorised class-id -> label lookup; ids without a COCO name map to "id <n>"
+_LABEL_LUT = np.array(
+    [_COCO_LABELS.get(i, f"id {i}") for i in range(max(_COCO_LABELS) + 1)], dtype=object
+)
+
+
 def _load_detector():
-    global _DETECTOR
-    if _DETECTOR is None:
-        # SSD MobileNet V2 FPNLite 640x640
-        _DETECTOR = hub.load("https://tfhub.dev/tensorflow/ssd_mobilenet_v2/fpnlite_640x640/1")
-    return _DETECTOR
+    # SSD MobileNet V2 FPNLite 640x640, from the local artifact store when present
+    path = artifact_path(DETECTOR_NAME)
+    if path is None:
+        require_download(DETECTOR_NAME, DETECTOR_URL)
+        path = DETECTOR_URL
+    return hub.load(path)
+
 
+def _compile_detector(model) -> Callable:
+    # Inputs are pre-resized to DETECTOR_INPUT_SIZE, so the whole signature is static.
+    # The hub model only accepts a batch of one.
+    width, height = DETECTOR_INPUT_SIZE
 
-def detect_objects(image: Image.Image, score_threshold: float = 0.4, max_results: int = 50) -> Dict:
+    @tf.function(input_signature=[tf.TensorSpec(shape=[1, height, width, 3], dtype=tf.uint8)])
+    def detect(input_tensor):
+        return model(input_tensor)
+
+    return detect
+
+
+def _load_detector_entry() -> LoadedModel:
     model = _load_detector()
+    return LoadedModel(model=model, infer=_compile_detector(model))
 
-    rgb = image.convert("RGB")
-    img_arr = np.array(rgb)
-    input_tensor = tf.convert_to_tensor(img_arr, dtype=tf.uint8)
-    input_tensor = input_tensor[tf.newaxis, ...]
 
-    outputs = model(input_tensor)
-    # outputs: dict with 'detection_boxes', 'detection_scores', 'detection_classes', 'num_detections'
-    boxes = outputs["detection_boxes"][0].numpy()  # yMin, xMin, yMax, xMax (normalized)
-    scores = outputs["detection_scores"][0].numpy()
-    classes = outputs["detection_classes"][0].numpy().astype(np.int32)
+registry.register(DETECTOR_NAME, _load_detector_entry)
+
+
+def _get_detect_fn() -> Callable:
+    return registry.get(DETECTOR_NAME).infer
+
+
+def warmup_detector() -> float:
+    t0 = time.perf_counter()
+    width, height = DETECTOR_INPUT_SIZE
+    _get_detect_fn()(tf.zeros([1, height, width, 3], dtype=tf.uint8))
+    return (time.perf_counter() - t0) * 1000.0
+
+
+def compare_detector_latency(runs: int = 10) -> Dict[str, float]:
+    """Median latency (ms) of the eager hub call vs the compiled detect function."""
+    loaded = registry.get(DETECTOR_NAME)
+    model, detect = loaded.model, loaded.infer
+    width, height = DETECTOR_INPUT_SIZE
+    input_tensor = tf.convert_to_tensor(np.random.randint(0, 255, (1, height, width, 3), dtype=np.uint8))
+
+    def _median_ms(fn: Callable) -> float:
+        fn(input_tensor)
+        samples = []
+        for _ in range(max(1, runs)):
+            t0 = time.perf_counter()
+            fn(input_tensor)
+            samples.append((time.perf_counter() - t0) * 1000.0)
+        return float(np.median(samples))
+
+    before = _median_ms(model)
+    after = _median_ms(detect)
+    return {"before_ms": before, "after_ms": after, "speedup": before / after if after > 0 else 0.0}
+
+
+def _prepare(image: Image.Image) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """640x640 uint8 input plus the original (width, height).
+
+    Large JPEGs are decoded at reduced resolution and other formats are
+    reduced before RGB conversion, so a multi-megapixel upload never becomes a
+    full-size array.
+    """
+    original_size = image.size
+    rgb = decode_for_inference(image, [DETECTOR_INPUT_SIZE])
+    if rgb.size != DETECTOR_INPUT_SIZE:
+        rgb = rgb.resize(DETECTOR_INPUT_SIZE, Image.BILINEAR)
+    return np.asarray(rgb, dtype=np.uint8), original_size
+
+
+def _postprocess(
+    boxes: np.ndarray,
+    scores: np.ndarray,
+    classes: np.ndarray,
+    sizes: Sequence[Tuple[int, int]],
+    score_threshold: float,
+    max_results: int,
+) -> List[Dict]:
+    """Threshold, denormalise and label [N, K] detector outputs for N images at once."""
+    boxes = boxes[:, :max_results]
+    scores = scores[:, :max_results]
+    classes = classes[:, :max_results].astype(np.int64)
+
+    # yMin, xMin, yMax, xMax -> xMin, yMin, xMax, yMax (normalised)
+    boxn = boxes[..., [1, 0, 3, 2]].astype(np.float64)
+    scale = np.array([[w, h, w, h] for (w, h) in sizes], dtype=np.float64)[:, np.newaxis, :]
+    box_px = (boxn * scale).astype(np.int64)
+    in_lut = (classes >= 0) & (classes < len(_LABEL_LUT))
+    labels = np.where(in_lut, _LABEL_LUT[np.clip(classes, 0, len(_LABEL_LUT) - 1)], None)
+    keep = scores >= score_threshold
 
-    h, w = img_arr.shape[:2]
     results = []
-    for i in range(min(len(scores), max_results)):
-        if scores[i] < score_threshold:
-            continue
-        y_min, x_min, y_max, x_max = boxes[i]
-        # normalized box (0-1)
-        boxn = [float(x_min), float(y_min), float(x_max), float(y_max)]
-        # pixel box
-        box_px = [int(x_min * w), int(y_min * h), int(x_max * w), int(y_max * h)]  # x1,y1,x2,y2
-        class_id = int(classes[i])
-        label = _COCO_LABELS.get(class_id, f"id {class_id}")
+    for n, (w, h) in enumerate(sizes):
+        k = keep[n]
+        cls = classes[n][k]
+        lbl = labels[n][k]
         results.append({
-            "box": box_px,
-            "boxn": boxn,
-            "score": float(scores[i]),
-            "class_id": class_id,
-            "label": label,
+            "detections": [
+                {
+                    "box": b,
+                    "boxn": bn,
+                    "score": sc,
+                    "class_id": c,
+                    "label": l if l is not None else f"id {c}",
+                }
+                for b, bn, sc, c, l in zip(
+                    box_px[n][k].tolist(),
+                    boxn[n][k].tolist(),
+                    scores[n][k].astype(np.float64).tolist(),
+                    cls.tolist(),
+                    lbl.tolist(),
+                )
+            ],
+            "width": w,
+            "height": h,
         })
+    return results
+
+
+def local_forward(batch: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Boxes, scores and classes for a [1, 640, 640, 3] uint8 batch, run in this process."""
+    # outputs: dict with 'detection_boxes', 'detection_scores', 'detection_classes', 'num_detections'
+    outputs = _get_detect_fn()(tf.convert_to_tensor(batch))
+    return (
+        outputs["detection_boxes"].numpy(),
+        outputs["detection_scores"].numpy(),
+        outputs["detection_classes"].numpy(),
+    )
+
+
+def _forward() -> Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    pool = get_pool()
+    if pool is None:
+        return local_forward
+    return lambda batch: pool.run("detect", DETECTOR_NAME, batch)
+
+
+def detect_objects_batch(
+    images: Sequence[Image.Image], score_threshold: float = 0.4, max_results: int = 50
+) -> List[Dict]:
+    if not images:
+        return []
+    forward = _forward()
+
+    with stage("decode", DETECTOR_NAME):
+        prepared = [_prepare(image) for image in images]
+    boxes, scores, classes = [], [], []
+    with stage("inference", DETECTOR_NAME):
+        for arr, _ in prepared:
+            b, s, c = forward(arr[np.newaxis, ...])
+            boxes.append(b)
+            scores.append(s)
+            classes.append(c)
+
+    with stage("postprocess", DETECTOR_NAME):
+        return _postprocess(
+            np.concatenate(boxes),
+            np.concatenate(scores),
+            np.concatenate(classes),
+            [size for _, size in prepared],
+            score_threshold,
+            max_results,
+        )
+
+
+def _letterbox(tile: Image.Image) -> Tuple[np.ndarray, Tuple[float, float]]:
+    """Detector input with `tile` scaled to fit and padded at the right and bottom.
+
+    Also returns the (width, height) in tile pixels that the whole input spans,
+    for mapping normalised boxes back.
+    """
+    in_w, in_h = DETECTOR_INPUT_SIZE
+    scale = min(in_w / tile.width, in_h / tile.height)
+    size = (max(1, min(in_w, round(tile.width * scale))), max(1, min(in_h, round(tile.height * scale))))
+    canvas = np.zeros((in_h, in_w, 3), dtype=np.uint8)
+    scaled = tile if tile.size == size else tile.resize(size, Image.BILINEAR)
+    canvas[: size[1], : size[0]] = np.asarray(scaled, dtype=np.uint8)
+    return canvas, (in_w / scale, in_h / scale)
+
+
+def detect_objects_tiled(image: Image.Image, score_threshold: float = 0.4, max_results: int = 50) -> Dict:
+    """Detect on overlapping tiles so small objects in large images keep their resolution.
+
+    The image is decoded once at no more than TILE_MAX_SIDE on its longest
+    side (ValueError above TILE_MAX_PIXELS), then cut into TILE_SIZE windows
+    overlapping by TILE_OVERLAP plus one whole-image window for objects larger
+    than a tile. Windows are scaled and padded to the model input without
+    changing their aspect ratio. Only TILE_BATCH tiles are materialised at a
+    time; with inference workers a batch runs on as many workers as serve the
+    detector. Boxes are mapped back to image coordinates and merged with
+    class-aware NMS.
+    """
+    original_w, original_h = image.size
+    with stage("decode", DETECTOR_NAME):
+        target = capped_size(original_w, original_h, TILE_MAX_SIDE)
+        rgb = decode_for_inference(image, [target], max_pixels=TILE_MAX_PIXELS)
+        if rgb.size != target:
+            rgb = rgb.resize(target, Image.BILINEAR)
+    width, height = rgb.size
+    if width <= TILE_SIZE and height <= TILE_SIZE:
+        result = detect_objects_batch([rgb], score_threshold=score_threshold, max_results=max_results)[0]
+        return {**result, "tiles": 1}
+
+    windows = np.concatenate([[[0, 0, width, height]], tile_grid(width, height, TILE_SIZE, TILE_OVERLAP)])
+    forward = _forward()
+    pool = get_pool()
+    workers = pool.capacity(DETECTOR_NAME) if pool is not None else 1
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="detect-tile") if workers > 1 else None
+
+    tile_s = infer_s = 0.0
+    found_boxes, found_scores, found_classes = [], [], []
+    try:
+        for batch in batched(windows, TILE_BATCH):
+            t0 = time.perf_counter()
+            inputs = [_letterbox(rgb.crop(tuple(int(v) for v in w))) for w in batch]
+            arrays = [array[np.newaxis, ...] for array, _ in inputs]
+            t1 = time.perf_counter()
+            outputs = list(executor.map(forward, arrays)) if executor is not None else [forward(a) for a in arrays]
+            t2 = time.perf_counter()
+            tile_s += t1 - t0
+            infer_s += t2 - t1
+            del arrays
+            for window, (_, span), (b, sc, c) in zip(batch, inputs, outputs):
+                keep = sc[0] >= score_threshold
+                # Normalised yMin, xMin, yMax, xMax within the padded input -> x0, y0, x1, y1 in
+                # decoded pixels, clipped to the window so nothing reaches into the padding
+                offset = np.array([window[0], window[1]] * 2, dtype=np.float64)
+                mapped = b[0][keep][:, [1, 0, 3, 2]].astype(np.float64) * np.array(span * 2) + offset
+                found_boxes.append(np.clip(mapped, offset, np.array([window[2], window[3]] * 2, dtype=np.float64)))
+                found_scores.append(sc[0][keep].astype(np.float64))
+                found_classes.append(c[0][keep].astype(np.int64))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    observe_stage("tile", tile_s, DETECTOR_NAME)
+    observe_stage("inference", infer_s, DETECTOR_NAME)
+
+    with stage("postprocess", DETECTOR_NAME):
+        boxes = np.concatenate(found_boxes)
+        scores = np.concatenate(found_scores)
+        classes = np.concatenate(found_classes)
+        keep = nms(boxes, scores, TILE_NMS_IOU, classes=classes, max_output=max_results)
+        boxn = boxes[keep] / np.array([width, height, width, height], dtype=np.float64)
+        box_px = (boxn * np.array([original_w, original_h, original_w, original_h], dtype=np.float64)).astype(np.int64)
+        detections = [
+            {
+                "box": b,
+                "boxn": bn,
+                "score": sc,
+                "class_id": c,
+                "label": _LABEL_LUT[c] if 0 <= c < len(_LABEL_LUT) else f"id {c}",
+            }
+            for b, bn, sc, c in zip(box_px.tolist(), boxn.tolist(), scores[keep].tolist(), classes[keep].tolist())
+        ]
+    return {"detections": detections, "width": original_w, "height": original_h, "tiles": len(windows)}
+
 
-    return {"detections": results, "width": w, "height": h} 
\ No newline at end of file
+def detect_objects(
+    image: Image.Image, score_threshold: float = 0.4, max_results: int = 50, tiled: bool = False
+) -> Dict:
+    if tiled:
+        return detect_objects_tiled(image, score_threshold=score_threshold, max_results=max_results)
+    return detect_objects_batch([image], score_threshold=score_threshold, max_results=max_results)[0]
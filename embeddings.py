@@ -0,0 +1,148 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EMBEDDING_DIR = os.environ.get("EMBEDDING_DIR", os.path.join(BASE_DIR, "embeddings"))
+# Rows scored per matrix-vector product during a search
+SEARCH_CHUNK_ROWS = int(os.environ.get("EMBEDDING_SEARCH_CHUNK_ROWS", "65536"))
+
+
+class EmbeddingIndex:
+    """Append-only similar-image index for one model's embeddings.
+
+    Vectors are L2-normalised and stored as float16 rows of a raw matrix
+    (`<model>.f16`) that searches read through np.memmap; `<model>.ids` holds
+    the matching `predictions` row ids as int64, row for row. A search is an
+    exact cosine-similarity scan done as chunked matrix-vector products, so
+    only one chunk is converted to float32 at a time. Assumes one process
+    appends to the files.
+    """
+
+    def __init__(self, model_name: str, directory: str = EMBEDDING_DIR) -> None:
+        if not model_name or model_name.startswith(".") or os.path.basename(model_name) != model_name:
+            raise ValueError(f"invalid model name for an embedding index: {model_name!r}")
+        self.model_name = model_name
+        self._vectors_path = os.path.join(directory, f"{model_name}.f16")
+        self._ids_path = os.path.join(directory, f"{model_name}.ids")
+        self._meta_path = os.path.join(directory, f"{model_name}.json")
+        self._lock = threading.Lock()
+        self._dim: Optional[int] = None
+        self._rows = 0
+        self._mapped: Optional[Tuple[int, np.memmap, np.memmap]] = None
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path, "r", encoding="utf-8") as fh:
+                self._dim = int(json.load(fh)["dim"])
+            self._rows = self._repair()
+
+    def _repair(self) -> int:
+        # An interrupted append can leave one file a row ahead of the other; drop the partial row
+        rows = min(
+            os.path.getsize(self._vectors_path) // (self._dim * 2) if os.path.exists(self._vectors_path) else 0,
+            os.path.getsize(self._ids_path) // 8 if os.path.exists(self._ids_path) else 0,
+        )
+        for path, row_bytes in ((self._vectors_path, self._dim * 2), (self._ids_path, 8)):
+            with open(path, "ab") as fh:
+                fh.truncate(rows * row_bytes)
+        return rows
+
+    def __len__(self) -> int:
+        return self._rows
+
+    def add(self, ids: Sequence[int], vectors: np.ndarray) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), -1)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        rows = (vectors / np.maximum(norms, 1e-12)).astype(np.float16)
+        with self._lock:
+            if self._dim is None:
+                self._dim = rows.shape[1]
+                with open(self._meta_path, "w", encoding="utf-8") as fh:
+                    json.dump({"model": self.model_name, "dim": self._dim}, fh)
+            elif rows.shape[1] != self._dim:
+                raise ValueError(f"{self.model_name} embeddings have {self._dim} dims, got {rows.shape[1]}")
+            with open(self._vectors_path, "ab") as fh:
+                fh.write(rows.tobytes())
+            with open(self._ids_path, "ab") as fh:
+                fh.write(np.asarray(ids, dtype=np.int64).tobytes())
+            self._rows += len(ids)
+
+    def _view(self) -> Tuple[int, Optional[np.memmap], Optional[np.memmap]]:
+        """Read-only maps of the committed rows, remapped only after the index grows."""
+        with self._lock:
+            rows = self._rows
+            mapped = self._mapped
+            if rows == 0:
+                return 0, None, None
+            if mapped is None or mapped[0] != rows:
+                mapped = (
+                    rows,
+                    np.memmap(self._vectors_path, dtype=np.float16, mode="r", shape=(rows, self._dim)),
+                    np.memmap(self._ids_path, dtype=np.int64, mode="r", shape=(rows,)),
+                )
+                self._mapped = mapped
+        return mapped
+
+    def vector(self, prediction_id: int) -> Optional[np.ndarray]:
+        rows, vectors, ids = self._view()
+        if rows == 0:
+            return None
+        hits = np.flatnonzero(ids == prediction_id)
+        return np.asarray(vectors[hits[-1]], dtype=np.float32) if hits.size else None
+
+    def search(self, query: np.ndarray, k: int = 10, exclude: Sequence[int] = ()) -> List[Tuple[int, float]]:
+        """Up to `k` (prediction id, cosine similarity) pairs, most similar first."""
+        rows, vectors, ids = self._view()
+        if rows == 0:
+            return []
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        # Over-fetch so excluded ids do not leave the result short
+        want = min(rows, k + len(exclude))
+        best_ids = np.zeros(0, dtype=np.int64)
+        best_scores = np.zeros(0, dtype=np.float32)
+        for start in range(0, rows, SEARCH_CHUNK_ROWS):
+            scores = np.asarray(vectors[start:start + SEARCH_CHUNK_ROWS], dtype=np.float32) @ query
+            top = np.argpartition(-scores, want - 1)[:want] if len(scores) > want else np.arange(len(scores))
+            best_ids = np.concatenate([best_ids, np.asarray(ids[start + top])])
+            best_scores = np.concatenate([best_scores, scores[top]])
+            if len(best_scores) > want:
+                keep = np.argpartition(-best_scores, want - 1)[:want]
+                best_ids, best_scores = best_ids[keep], best_scores[keep]
+        order = np.argsort(-best_scores, kind="stable")
+        excluded = set(int(i) for i in exclude)
+        results = [(int(best_ids[i]), float(best_scores[i])) for i in order if int(best_ids[i]) not in excluded]
+        return results[:k]
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "rows": self._rows,
+            "dim": self._dim,
+            "bytes": self._rows * (self._dim or 0) * 2,
+        }
+
+
+_indexes: Dict[str, EmbeddingIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(model_name: str) -> EmbeddingIndex:
+    with _indexes_lock:
+        index = _indexes.get(model_name)
+        if index is None:
+            index = _indexes[model_name] = EmbeddingIndex(model_name)
+        return index
+
+
+def list_indexes() -> Dict[str, Dict[str, object]]:
+    """Stats of every index on disk, opening the ones not used yet."""
+    names = set()
+    if os.path.isdir(EMBEDDING_DIR):
+        names = {n[: -len(".json")] for n in os.listdir(EMBEDDING_DIR) if n.endswith(".json")}
+    with _indexes_lock:
+        names |= set(_indexes)
+    return {name: get_index(name).stats() for name in sorted(names)}
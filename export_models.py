@@ -0,0 +1,37 @@
+import argparse
+import os
+import shutil
+
+from artifacts import ARTIFACT_DIR
+from detector import DETECTOR_NAME, DETECTOR_URL
+from model import FLOWER_MODEL_URL, _MODEL_SPECS, hub, tf
+
+IMAGENET_CLASS_INDEX_URL = "https://storage.googleapis.com/download.tensorflow.org/data/imagenet_class_index.json"
+HUB_MODELS = {"flowers_v1": FLOWER_MODEL_URL, DETECTOR_NAME: DETECTOR_URL}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Download every model once and write it to the local artifact store.")
+    parser.add_argument("--out", default=ARTIFACT_DIR, help="artifact directory (MODEL_ARTIFACT_DIR)")
+    parser.add_argument("--models", default=",".join([*_MODEL_SPECS, *HUB_MODELS]), help="comma-separated model names")
+    args = parser.parse_args()
+    os.makedirs(args.out, exist_ok=True)
+
+    for name in [n for n in args.models.split(",") if n]:
+        if name in _MODEL_SPECS:
+            path = os.path.join(args.out, f"{name}.keras")
+            _MODEL_SPECS[name].loader().save(path)
+        elif name in HUB_MODELS:
+            path = os.path.join(args.out, name)
+            shutil.copytree(hub.resolve(HUB_MODELS[name]), path, dirs_exist_ok=True)
+        else:
+            print(f"skip unknown model {name}")
+            continue
+        print(f"{name:<30}{path}")
+
+    index = tf.keras.utils.get_file("imagenet_class_index.json", IMAGENET_CLASS_INDEX_URL, cache_subdir="models")
+    shutil.copy(index, os.path.join(args.out, "imagenet_class_index.json"))
+
+
+if __name__ == "__main__":
+    main()
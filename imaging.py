@@ -0,0 +1,137 @@
+import threading
+import time
+from typing import Any, Dict, Iterable, Tuple
+
+from PIL import Image
+
+
+# Modes Image.reduce() handles directly; anything else is converted to RGB first
+_REDUCIBLE_MODES = {"L", "LA", "RGB", "RGBA", "RGBX", "CMYK", "I", "F"}
+
+_stats: Dict[str, Dict[str, float]] = {}
+_stats_lock = threading.Lock()
+
+
+def _largest_size(sizes: Iterable[Tuple[int, int]]) -> Tuple[int, int]:
+    sizes = list(sizes)
+    return (max(w for w, _ in sizes), max(h for _, h in sizes))
+
+
+def decode_for_inference(image: Image.Image, sizes: Iterable[Tuple[int, int]], max_pixels: int = 0) -> Image.Image:
+    """Decode a lazily opened image at the smallest resolution that still covers every target size.
+
+    JPEGs use draft mode, so libjpeg's DCT scaling decodes at 1/2, 1/4 or 1/8
+    of the native resolution. Other formats are decoded fully and then
+    box-reduced by an integer factor before RGB conversion, which keeps the
+    later resize cheap. The result is an RGB image at least as large as the
+    largest requested size in both dimensions.
+
+    Only JPEG decoding itself can be scaled down; with `max_pixels` set, an
+    image that would still be decoded at more pixels than that raises
+    ValueError before any pixel data is read, which bounds peak memory.
+    """
+    target_w, target_h = _largest_size(sizes)
+    fmt = (image.format or "unknown").upper()
+    source_w, source_h = image.size
+
+    t0 = time.perf_counter()
+    reduced = False
+    if fmt == "JPEG":
+        if image.draft("RGB", (target_w, target_h)) is not None:
+            reduced = image.size != (source_w, source_h)
+    if max_pixels > 0 and image.size[0] * image.size[1] > max_pixels:
+        raise ValueError(f"{fmt} image of {source_w}x{source_h} is too large to decode (limit {max_pixels} pixels)")
+    image.load()
+    if fmt != "JPEG":
+        factor = min(source_w // max(1, target_w), source_h // max(1, target_h))
+        if factor >= 2:
+            if image.mode not in _REDUCIBLE_MODES:
+                image = image.convert("RGB")
+            image = image.reduce(factor)
+            reduced = True
+    rgb = image.convert("RGB") if image.mode != "RGB" else image
+    elapsed_ms = (time.perf_counter() - t0) * 1000.0
+
+    _record(fmt, elapsed_ms, reduced, source_w * source_h, rgb.size[0] * rgb.size[1])
+    return rgb
+
+
+def dhash(image: Image.Image, size: int = 8) -> int:
+    """64-bit difference hash (for size 8) of an image: one bit per horizontally adjacent pixel pair.
+
+    The image is box-averaged down to (size + 1) x size grey levels, so
+    resizing and re-compression barely change the bits while a different
+    picture flips about half of them.
+    """
+    small = image.resize((size + 1, size), Image.BOX).convert("L")
+    pixels = small.tobytes()
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] < pixels[offset + col + 1])
+    return value
+
+
+def _record(fmt: str, elapsed_ms: float, reduced: bool, source_pixels: int, decoded_pixels: int) -> None:
+    with _stats_lock:
+        entry = _stats.setdefault(
+            fmt, {"images": 0, "reduced": 0, "decode_ms": 0.0, "source_pixels": 0, "decoded_pixels": 0}
+        )
+        entry["images"] += 1
+        entry["reduced"] += int(reduced)
+        entry["decode_ms"] += elapsed_ms
+        entry["source_pixels"] += source_pixels
+        entry["decoded_pixels"] += decoded_pixels
+
+
+def get_decode_stats() -> Dict[str, Dict[str, Any]]:
+    with _stats_lock:
+        snapshot = {fmt: dict(entry) for fmt, entry in _stats.items()}
+    report = {}
+    for fmt, entry in snapshot.items():
+        images = entry["images"]
+        report[fmt] = {
+            "images": images,
+            "reduced": entry["reduced"],
+            "mean_decode_ms": entry["decode_ms"] / images if images else 0.0,
+            "mean_source_megapixels": entry["source_pixels"] / images / 1e6 if images else 0.0,
+            "mean_decoded_megapixels": entry["decoded_pixels"] / images / 1e6 if images else 0.0,
+            "pixel_reduction": 1.0 - (entry["decoded_pixels"] / entry["source_pixels"]) if entry["source_pixels"] else 0.0,
+        }
+    return report
+
+
+def measure_decode_savings(path: str, sizes: Iterable[Tuple[int, int]], runs: int = 5) -> Dict[str, Any]:
+    """Time a full-resolution decode + RGB convert against decode_for_inference for one file."""
+    sizes = list(sizes)
+
+    def _full() -> None:
+        with Image.open(path) as im:
+            im.convert("RGB")
+
+    def _reduced() -> None:
+        with Image.open(path) as im:
+            decode_for_inference(im, sizes)
+
+    def _median_ms(fn) -> float:
+        samples = []
+        for _ in range(max(1, runs)):
+            t0 = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - t0) * 1000.0)
+        samples.sort()
+        return samples[len(samples) // 2]
+
+    with Image.open(path) as im:
+        fmt = (im.format or "unknown").upper()
+        size = im.size
+    full_ms = _median_ms(_full)
+    reduced_ms = _median_ms(_reduced)
+    return {
+        "format": fmt,
+        "size": size,
+        "full_ms": full_ms,
+        "reduced_ms": reduced_ms,
+        "saved_ms": full_ms - reduced_ms,
+    }
@@ -0,0 +1,215 @@
+import json
+import logging
+import queue
+import threading
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from flask import Blueprint, Response, jsonify, stream_with_context
+
+from database import get_connection, get_writer
+
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("succeeded", "failed")
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+def _now() -> str:
+    return datetime.utcnow().isoformat(timespec="seconds") + "Z"
+
+
+class JobQueue:
+    """SQLite-backed job queue served by a fixed pool of worker threads.
+
+    Jobs are rows in a ``jobs`` table, so anything queued or interrupted while
+    running is picked up again by ``start()`` after a restart. Handlers are
+    registered per job kind, receive the JSON payload and return a
+    JSON-serialisable result.
+    """
+
+    def __init__(self, db_path: str, workers: int = 2, max_pending: int = 100) -> None:
+        self._db_path = db_path
+        self._workers = max(1, int(workers))
+        self._max_pending = max(1, int(max_pending))
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._handlers: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+        self._threads: List[threading.Thread] = []
+        self._changed = threading.Condition()
+        self._version = 0  # bumped under _changed after every committed status change
+        self._start_lock = threading.Lock()
+        self._init_db()
+
+    def _init_db(self) -> None:
+        with get_connection(self._db_path) as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    payload_json TEXT NOT NULL,
+                    result_json TEXT,
+                    error TEXT,
+                    created_at TEXT NOT NULL,
+                    started_at TEXT,
+                    finished_at TEXT
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, created_at)")
+            conn.commit()
+
+    def register(self, kind: str, handler: Callable[[Dict[str, Any]], Any]) -> None:
+        self._handlers[kind] = handler
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._threads:
+                return
+            # Jobs that were running when the process died are retried from scratch
+            get_writer(self._db_path).execute("UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running'")
+            with get_connection(self._db_path) as conn:
+                rows = conn.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at, rowid").fetchall()
+            for row in rows:
+                self._queue.put(row["id"])
+            for i in range(self._workers):
+                thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, kind: str, payload: Dict[str, Any]) -> str:
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind '{kind}'")
+        if self._queue.qsize() >= self._max_pending:
+            raise QueueFullError("Job queue is full, try again later")
+        job_id = uuid.uuid4().hex
+        get_writer(self._db_path).execute(
+            "INSERT INTO jobs (id, kind, status, payload_json, created_at) VALUES (?, ?, 'queued', ?, ?)",
+            (job_id, kind, json.dumps(payload), _now()),
+        )
+        self._queue.put(job_id)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with get_connection(self._db_path) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "result": json.loads(row["result_json"]) if row["result_json"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "started_at": row["started_at"],
+            "finished_at": row["finished_at"],
+        }
+
+    def version(self) -> int:
+        """Change counter to read before ``get()`` and pass to ``wait_for_change``."""
+        with self._changed:
+            return self._version
+
+    def wait_for_change(self, since: int, timeout: float) -> bool:
+        """Block until a job changes status after version `since`; False if the timeout elapsed first."""
+        with self._changed:
+            return self._changed.wait_for(lambda: self._version != since, timeout)
+
+    def _set_status(self, job_id: str, sql: str, params: tuple) -> None:
+        get_writer(self._db_path).execute(sql, params + (job_id,))
+        with self._changed:
+            self._version += 1
+            self._changed.notify_all()
+
+    def _run(self) -> None:
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._execute(job_id)
+            except Exception:
+                logger.exception("Job %s crashed", job_id)
+            finally:
+                self._queue.task_done()
+
+    def _execute(self, job_id: str) -> None:
+        with get_connection(self._db_path) as conn:
+            row = conn.execute("SELECT kind, status, payload_json FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or row["status"] != "queued":
+            return
+        self._set_status(job_id, "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ?", (_now(),))
+        try:
+            handler = self._handlers[row["kind"]]
+            result = handler(json.loads(row["payload_json"]))
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job_id, row["kind"])
+            self._set_status(
+                job_id,
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?",
+                (str(e), _now()),
+            )
+            return
+        self._set_status(
+            job_id,
+            "UPDATE jobs SET status = 'succeeded', result_json = ?, finished_at = ? WHERE id = ?",
+            (json.dumps(result), _now()),
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        with get_connection(self._db_path) as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS cnt FROM jobs GROUP BY status").fetchall()
+        return {
+            "workers": self._workers,
+            "pending": self._queue.qsize(),
+            "max_pending": self._max_pending,
+            "by_status": {row["status"]: int(row["cnt"]) for row in rows},
+        }
+
+
+def create_jobs_blueprint(job_queue: JobQueue, keepalive_s: float = 15.0) -> Blueprint:
+    """Routes for polling a job (GET /api/jobs/<id>) and following it via server-sent events."""
+    bp = Blueprint("jobs", __name__)
+
+    @bp.get("/api/jobs")
+    def jobs_stats():
+        return jsonify(job_queue.stats())
+
+    @bp.get("/api/jobs/<job_id>")
+    def job_status(job_id: str):
+        job = job_queue.get(job_id)
+        if job is None:
+            return jsonify({"error": "Not found"}), 404
+        return jsonify(job)
+
+    @bp.get("/api/jobs/<job_id>/events")
+    def job_events(job_id: str):
+        if job_queue.get(job_id) is None:
+            return jsonify({"error": "Not found"}), 404
+
+        def generate():
+            last_status = None
+            while True:
+                # Read the version first so a change landing after get() still wakes the wait
+                version = job_queue.version()
+                job = job_queue.get(job_id)
+                if job["status"] != last_status:
+                    last_status = job["status"]
+                    yield f"event: {last_status}\ndata: {json.dumps(job)}\n\n"
+                if last_status in TERMINAL_STATUSES:
+                    return
+                if not job_queue.wait_for_change(version, keepalive_s):
+                    yield ": keep-alive\n\n"
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+
+    return bp
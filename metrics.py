@@ -0,0 +1,167 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from flask import Flask, Response, g, request
+
+
+# Histogram bucket upper bounds, in seconds (Prometheus convention)
+BUCKETS: Tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram keyed by a fixed set of label names."""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...], buckets: Tuple[float, ...] = BUCKETS) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # labels -> bucket counts + [sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name) or "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted(self._series.items())
+            series = [(key, list(values)) for key, values in series]
+        for key, values in series:
+            labels = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, key))
+            sep = "," if labels else ""
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound:g}"}} {int(count)}')
+            lines.append(f'{self.name}_bucket{{{labels}{sep}le="+Inf"}} {int(values[-1])}')
+            lines.append(f"{self.name}_sum{{{labels}}} {values[-2]:.6f}")
+            lines.append(f"{self.name}_count{{{labels}}} {int(values[-1])}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+STAGE_SECONDS = Histogram(
+    "image_ai_stage_duration_seconds", "Time spent in one pipeline stage.", ("stage", "model", "endpoint")
+)
+REQUEST_SECONDS = Histogram(
+    "image_ai_request_duration_seconds", "HTTP request latency.", ("endpoint", "method", "status")
+)
+
+
+class Timings:
+    """Stage durations (ms) collected for one request or job, stored with its result row."""
+
+    def __init__(self, endpoint: str = "") -> None:
+        self.endpoint = endpoint
+        self.stages: Dict[str, float] = {}
+        self._started = time.perf_counter()
+
+    def add(self, stage: str, ms: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + ms
+
+    def as_dict(self) -> Dict[str, float]:
+        out = {stage: round(ms, 2) for stage, ms in self.stages.items()}
+        out["total"] = round((time.perf_counter() - self._started) * 1000.0, 2)
+        return out
+
+
+_current: "contextvars.ContextVar[Optional[Timings]]" = contextvars.ContextVar("timings", default=None)
+
+
+def current_timings() -> Optional[Timings]:
+    return _current.get()
+
+
+def observe_stage(stage: str, seconds: float, model: str = "", endpoint: Optional[str] = None) -> None:
+    timings = _current.get()
+    if endpoint is None:
+        endpoint = timings.endpoint if timings is not None else ""
+    STAGE_SECONDS.observe(seconds, stage=stage, model=model, endpoint=endpoint)
+    if timings is not None:
+        timings.add(stage, seconds * 1000.0)
+
+
+@contextmanager
+def stage(name: str, model: str = "") -> Iterator[None]:
+    """Time the block into the stage histogram and the current request's Timings."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - t0, model)
+
+
+@contextmanager
+def collect(endpoint: str) -> Iterator[Timings]:
+    """Collect stage timings outside a Flask request, e.g. in a job worker."""
+    timings = Timings(endpoint)
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+def timed(stage_name: str, fn: Callable[..., Any], model: str = "", endpoint: str = "") -> Callable[..., Any]:
+    """Wrap `fn` so calls are recorded as `stage_name`; for work handed to background threads."""
+
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            observe_stage(stage_name, time.perf_counter() - t0, model, endpoint)
+
+    return wrapper
+
+
+def render() -> str:
+    return "\n".join([*STAGE_SECONDS.render(), *REQUEST_SECONDS.render()]) + "\n"
+
+
+def init_app(app: Flask) -> None:
+    """Time every request and serve the histograms at /metrics in Prometheus text format."""
+
+    @app.before_request
+    def _start_timings() -> None:
+        g._metrics_token = _current.set(Timings(request.endpoint or "unknown"))
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response: Response) -> Response:
+        started = g.pop("_metrics_started", None)
+        if started is not None:
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - started,
+                endpoint=request.endpoint or "unknown",
+                method=request.method,
+                status=str(response.status_code),
+            )
+        return response
+
+    @app.teardown_request
+    def _reset_timings(_exc: Optional[BaseException]) -> None:
+        token = g.pop("_metrics_token", None)
+        if token is not None:
+            try:
+                _current.reset(token)
+            except ValueError:  # streamed responses finish in a different context
+                _current.set(None)
+
+    @app.get("/metrics")
+    def metrics() -> Response:
+        return Response(render(), mimetype="text/plain; version=0.0.4")
@@ -1,24 +1,51 @@
+import contextvars
+import gc
+import json
+import os
+import queue
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Callable, Dict, List, Tuple
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import numpy as np
 from PIL import Image
 
-from tensorflow.keras.applications.mobilenet_v2 import (
-    MobileNetV2,
-    preprocess_input as mobilenet_preprocess,
-    decode_predictions as mobilenet_decode,
-)
-from tensorflow.keras.applications.efficientnet_v2 import (
-    EfficientNetV2B0,
-    EfficientNetV2B3,
-    preprocess_input as efficientnet_preprocess,
-    decode_predictions as efficientnet_decode,
-)
-import threading
-import tensorflow_hub as hub
-import tensorflow as tf
+from artifacts import artifact_path, data_file, require_download
+from metrics import collect, current_timings, observe_stage, stage
+from registry import LoadedModel, estimate_model_bytes, registry
+from tflite_backend import ENGINES, TFLiteRunner, calibration_images, convert, load_or_convert
+from utils import lazy_import
+from workers import get_pool
+
+# TensorFlow and Keras are imported on first use so the web process starts
+# without paying for them.
+tf = lazy_import("tensorflow")
+hub = lazy_import("tensorflow_hub")
+_mobilenet_v2 = lazy_import("tensorflow.keras.applications.mobilenet_v2")
+_efficientnet_v2 = lazy_import("tensorflow.keras.applications.efficientnet_v2")
+
+
+_IMAGENET_CLASS_INDEX: Optional[Dict[str, List[str]]] = None
+
+
+def _imagenet_decode(preds: np.ndarray, top: int = 5) -> List[List[Tuple[str, str, float]]]:
+    """Keras-compatible decode_predictions that prefers a local imagenet_class_index.json."""
+    global _IMAGENET_CLASS_INDEX
+    if _IMAGENET_CLASS_INDEX is None:
+        path = data_file("imagenet_class_index.json")
+        if path is None:
+            require_download("imagenet_class_index.json", "the Keras ImageNet class index")
+            return _mobilenet_v2.decode_predictions(preds, top=top)
+        with open(path, "r", encoding="utf-8") as fh:
+            _IMAGENET_CLASS_INDEX = json.load(fh)
+    results = []
+    for row in preds:
+        top_idx = row.argsort()[-top:][::-1]
+        results.append([(*_IMAGENET_CLASS_INDEX[str(i)], float(row[i])) for i in top_idx])
+    return results
 
 
 @dataclass(frozen=True)
@@ -28,46 +55,64 @@ class ModelSpec:
     loader: Callable[[], object]
     preprocess: Callable[[np.ndarray], np.ndarray]
     decode: Callable[[np.ndarray, int], List[List[Tuple[str, str, float]]]]
+    # "keras", "tflite_dynamic" or "tflite_int8" (see tflite_backend)
+    engine: str = "keras"
 
 
 _DEFAULT_MODEL_NAME = "efficientnet_v2_b3"
 
+# `loader` builds the model from downloaded ImageNet weights; a local artifact
+# with the same name takes precedence (see _load_classifier).
 _MODEL_SPECS: Dict[str, ModelSpec] = {
     "mobilenet_v2": ModelSpec(
         name="mobilenet_v2",
         target_size=(224, 224),
-        loader=lambda: MobileNetV2(weights="imagenet"),
-        preprocess=mobilenet_preprocess,
-        decode=mobilenet_decode,
+        loader=lambda: _mobilenet_v2.MobileNetV2(weights="imagenet"),
+        preprocess=lambda x: _mobilenet_v2.preprocess_input(x),
+        decode=_imagenet_decode,
     ),
     "efficientnet_v2_b0": ModelSpec(
         name="efficientnet_v2_b0",
         target_size=(224, 224),
-        loader=lambda: EfficientNetV2B0(weights="imagenet"),
-        preprocess=efficientnet_preprocess,
-        decode=efficientnet_decode,
+        loader=lambda: _efficientnet_v2.EfficientNetV2B0(weights="imagenet"),
+        preprocess=lambda x: _efficientnet_v2.preprocess_input(x),
+        decode=_imagenet_decode,
     ),
     "efficientnet_v2_b3": ModelSpec(
         name="efficientnet_v2_b3",
         target_size=(300, 300),
-        loader=lambda: EfficientNetV2B3(weights="imagenet"),
-        preprocess=efficientnet_preprocess,
-        decode=efficientnet_decode,
+        loader=lambda: _efficientnet_v2.EfficientNetV2B3(weights="imagenet"),
+        preprocess=lambda x: _efficientnet_v2.preprocess_input(x),
+        decode=_imagenet_decode,
     ),
 }
 
+# Per-model engine overrides, e.g. MODEL_ENGINES="mobilenet_v2=tflite_int8,efficientnet_v2_b0=tflite_dynamic"
+_ENGINE_OVERRIDES: Dict[str, str] = dict(
+    item.split("=", 1) for item in os.environ.get("MODEL_ENGINES", "").replace(" ", "").split(",") if "=" in item
+)
+
+
+def get_engine(model_name: str) -> str:
+    if model_name not in _MODEL_SPECS:
+        return "keras"
+    engine = _ENGINE_OVERRIDES.get(model_name, _MODEL_SPECS[model_name].engine)
+    return engine if engine in ENGINES else "keras"
+
+
 # Flower classifier from TF Hub (e.g., a MobileNet trained on flowers)
-_FLOWER_MODEL = None
+FLOWER_MODEL_URL = "https://tfhub.dev/google/tf2-preview/mobilenet_v2/classification/4"
 _FLOWER_LABELS = [
     "daisy","dandelion","roses","sunflowers","tulips"
 ]
 
 
 def _load_flower_model():
-    global _FLOWER_MODEL
-    if _FLOWER_MODEL is None:
-        _FLOWER_MODEL = hub.load("https://tfhub.dev/google/tf2-preview/mobilenet_v2/classification/4")
-    return _FLOWER_MODEL
+    path = artifact_path("flowers_v1")
+    if path is None:
+        require_download("flowers_v1", FLOWER_MODEL_URL)
+        path = FLOWER_MODEL_URL
+    return hub.load(path)
 
 
 def _flower_preprocess(arr: np.ndarray) -> np.ndarray:
@@ -80,13 +125,170 @@ def _flower_preprocess(arr: np.ndarray) -> np.ndarray:
 def _flower_decode(preds: np.ndarray, top: int):
     # The chosen hub model is ImageNet; for demo we will keep ImageNet decode through Keras if needed.
     # Simple mapping to flower labels for a 5-class demo isn't perfect; a dedicated flower model is ideal.
-    # Here we fallback to Keras mobilenet decode for readability.
-    from tensorflow.keras.applications.mobilenet_v2 import decode_predictions as dp
-    return dp(preds, top=top)
+    # Here we fallback to the ImageNet decode for readability.
+    return _imagenet_decode(preds, top=top)
+
+
+# Also return the pooled penultimate features of Keras classifiers, for the similar-image index
+EMBEDDINGS_ENABLED = os.environ.get("MODEL_EMBEDDINGS", "1") == "1"
+
+# Dynamic micro-batching: concurrent requests for the same model are collected
+# for up to BATCH_MAX_WAIT_MS (or until BATCH_MAX_SIZE is reached) and run as a
+# single forward pass.
+BATCH_MAX_SIZE = int(os.environ.get("MODEL_BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("MODEL_BATCH_MAX_WAIT_MS", "5"))
+BATCH_MAX_QUEUE = int(os.environ.get("MODEL_BATCH_MAX_QUEUE", "256"))
+BATCH_SUBMIT_TIMEOUT_S = float(os.environ.get("MODEL_BATCH_SUBMIT_TIMEOUT_S", "30"))
+
+
+class _PendingRequest:
+    __slots__ = ("array", "enqueued_at", "finished_at", "done", "result", "error")
+
+    def __init__(self, array: np.ndarray) -> None:
+        self.array = array
+        self.enqueued_at = time.perf_counter()
+        self.finished_at = 0.0
+        self.done = threading.Event()
+        self.result: Optional[np.ndarray] = None
+        self.error: Optional[BaseException] = None
+
+
+class MicroBatcher:
+    def __init__(
+        self,
+        name: str,
+        forward: Callable[[np.ndarray], Any],
+        max_batch_size: int = BATCH_MAX_SIZE,
+        max_wait_ms: float = BATCH_MAX_WAIT_MS,
+        max_queue: int = BATCH_MAX_QUEUE,
+        concurrency: int = 1,
+    ) -> None:
+        self.name = name
+        self._forward = forward
+        # Batches run in flight at once; >1 only when forward hands off to worker processes
+        self._concurrency = max(1, int(concurrency))
+        self._max_batch_size = max(1, int(max_batch_size))
+        self._max_wait_s = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue: "queue.Queue[_PendingRequest]" = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._threads: List[threading.Thread] = []
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._errors = 0
+        self._max_seen_batch = 0
+        self._batch_size_hist: Dict[int, int] = {}
+        self._wait_ms_total = 0.0
+        self._wait_ms_max = 0.0
+        self._infer_ms_total = 0.0
+        self._last_infer_ms = 0.0
+
+    def _ensure_started(self) -> None:
+        if self._threads:
+            return
+        with self._start_lock:
+            if not self._threads:
+                for i in range(self._concurrency):
+                    thread = threading.Thread(target=self._run, name=f"batcher-{self.name}-{i}", daemon=True)
+                    thread.start()
+                    self._threads.append(thread)
+
+    def submit_async(self, array: np.ndarray) -> _PendingRequest:
+        """Queue one preprocessed input (without batch axis) and return its pending handle."""
+        self._ensure_started()
+        request = _PendingRequest(array)
+        try:
+            self._queue.put(request, timeout=BATCH_SUBMIT_TIMEOUT_S)
+        except queue.Full:
+            raise RuntimeError(f"Inference queue for '{self.name}' is full")
+        return request
+
+    def submit(self, array: np.ndarray) -> Any:
+        """Queue one preprocessed input and block until its output row (or tuple of rows) is ready."""
+        request = self.submit_async(array)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _collect(self) -> List[_PendingRequest]:
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self._max_wait_s
+        while len(batch) < self._max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            try:
+                outputs = self._forward(np.stack([r.array for r in batch]))
+                if isinstance(outputs, tuple):
+                    # Several outputs per input (e.g. probabilities and embeddings): one row of each
+                    parts = [np.asarray(o) for o in outputs]
+                    for i, request in enumerate(batch):
+                        request.result = tuple(p[i] for p in parts)
+                else:
+                    outputs = np.asarray(outputs)
+                    for i, request in enumerate(batch):
+                        request.result = outputs[i]
+            except BaseException as e:  # propagate to every waiting caller
+                for request in batch:
+                    request.error = e
+                with self._stats_lock:
+                    self._errors += 1
+            finished = time.perf_counter()
+            for request in batch:
+                request.finished_at = finished
+                request.done.set()
+            self._record(batch, started, finished)
+
+    def _record(self, batch: List[_PendingRequest], started: float, finished: float) -> None:
+        size = len(batch)
+        waits = [(started - r.enqueued_at) * 1000.0 for r in batch]
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += size
+            self._max_seen_batch = max(self._max_seen_batch, size)
+            self._batch_size_hist[size] = self._batch_size_hist.get(size, 0) + 1
+            self._wait_ms_total += sum(waits)
+            self._wait_ms_max = max(self._wait_ms_max, max(waits))
+            self._last_infer_ms = (finished - started) * 1000.0
+            self._infer_ms_total += self._last_infer_ms
 
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            batches = self._batches
+            requests = self._requests
+            return {
+                "max_batch_size": self._max_batch_size,
+                "max_wait_ms": self._max_wait_s * 1000.0,
+                "concurrency": self._concurrency,
+                "queue_depth": self._queue.qsize(),
+                "queue_capacity": self._queue.maxsize,
+                "batches": batches,
+                "requests": requests,
+                "errors": self._errors,
+                "mean_batch_size": (requests / batches) if batches else 0.0,
+                "max_seen_batch_size": self._max_seen_batch,
+                "batch_size_histogram": dict(sorted(self._batch_size_hist.items())),
+                "mean_wait_ms": (self._wait_ms_total / requests) if requests else 0.0,
+                "max_wait_ms_seen": self._wait_ms_max,
+                "mean_infer_ms": (self._infer_ms_total / batches) if batches else 0.0,
+                "last_infer_ms": self._last_infer_ms,
+            }
 
-_models_cache: Dict[str, object] = {}
-_model_lock = threading.Lock()
+
+_batchers: Dict[str, MicroBatcher] = {}
+_batchers_lock = threading.Lock()
 
 
 # Static metadata for display (approximate values)
@@ -103,47 +305,376 @@ def list_available_models() -> List[str]:
 
 
 def get_model_info() -> Dict[str, Dict[str, str]]:
-    return _MODEL_INFO.copy()
+    return {name: {**info, "engine": get_engine(name)} for name, info in _MODEL_INFO.items()}
 
 
 def _get_model(model_name: str):
+    return registry.get(_resolve_model_name(model_name)).model
+
+
+def get_target_size(model_name: str) -> Tuple[int, int]:
     if model_name == "flowers_v1":
-        return _load_flower_model()
-    if model_name not in _MODEL_SPECS:
-        model_name = _DEFAULT_MODEL_NAME
-    with _model_lock:
-        model = _models_cache.get(model_name)
-        if model is None:
-            model = _MODEL_SPECS[model_name].loader()
-            _models_cache[model_name] = model
-        return model
+        return (224, 224)
+    return _MODEL_SPECS.get(model_name, _MODEL_SPECS[_DEFAULT_MODEL_NAME]).target_size
+
+
+def _compile(model_name: str, model) -> Callable:
+    # Traced with a fixed input signature so repeated calls skip Keras' predict() loop setup
+    width, height = get_target_size(model_name)
+    signature = [tf.TensorSpec(shape=[None, height, width, 3], dtype=tf.float32)]
+
+    if model_name == "flowers_v1":
+        # The hub model returns 1001 logits with a leading background class;
+        # convert to ImageNet-1000 probabilities so Keras decode works.
+        @tf.function(input_signature=signature)
+        def infer(batch):
+            return tf.nn.softmax(model(batch))[:, 1:]
+    else:
+        @tf.function(input_signature=signature)
+        def infer(batch):
+            return model(batch, training=False)
+
+    return infer
+
+
+def _compile_embed(model_name: str, model) -> Optional[Callable]:
+    """Compiled (probabilities, pooled features) function; None when the model has no global pooling layer."""
+    pooled = next(
+        (layer for layer in reversed(model.layers) if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D)), None
+    )
+    if pooled is None:
+        return None
+    # Shares the classifier's layers and weights; only the graph gains a second output
+    dual = tf.keras.Model(model.inputs, [model.output, pooled.output])
+    width, height = get_target_size(model_name)
+
+    @tf.function(input_signature=[tf.TensorSpec(shape=[None, height, width, 3], dtype=tf.float32)])
+    def embed(batch):
+        return dual(batch, training=False)
+
+    return embed
+
+
+def _load_keras_model(model_name: str):
+    path = artifact_path(model_name)
+    if path is not None:
+        return tf.keras.models.load_model(path, compile=False)
+    require_download(model_name, "ImageNet weights")
+    return _MODEL_SPECS[model_name].loader()
+
+
+def _calibration_set(model_name: str) -> List[np.ndarray]:
+    spec = _MODEL_SPECS[model_name]
+    return calibration_images(spec.target_size, spec.preprocess)
+
+
+def _load_classifier(model_name: str) -> LoadedModel:
+    if model_name == "flowers_v1":
+        model = _load_flower_model()
+        return LoadedModel(model=model, infer=_compile(model_name, model))
+    engine = get_engine(model_name)
+    if engine == "keras":
+        model = _load_keras_model(model_name)
+        embed = _compile_embed(model_name, model) if EMBEDDINGS_ENABLED else None
+        return LoadedModel(model=model, infer=_compile(model_name, model), embed=embed)
+    runner = load_or_convert(
+        model_name, engine, partial(_load_keras_model, model_name), partial(_calibration_set, model_name)
+    )
+    return LoadedModel(model=runner, infer=runner)
+
+
+for _name in list_available_models():
+    registry.register(_name, partial(_load_classifier, _name))
+
+
+def local_forward(model_name: str) -> Callable[[np.ndarray], Any]:
+    """Batch forward pass in this process: probabilities, or (probabilities, embeddings) when available."""
+
+    def forward(batch: np.ndarray) -> Any:
+        loaded = registry.get(_resolve_model_name(model_name))
+        batch = np.asarray(batch, dtype=np.float32)
+        if loaded.embed is not None:
+            probs, features = loaded.embed(batch)
+            return np.asarray(probs), np.asarray(features, dtype=np.float32)
+        # Compiled Keras functions return tensors, TFLite runners return arrays
+        return np.asarray(loaded.infer(batch))
+
+    return forward
+
+
+def _forward_fn(model_name: str) -> Callable[[np.ndarray], np.ndarray]:
+    pool = get_pool()
+    if pool is None:
+        return local_forward(model_name)
+    return lambda batch: pool.run("classify", model_name, np.asarray(batch, dtype=np.float32))
+
+
+def warmup_models(model_names: List[str]) -> Dict[str, float]:
+    """Load, compile and trace each model once; returns warmup time in ms per model."""
+    timings: Dict[str, float] = {}
+    for name in model_names:
+        if name not in list_available_models():
+            continue
+        t0 = time.perf_counter()
+        width, height = get_target_size(name)
+        local_forward(name)(np.zeros([1, height, width, 3], dtype=np.float32))
+        timings[name] = (time.perf_counter() - t0) * 1000.0
+    return timings
+
+
+def _median_ms(fn: Callable[[], Any], runs: int) -> float:
+    fn()
+    samples = []
+    for _ in range(max(1, runs)):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return float(np.median(samples))
+
+
+def _rss_bytes() -> Optional[int]:
+    """Resident set size of this process (Linux ``/proc``), None where unavailable."""
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _rss_growth_mb(before: Optional[int]) -> Optional[float]:
+    after = _rss_bytes()
+    if before is None or after is None:
+        return None
+    return max(0, after - before) / (1024 * 1024)
+
+
+def compare_inference_latency(model_name: str, runs: int = 20) -> Dict[str, float]:
+    """Median single-image latency (ms) of model.predict/eager call vs the compiled path."""
+    loaded = registry.get(_resolve_model_name(model_name))
+    model, infer = loaded.model, loaded.infer
+    width, height = get_target_size(model_name)
+    batch = np.random.rand(1, height, width, 3).astype(np.float32)
+    if model_name == "flowers_v1" or not hasattr(model, "predict"):
+        baseline = lambda: model(batch)
+    else:
+        baseline = lambda: model.predict(batch, verbose=0)
+    compiled = lambda: np.asarray(infer(batch))
+
+    before = _median_ms(baseline, runs)
+    after = _median_ms(compiled, runs)
+    return {"before_ms": before, "after_ms": after, "speedup": before / after if after > 0 else 0.0}
+
+
+def compare_engines(
+    model_name: str, engines: Tuple[str, ...] = ("tflite_dynamic", "tflite_int8"), runs: int = 20, eval_limit: int = 200
+) -> Dict[str, Dict[str, float]]:
+    """Latency, memory and top-1 agreement of TFLite engines against the Keras model.
+
+    ``model_mb`` is the size of the weights/flatbuffer; ``rss_mb`` is the growth
+    in resident memory from loading the engine and running its first inference
+    (None off Linux). Images come from stored uploads (random inputs when there
+    are none); INT8 is calibrated on every other image and agreement is measured
+    on the rest. Conversions are kept in memory and not written to the artifact store.
+    """
+    spec = _MODEL_SPECS[model_name]
+    gc.collect()
+    rss_before = _rss_bytes()
+    keras_model = _load_keras_model(model_name)
+    keras_infer = _compile(model_name, keras_model)
+    images = calibration_images(spec.target_size, spec.preprocess, limit=eval_limit)
+    if not images:
+        width, height = spec.target_size
+        images = [spec.preprocess(np.random.rand(1, height, width, 3).astype(np.float32) * 255.0) for _ in range(8)]
+    calibration = images[::2]
+    evaluation = images[1::2] or images
+    reference = np.concatenate([np.asarray(keras_infer(x)) for x in evaluation]).argmax(axis=-1)
+    sample = evaluation[0]
+    np.asarray(keras_infer(sample))
+    keras_rss = _rss_growth_mb(rss_before)
+
+    report = {
+        "keras": {
+            "latency_ms": _median_ms(lambda: np.asarray(keras_infer(sample)), runs),
+            "model_mb": estimate_model_bytes(keras_model) / (1024 * 1024),
+            "rss_mb": keras_rss,
+            "top1_agreement": 1.0,
+        }
+    }
+    for engine in engines:
+        flatbuffer = convert(keras_model, engine, calibration if engine == "tflite_int8" else None)
+        gc.collect()
+        rss_before = _rss_bytes()
+        runner = TFLiteRunner(flatbuffer)
+        runner(sample)
+        runner_rss = _rss_growth_mb(rss_before)
+        top1 = np.concatenate([runner(x) for x in evaluation]).argmax(axis=-1)
+        report[engine] = {
+            "latency_ms": _median_ms(lambda: runner(sample), runs),
+            "model_mb": runner.nbytes / (1024 * 1024),
+            "rss_mb": runner_rss,
+            "top1_agreement": float(np.mean(top1 == reference)),
+        }
+    report["images"] = {"calibration": len(calibration), "evaluation": len(evaluation)}
+    return report
+
+
+def _get_batcher(model_name: str) -> MicroBatcher:
+    batcher = _batchers.get(model_name)
+    if batcher is None:
+        with _batchers_lock:
+            batcher = _batchers.get(model_name)
+            if batcher is None:
+                pool = get_pool()
+                concurrency = pool.capacity(model_name) if pool is not None else 1
+                batcher = MicroBatcher(model_name, _forward_fn(model_name), concurrency=concurrency)
+                _batchers[model_name] = batcher
+    return batcher
+
+
+def get_batching_stats() -> Dict[str, Dict[str, Any]]:
+    with _batchers_lock:
+        batchers = dict(_batchers)
+    return {name: b.stats() for name, b in batchers.items()}
+
+
+def _prepare_input(rgb: Image.Image, model_name: str) -> np.ndarray:
+    """Model-ready input (no batch axis) built from an already-decoded RGB image."""
+    if model_name == "flowers_v1":
+        return _flower_preprocess(np.array(rgb))
+    spec = _MODEL_SPECS[model_name]
+    image_array = np.array(rgb.resize(spec.target_size), dtype=np.float32)
+    image_array = np.expand_dims(image_array, axis=0)
+    return spec.preprocess(image_array)[0]
+
+
+def _decode_row(row: np.ndarray, model_name: str, top_k: int) -> List[Tuple[str, float]]:
+    decode = _flower_decode if model_name == "flowers_v1" else _MODEL_SPECS[model_name].decode
+    decoded = decode(row[np.newaxis, ...], top=top_k)[0]
+    return [(label.replace("_", " "), float(prob)) for (_, label, prob) in decoded]
+
+
+def _resolve_model_name(model_name: str) -> str:
+    if model_name == "flowers_v1" or model_name in _MODEL_SPECS:
+        return model_name
+    return _DEFAULT_MODEL_NAME
+
+
+class PendingClassification:
+    """Handle for a classification queued on a model's micro-batcher."""
+
+    def __init__(self, request: _PendingRequest, model_name: str, top_k: int) -> None:
+        self._request = request
+        self.model_name = model_name
+        self.top_k = top_k
+        # Pooled features of the image, set by result() when the model provides them
+        self.embedding: Optional[np.ndarray] = None
+        # Raw output row, set by result()
+        self.scores: Optional[np.ndarray] = None
+
+    def done(self) -> bool:
+        return self._request.done.is_set()
+
+    def result(self) -> List[Tuple[str, float]]:
+        self._request.done.wait()
+        if self._request.error is not None:
+            raise self._request.error
+        # Queue wait plus the batch's forward pass, whenever the caller collects it
+        observe_stage("inference", self._request.finished_at - self._request.enqueued_at, self.model_name)
+        row = self._request.result
+        if isinstance(row, tuple):
+            row, self.embedding = row
+        self.scores = row
+        with stage("decode_predictions", self.model_name):
+            return _decode_row(row, self.model_name, self.top_k)
+
+
+def classify_image_async(
+    image: Image.Image,
+    model_name: str = _DEFAULT_MODEL_NAME,
+    top_k: int = 5,
+) -> PendingClassification:
+    """Preprocess in the caller's thread and queue the image without waiting for the result.
+
+    Submitting many images back to back lets the batcher fill whole batches
+    from a single caller.
+    """
+    return classify_prepared_async(prepare_image(image, model_name), model_name=model_name, top_k=top_k)
+
+
+def prepare_image(image: Image.Image, model_name: str = _DEFAULT_MODEL_NAME) -> np.ndarray:
+    """Resize and preprocess an image for ``model_name``; safe to call from worker threads."""
+    model_name = _resolve_model_name(model_name)
+    with stage("preprocess", model_name):
+        return _prepare_input(image.convert("RGB"), model_name)
+
+
+def classify_prepared_async(
+    array: np.ndarray,
+    model_name: str = _DEFAULT_MODEL_NAME,
+    top_k: int = 5,
+) -> PendingClassification:
+    model_name = _resolve_model_name(model_name)
+    return PendingClassification(_get_batcher(model_name).submit_async(array), model_name, top_k)
 
 
 def classify_image(
     image: Image.Image,
     model_name: str = _DEFAULT_MODEL_NAME,
     top_k: int = 5,
-) -> List[Tuple[str, float]]:
-    if model_name == "flowers_v1":
-        model = _get_model(model_name)
-        rgb = image.convert("RGB")
-        arr = np.array(rgb)
-        arr = _flower_preprocess(arr)
-        arr = np.expand_dims(arr, 0)
-        preds = model(arr)
-        decoded = _flower_decode(preds, top=top_k)[0]
-        return [(label.replace("_", " "), float(prob)) for (_, label, prob) in decoded]
-
-    spec = _MODEL_SPECS.get(model_name, _MODEL_SPECS[_DEFAULT_MODEL_NAME])
-    model = _get_model(spec.name)
-
-    image_resized = image.convert("RGB").resize(spec.target_size)
-    image_array = np.array(image_resized, dtype=np.float32)
-    image_array = np.expand_dims(image_array, axis=0)
-    image_preprocessed = spec.preprocess(image_array)
+    return_embedding: bool = False,
+) -> Any:
+    """Top-k (label, probability) pairs; with `return_embedding`, a (predictions, embedding) pair.
+
+    The embedding is the model's pooled penultimate feature vector, or None
+    for models without one (TFLite engines, flowers_v1).
+    """
+    pending = classify_image_async(image, model_name=model_name, top_k=top_k)
+    predictions = pending.result()
+    return (predictions, pending.embedding) if return_embedding else predictions
+
+
+_ensemble_executor = ThreadPoolExecutor(max_workers=len(_MODEL_SPECS) + 1, thread_name_prefix="ensemble")
+
+
+def classify_ensemble(
+    image: Image.Image,
+    model_names: List[str],
+    top_k: int = 5,
+    merge: bool = True,
+) -> Dict[str, Any]:
+    """Run several models on one decoded image concurrently.
+
+    All models share the same RGB buffer and only differ in their resize and
+    preprocessing. Every model here produces ImageNet-1000 probabilities, so
+    the merged ranking is the decode of the mean probability vector. Each
+    model's stage timings are returned under "timings".
+    """
+    rgb = image.convert("RGB")
+    names = list(dict.fromkeys(_resolve_model_name(n) for n in model_names))
+
+    def _run(name: str) -> Tuple[str, PendingClassification, List[Tuple[str, float]], Dict[str, float], float]:
+        parent = current_timings()
+        t0 = time.perf_counter()
+        # Per-model Timings under the caller's endpoint, so stages of parallel models stay apart
+        with collect(parent.endpoint if parent is not None else "") as timings:
+            with stage("preprocess", name):
+                array = _prepare_input(rgb, name)
+            pending = PendingClassification(_get_batcher(name).submit_async(array), name, top_k)
+            predictions = pending.result()
+        stages = {k: round(v, 2) for k, v in timings.stages.items()}
+        return name, pending, predictions, stages, (time.perf_counter() - t0) * 1000.0
 
-    predictions = model.predict(image_preprocessed)
-    decoded = spec.decode(predictions, top=top_k)[0]
+    # Tasks run in a copy of the caller's context so they see its request Timings
+    futures = [_ensemble_executor.submit(contextvars.copy_context().run, _run, name) for name in names]
+    outputs = [future.result() for future in futures]
+    result: Dict[str, Any] = {
+        "models": {
+            name: {"predictions": predictions, "timings": stages, "latency_ms": latency_ms}
+            for name, _, predictions, stages, latency_ms in outputs
+        },
+    }
+    if merge and outputs:
+        mean = np.mean(np.stack([pending.scores for _, pending, _, _, _ in outputs]), axis=0)
+        result["merged"] = _decode_row(mean, _DEFAULT_MODEL_NAME, top_k)
+    return result
 
-    results = [(label.replace("_", " "), float(prob)) for (_, label, prob) in decoded]
-    return results 
\ No newline at end of file
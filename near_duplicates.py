@@ -0,0 +1,96 @@
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class _Node:
+    __slots__ = ("phash", "values", "children")
+
+    def __init__(self, phash: int) -> None:
+        self.phash = phash
+        self.values: Set[str] = set()
+        self.children: Dict[int, "_Node"] = {}
+
+
+class BKTree:
+    """Burkhard-Keller tree over integer hashes under Hamming distance.
+
+    Each node's children are keyed by their distance to it, so by the
+    triangle inequality a search within `max_distance` of a query only
+    descends into children keyed d - max_distance .. d + max_distance.
+    Equal hashes share a node and collect their values.
+    """
+
+    def __init__(self) -> None:
+        self._root: Optional[_Node] = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, phash: int, value: str) -> bool:
+        """Insert `value` under `phash`; False if that pair was already present."""
+        if self._root is None:
+            self._root = _Node(phash)
+        node = self._root
+        while True:
+            distance = hamming(phash, node.phash)
+            if distance == 0:
+                if value in node.values:
+                    return False
+                node.values.add(value)
+                self._size += 1
+                return True
+            child = node.children.get(distance)
+            if child is None:
+                child = node.children[distance] = _Node(phash)
+            node = child
+
+    def search(self, phash: int, max_distance: int) -> List[Tuple[int, str]]:
+        """(distance, value) pairs within `max_distance` of `phash`, closest first."""
+        found: List[Tuple[int, str]] = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(phash, node.phash)
+            if distance <= max_distance:
+                found.extend((distance, value) for value in node.values)
+            for edge, child in node.children.items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        found.sort()
+        return found
+
+
+class NearDuplicateIndex:
+    """Perceptual hashes of past uploads, mapping each hash to the digests of uploads that had it."""
+
+    def __init__(self) -> None:
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+        self._lookups = 0
+        self._matches = 0
+
+    def load(self, pairs: Iterable[Tuple[int, str]]) -> None:
+        with self._lock:
+            for phash, digest in pairs:
+                self._tree.add(phash, digest)
+
+    def add(self, phash: int, digest: str) -> None:
+        with self._lock:
+            self._tree.add(phash, digest)
+
+    def find(self, phash: int, max_distance: int, exclude: Optional[str] = None) -> List[Tuple[int, str]]:
+        """(distance, digest) of indexed uploads within `max_distance` bits, closest first."""
+        with self._lock:
+            found = [(d, digest) for d, digest in self._tree.search(phash, max_distance) if digest != exclude]
+            self._lookups += 1
+            self._matches += int(bool(found))
+        return found
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hashes": len(self._tree), "lookups": self._lookups, "matches": self._matches}
@@ -0,0 +1,92 @@
+import logging
+import queue
+import threading
+from typing import Any, Callable, Dict, Optional
+
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class BackgroundPersister:
+    """Single worker thread that runs file writes and DB inserts off the request path.
+
+    Tasks run in submission order. When the queue is full the task runs inline
+    in the caller, which applies back-pressure instead of dropping work.
+    """
+
+    def __init__(self, name: str = "persistence", max_queue: int = 1024) -> None:
+        self._name = name
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, int(max_queue)))
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self._completed = 0
+        self._failed = 0
+        self._inline = 0
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+                self._thread.start()
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> None:
+        if self._closed:
+            self._call(fn, args, kwargs)
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((fn, args, kwargs))
+        except queue.Full:
+            with self._lock:
+                self._inline += 1
+            self._call(fn, args, kwargs)
+
+    def _call(self, fn: Callable[..., Any], args: tuple, kwargs: dict) -> None:
+        try:
+            fn(*args, **kwargs)
+        except Exception:
+            logger.exception("Background task %s failed", getattr(fn, "__name__", fn))
+            with self._lock:
+                self._failed += 1
+        else:
+            with self._lock:
+                self._completed += 1
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                fn, args, kwargs = item
+                self._call(fn, args, kwargs)
+            finally:
+                self._queue.task_done()
+
+    def drain(self) -> None:
+        """Block until every task submitted so far has run."""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self, timeout: float = 30.0) -> None:
+        """Drain outstanding work and stop the worker; later submits run inline."""
+        self._closed = True
+        thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "completed": self._completed,
+                "failed": self._failed,
+                "ran_inline": self._inline,
+            }
@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+
+@dataclass(frozen=True)
+class LoadedModel:
+    model: Any
+    infer: Callable
+    # Returns (outputs, pooled embeddings) for models that expose penultimate features
+    embed: Optional[Callable] = None
+
+
+def estimate_model_bytes(model: Any) -> int:
+    """Approximate resident size from the model's variables (weights dominate memory)."""
+    if hasattr(model, "nbytes"):
+        return int(model.nbytes)  # TFLite flatbuffer
+    total = 0
+    for variable in getattr(model, "variables", None) or []:
+        try:
+            count = 1
+            for dim in variable.shape:
+                count *= int(dim)
+            total += count * variable.dtype.size
+        except (TypeError, AttributeError):
+            continue
+    return total
+
+
+class _Entry:
+    __slots__ = ("loader", "value", "size_bytes", "loaded_at", "last_used", "loads", "hits", "loading")
+
+    def __init__(self, loader: Callable[[], LoadedModel]) -> None:
+        self.loader = loader
+        self.value: Optional[LoadedModel] = None
+        self.size_bytes = 0
+        self.loaded_at = 0.0
+        self.last_used = 0.0
+        self.loads = 0
+        self.hits = 0
+        self.loading: Optional[threading.Event] = None
+
+
+class ModelRegistry:
+    """Loads models on first use and keeps them within a memory budget.
+
+    Concurrent first requests for the same model share one load (single
+    flight). When the resident total exceeds the budget, least recently used
+    models are evicted; the model just requested is never evicted to make
+    room for itself. A budget of 0 means unlimited.
+    """
+
+    def __init__(self, budget_bytes: int = 0) -> None:
+        self._budget_bytes = max(0, int(budget_bytes))
+        self._entries: Dict[str, _Entry] = {}
+        self._lru: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._evictions = 0
+
+    def register(self, name: str, loader: Callable[[], LoadedModel]) -> None:
+        with self._lock:
+            self._entries[name] = _Entry(loader)
+
+    def names(self) -> List[str]:
+        return list(self._entries)
+
+    def get(self, name: str) -> LoadedModel:
+        while True:
+            with self._lock:
+                entry = self._entries[name]
+                if entry.value is not None:
+                    entry.hits += 1
+                    entry.last_used = time.time()
+                    self._lru.move_to_end(name)
+                    return entry.value
+                loading = entry.loading
+                if loading is None:
+                    loading = entry.loading = threading.Event()
+                    owner = True
+                else:
+                    owner = False
+            if not owner:
+                loading.wait()
+                continue  # loaded (or failed, in which case this caller retries the load)
+            try:
+                value = entry.loader()
+                size = estimate_model_bytes(value.model)
+            except BaseException:
+                with self._lock:
+                    entry.loading = None
+                loading.set()
+                raise
+            # Publish the value and release waiters in one step so none of them starts a second load
+            with self._lock:
+                entry.value = value
+                entry.size_bytes = size
+                entry.loaded_at = entry.last_used = time.time()
+                entry.loads += 1
+                entry.loading = None
+                self._lru[name] = None
+                self._lru.move_to_end(name)
+                self._enforce_budget(keep=name)
+            loading.set()
+            return value
+
+    def _enforce_budget(self, keep: str) -> None:
+        if self._budget_bytes <= 0:
+            return
+        for name in list(self._lru):
+            if self._resident_bytes() <= self._budget_bytes:
+                return
+            if name != keep:
+                self._evict_locked(name)
+
+    def _resident_bytes(self) -> int:
+        return sum(self._entries[n].size_bytes for n in self._lru)
+
+    def _evict_locked(self, name: str) -> None:
+        entry = self._entries[name]
+        entry.value = None
+        entry.size_bytes = 0
+        self._lru.pop(name, None)
+        self._evictions += 1
+
+    def evict(self, name: str) -> bool:
+        with self._lock:
+            if name not in self._lru:
+                return False
+            self._evict_locked(name)
+            return True
+
+    def preload(self, names: List[str]) -> None:
+        for name in names:
+            if name in self._entries:
+                self.get(name)
+
+    def resident(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {
+                    "name": name,
+                    "approx_bytes": self._entries[name].size_bytes,
+                    "approx_mb": round(self._entries[name].size_bytes / (1024 * 1024), 1),
+                    "loaded_at": self._entries[name].loaded_at,
+                    "last_used": self._entries[name].last_used,
+                    "loads": self._entries[name].loads,
+                    "hits": self._entries[name].hits,
+                }
+                for name in reversed(self._lru)
+            ]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "budget_bytes": self._budget_bytes,
+                "resident_bytes": self._resident_bytes(),
+                "registered": list(self._entries),
+                "evictions": self._evictions,
+            }
+
+
+registry = ModelRegistry(budget_bytes=int(float(os.environ.get("MODEL_MEMORY_BUDGET_MB", "0")) * 1024 * 1024))
@@ -113,7 +113,7 @@ window.addEventListener('load', () => {
   const modal = document.getElementById('modal');
   const modalImg = document.getElementById('modal-img');
   const resImg = document.getElementById('result-img');
-  const openModal = () => { if (!modal || !resImg || !modalImg) return; modalImg.src = resImg.src; modal.classList.add('show'); };
+  const openModal = () => { if (!modal || !resImg || !modalImg) return; modalImg.src = resImg.dataset.full || resImg.src; modal.classList.add('show'); };
   if (viewBtn) viewBtn.addEventListener('click', openModal);
   if (resImg) resImg.addEventListener('click', openModal);
   modal && modal.addEventListener('click', (e) => { if (e.target === modal) modal.classList.remove('show'); });
@@ -0,0 +1,171 @@
+import hashlib
+import io
+import os
+import re
+import tempfile
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from PIL import Image
+
+from werkzeug.utils import secure_filename
+
+from database import get_upload, record_upload
+
+
+_CHUNK_SIZE = 64 * 1024
+_DIGEST_NAME_RE = re.compile(r"^[0-9a-f]{64}\.[a-z0-9]+$")
+
+
+@dataclass(frozen=True)
+class StoredUpload:
+    digest: str
+    stored_filename: str
+    stored_path: str
+    original_filename: str
+    size_bytes: int
+    is_new: bool
+    # Raw bytes for uploads that are decoded from memory and persisted later
+    data: Optional[bytes] = None
+
+
+# Uploads read into memory but not yet written to disk, keyed by stored filename.
+# Each entry is [bytes, pending persist count]; identical uploads staged before
+# the first one is written share the entry, found through _staged_names.
+_staged: Dict[str, list] = {}
+_staged_names: Dict[str, str] = {}  # digest -> stored filename
+_staged_lock = threading.Lock()
+
+
+def is_content_addressed(filename: str) -> bool:
+    return bool(_DIGEST_NAME_RE.match(filename))
+
+
+def _content_filename(digest: str, original_filename: str) -> str:
+    _, ext = os.path.splitext(original_filename)
+    return f"{digest}{ext.lower()}"
+
+
+def _existing_filename(db_path: str, upload_dir: str, digest: str) -> Optional[str]:
+    row = get_upload(db_path, digest)
+    if row is not None and os.path.exists(os.path.join(upload_dir, row["stored_filename"])):
+        return row["stored_filename"]
+    return None
+
+
+def save_upload(file_storage, upload_dir: str, db_path: str) -> StoredUpload:
+    """Stream an upload to disk while hashing it and keep one copy per SHA-256 digest.
+
+    The bytes go to a temporary file next to the store; once the digest is known
+    the file is renamed to ``<digest>.<ext>`` or discarded if that content is
+    already stored. The original filename is recorded in the ``uploads`` table.
+    """
+    original_filename = secure_filename(file_storage.filename or "") or "upload"
+    digest = hashlib.sha256()
+    size = 0
+
+    stream = file_storage.stream
+    fd, tmp_path = tempfile.mkstemp(prefix=".upload-", dir=upload_dir)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for chunk in iter(lambda: stream.read(_CHUNK_SIZE), b""):
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        hexdigest = digest.hexdigest()
+
+        stored_filename = _existing_filename(db_path, upload_dir, hexdigest)
+        is_new = stored_filename is None
+        if is_new:
+            stored_filename = _content_filename(hexdigest, original_filename)
+            os.replace(tmp_path, os.path.join(upload_dir, stored_filename))
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    record_upload(db_path, hexdigest, stored_filename, original_filename, size)
+    return StoredUpload(
+        digest=hexdigest,
+        stored_filename=stored_filename,
+        stored_path=os.path.join(upload_dir, stored_filename),
+        original_filename=original_filename,
+        size_bytes=size,
+        is_new=is_new,
+    )
+
+
+def stage_upload(file_storage, upload_dir: str, db_path: str) -> StoredUpload:
+    """Read an upload into memory and hash it without touching the disk.
+
+    The returned upload carries its bytes; call ``persist_upload`` (typically
+    from a background worker) to write it and record it in the database.
+    Until then ``get_staged_bytes`` serves the content by its stored filename.
+    """
+    return stage_bytes(file_storage.stream.read(), file_storage.filename, upload_dir, db_path)
+
+
+def stage_bytes(data: bytes, filename: Optional[str], upload_dir: str, db_path: str) -> StoredUpload:
+    """Like ``stage_upload`` for bytes already in memory; every call must be followed by ``persist_upload``.
+
+    Content that is already stored or staged keeps its existing file name,
+    whatever extension this copy was uploaded with.
+    """
+    original_filename = secure_filename(filename or "") or "upload"
+    hexdigest = hashlib.sha256(data).hexdigest()
+    with _staged_lock:
+        stored_filename = _staged_names.get(hexdigest)
+        if stored_filename is not None:
+            _staged[stored_filename][1] += 1
+    if stored_filename is None:
+        candidate = _existing_filename(db_path, upload_dir, hexdigest) or _content_filename(hexdigest, original_filename)
+        with _staged_lock:
+            # A concurrent upload of the same bytes may have staged it meanwhile
+            stored_filename = _staged_names.setdefault(hexdigest, candidate)
+            entry = _staged.setdefault(stored_filename, [data, 0])
+            entry[1] += 1
+    stored_path = os.path.join(upload_dir, stored_filename)
+    return StoredUpload(
+        digest=hexdigest,
+        stored_filename=stored_filename,
+        stored_path=stored_path,
+        original_filename=original_filename,
+        size_bytes=len(data),
+        is_new=not os.path.exists(stored_path),
+        data=data,
+    )
+
+
+def persist_upload(upload: StoredUpload, db_path: str) -> None:
+    try:
+        if upload.data is not None and not os.path.exists(upload.stored_path):
+            upload_dir = os.path.dirname(upload.stored_path)
+            fd, tmp_path = tempfile.mkstemp(prefix=".upload-", dir=upload_dir)
+            try:
+                with os.fdopen(fd, "wb") as out:
+                    out.write(upload.data)
+                os.replace(tmp_path, upload.stored_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        record_upload(db_path, upload.digest, upload.stored_filename, upload.original_filename, upload.size_bytes)
+    finally:
+        with _staged_lock:
+            entry = _staged.get(upload.stored_filename)
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del _staged[upload.stored_filename]
+                    _staged_names.pop(upload.digest, None)
+
+
+def get_staged_bytes(stored_filename: str) -> Optional[bytes]:
+    with _staged_lock:
+        entry = _staged.get(stored_filename)
+        return entry[0] if entry is not None else None
+
+
+def open_upload_image(upload: StoredUpload) -> Image.Image:
+    if upload.data is not None:
+        return Image.open(io.BytesIO(upload.data))
+    return Image.open(upload.stored_path)
@@ -0,0 +1,125 @@
+import os
+import threading
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+from artifacts import ARTIFACT_DIR, BASE_DIR
+from imaging import decode_for_inference
+from utils import allowed_file, lazy_import
+
+tf = lazy_import("tensorflow")
+
+
+ENGINES = ("keras", "tflite_dynamic", "tflite_int8")
+# Interpreter threads per model; defaults to every core
+TFLITE_THREADS = int(os.environ.get("MODEL_TFLITE_THREADS", str(os.cpu_count() or 1)))
+# INT8 calibration images are drawn from stored uploads
+CALIBRATION_DIR = os.environ.get("MODEL_CALIBRATION_DIR", os.path.join(BASE_DIR, "uploads"))
+CALIBRATION_SIZE = int(os.environ.get("MODEL_CALIBRATION_SIZE", "100"))
+
+
+def tflite_path(model_name: str, engine: str) -> str:
+    return os.path.join(ARTIFACT_DIR, f"{model_name}.{engine}.tflite")
+
+
+def calibration_images(
+    target_size: Tuple[int, int],
+    preprocess: Callable[[np.ndarray], np.ndarray],
+    limit: int = CALIBRATION_SIZE,
+    directory: str = CALIBRATION_DIR,
+) -> List[np.ndarray]:
+    """Preprocessed [1, h, w, 3] float32 inputs built from up to `limit` stored uploads."""
+    samples: List[np.ndarray] = []
+    names = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+    for name in names:
+        if len(samples) >= limit:
+            break
+        if not allowed_file(name):
+            continue
+        try:
+            with Image.open(os.path.join(directory, name)) as image:
+                rgb = decode_for_inference(image, [target_size]).resize(target_size)
+        except OSError:
+            continue
+        array = np.asarray(rgb, dtype=np.float32)[np.newaxis, ...]
+        samples.append(preprocess(array).astype(np.float32))
+    return samples
+
+
+def convert(keras_model, engine: str, calibration: Optional[List[np.ndarray]] = None) -> bytes:
+    """Convert a Keras model to a TFLite flatbuffer.
+
+    `tflite_dynamic` quantizes weights to int8 and keeps float activations.
+    `tflite_int8` also quantizes activations, using `calibration` as the
+    representative dataset; inputs and outputs stay float32 so preprocessing
+    and decoding are unchanged.
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if engine == "tflite_int8":
+        if not calibration:
+            raise ValueError("tflite_int8 needs at least one calibration image")
+
+        def representative_dataset() -> Iterator[List[np.ndarray]]:
+            for sample in calibration:
+                yield [sample]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    elif engine != "tflite_dynamic":
+        raise ValueError(f"unknown TFLite engine {engine!r}")
+    return converter.convert()
+
+
+class TFLiteRunner:
+    """Batch-callable wrapper around a TFLite interpreter.
+
+    The interpreter is not thread-safe, so calls are serialised; the micro-batcher
+    already funnels each model's requests through one thread.
+    """
+
+    def __init__(self, model_content: bytes, num_threads: int = TFLITE_THREADS) -> None:
+        self.nbytes = len(model_content)
+        self._interpreter = tf.lite.Interpreter(model_content=model_content, num_threads=num_threads)
+        self._input = self._interpreter.get_input_details()[0]["index"]
+        self._output = self._interpreter.get_output_details()[0]["index"]
+        self._batch_size = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self._interpreter.resize_tensor_input(self._input, list(batch.shape))
+                self._interpreter.allocate_tensors()
+                self._batch_size = batch.shape[0]
+            self._interpreter.set_tensor(self._input, batch)
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output).copy()
+
+
+def load_or_convert(
+    model_name: str,
+    engine: str,
+    load_keras: Callable[[], object],
+    calibration: Callable[[], List[np.ndarray]],
+) -> TFLiteRunner:
+    """Runner for `model_name`, reusing `<name>.<engine>.tflite` from the artifact store when present.
+
+    A fresh conversion is written back to the store so later starts skip it.
+    """
+    path = tflite_path(model_name, engine)
+    if os.path.isfile(path):
+        with open(path, "rb") as fh:
+            return TFLiteRunner(fh.read())
+    content = convert(load_keras(), engine, calibration() if engine == "tflite_int8" else None)
+    try:
+        os.makedirs(ARTIFACT_DIR, exist_ok=True)
+        with open(path + ".tmp", "wb") as fh:
+            fh.write(content)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass  # read-only store: keep the in-memory conversion
+    return TFLiteRunner(content)
@@ -0,0 +1,103 @@
+import os
+import tempfile
+import threading
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from PIL import Image, ImageOps
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+THUMBNAIL_DIR = os.environ.get("THUMBNAIL_DIR", os.path.join(BASE_DIR, "thumbnails"))
+# Served widths; other requested widths snap to the next one up so the cache stays bounded
+THUMBNAIL_WIDTHS: Tuple[int, ...] = tuple(
+    sorted({int(w) for w in os.environ.get("THUMBNAIL_WIDTHS", "160,320,640").split(",") if w.strip()})
+)
+THUMBNAIL_QUALITY = int(os.environ.get("THUMBNAIL_QUALITY", "80"))
+
+
+def snap_width(requested: int) -> int:
+    for width in THUMBNAIL_WIDTHS:
+        if width >= requested:
+            return width
+    return THUMBNAIL_WIDTHS[-1]
+
+
+def thumbnail_filename(filename: str, width: int) -> str:
+    stem, _ = os.path.splitext(filename)
+    return f"{stem}.w{width}.webp"
+
+
+class ThumbnailStore:
+    """WebP derivatives of uploads at fixed widths, written once and reused from disk.
+
+    All missing widths of one upload are produced from a single decode, under a
+    per-upload lock so concurrent first requests do the work once. Files are
+    written atomically, so a partly written thumbnail is never served.
+    """
+
+    def __init__(self, directory: str = THUMBNAIL_DIR, quality: int = THUMBNAIL_QUALITY) -> None:
+        self.directory = directory
+        self._quality = quality
+        # filename -> [lock, callers holding or waiting on it]; dropped when the last one leaves
+        self._locks: Dict[str, List] = {}
+        self._lock = threading.Lock()
+        self._generated = 0
+        self._hits = 0
+
+    def path(self, filename: str, width: int) -> str:
+        return os.path.join(self.directory, thumbnail_filename(filename, width))
+
+    def get(self, filename: str, width: int, opener: Callable[[], Image.Image]) -> str:
+        """Path of the `width` thumbnail of `filename`, generating it from `opener()` if needed."""
+        path = self.path(filename, width)
+        if os.path.exists(path):
+            with self._lock:
+                self._hits += 1
+            return path
+        self.ensure(filename, opener)
+        return path
+
+    def ensure(self, filename: str, opener: Callable[[], Image.Image], widths: Iterable[int] = THUMBNAIL_WIDTHS) -> None:
+        """Generate every missing width of `filename`; used at upload time and on a cache miss."""
+        with self._lock:
+            entry = self._locks.setdefault(filename, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                missing = sorted((w for w in widths if not os.path.exists(self.path(filename, w))), reverse=True)
+                if missing:
+                    with opener() as image:
+                        self._render(filename, image, missing)
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[filename]
+
+    def _render(self, filename: str, image: Image.Image, widths: Iterable[int]) -> None:
+        widths = list(widths)
+        if image.format == "JPEG":
+            # Let libjpeg decode at reduced scale; it stays at least as large as the widest thumbnail
+            image.draft("RGB", (widths[0], widths[0]))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "PA") else "RGB")
+        os.makedirs(self.directory, exist_ok=True)
+        # Widest first, each one resized from the previous, so later resizes are cheap
+        for width in widths:
+            if image.width > width:
+                image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+            fd, tmp_path = tempfile.mkstemp(prefix=".thumb-", dir=self.directory)
+            try:
+                with os.fdopen(fd, "wb") as out:
+                    image.save(out, format="WEBP", quality=self._quality, method=4)
+                os.replace(tmp_path, self.path(filename, width))
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            with self._lock:
+                self._generated += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"widths": list(THUMBNAIL_WIDTHS), "generated": self._generated, "hits": self._hits}
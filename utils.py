@@ -1,4 +1,6 @@
+import importlib
 import os
+import types
 from typing import Set
 
 ALLOWED_EXTENSIONS: Set[str] = {"png", "jpg", "jpeg", "gif", "bmp", "webp"}
@@ -13,4 +15,18 @@ def allowed_file(filename: str) -> bool:
 
 def ensure_directories(paths):
     for path in paths:
-        os.makedirs(path, exist_ok=True) 
\ No newline at end of file
+        os.makedirs(path, exist_ok=True)
+
+
+class _LazyModule(types.ModuleType):
+    """Stand-in for a module that is imported on first attribute access."""
+
+    def __getattr__(self, attr: str):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """Defer importing a heavy module (e.g. TensorFlow) until it is first used."""
+    return _LazyModule(name)
@@ -0,0 +1,363 @@
+import atexit
+import itertools
+import os
+import queue
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import connection, resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Number of inference worker processes; 0 keeps inference in the web process
+INFERENCE_PROCESSES = int(os.environ.get("INFERENCE_PROCESSES", "0"))
+# Pin models to workers, e.g. "efficientnet_v2_b3=0,1;detector=2"; unlisted models go to every worker
+INFERENCE_ROUTES = os.environ.get("INFERENCE_ROUTES", "")
+HEALTH_INTERVAL_S = float(os.environ.get("INFERENCE_HEALTH_INTERVAL_S", "5"))
+CALL_TIMEOUT_S = float(os.environ.get("INFERENCE_CALL_TIMEOUT_S", "120"))
+
+DETECTOR_ALIAS = "detector"
+
+
+class WorkerUnavailableError(RuntimeError):
+    pass
+
+
+def parse_routes(spec: str) -> Dict[str, List[int]]:
+    routes: Dict[str, List[int]] = {}
+    for item in spec.replace(" ", "").split(";"):
+        if "=" not in item:
+            continue
+        name, indexes = item.split("=", 1)
+        routes[name] = [int(i) for i in indexes.split(",") if i]
+    return routes
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _Worker:
+    def __init__(self, index: int) -> None:
+        self.index = index
+        self.process: Optional[subprocess.Popen] = None
+        self.conn: Optional[connection.Connection] = None
+        self.ready = False
+        self.pending: Dict[int, _Call] = {}
+        self.send_lock = threading.Lock()
+        self.started_at = 0.0
+        self.last_pong = 0.0
+        self.restarts = -1
+        self.requests = 0
+        self.errors = 0
+
+
+class InferencePool:
+    """Inference worker processes, each loading and owning its own models.
+
+    Inputs are copied into a `multiprocessing.shared_memory` block that the
+    worker maps directly, so only the block name, shape and dtype cross the
+    pipe; outputs (class scores, detection boxes) are small and are pickled
+    back. Each call goes to the least loaded ready worker that serves the
+    model. A monitor thread pings the workers and restarts any that exit or
+    stop answering; calls in flight on a lost worker fail with
+    WorkerUnavailableError.
+    """
+
+    def __init__(self, processes: int, routes: Dict[str, List[int]], preload: List[str]) -> None:
+        self._routes = {self._canonical(name): idx for name, idx in routes.items()}
+        self._preload = [self._canonical(name) for name in preload]
+        self._workers = [_Worker(i) for i in range(max(1, processes))]
+        self._authkey = secrets.token_bytes(32)
+        self._listener = connection.Listener(authkey=self._authkey)
+        self._cond = threading.Condition()
+        self._call_ids = itertools.count()
+        self._closed = False
+
+    @staticmethod
+    def _canonical(name: str) -> str:
+        if name == DETECTOR_ALIAS:
+            from detector import DETECTOR_NAME
+            return DETECTOR_NAME
+        return name
+
+    def _serves(self, worker: _Worker, name: str) -> bool:
+        return name not in self._routes or worker.index in self._routes[name]
+
+    def capacity(self, name: str) -> int:
+        return sum(1 for w in self._workers if self._serves(w, self._canonical(name)))
+
+    def start(self) -> "InferencePool":
+        threading.Thread(target=self._accept, name="inference-accept", daemon=True).start()
+        for worker in self._workers:
+            self._spawn(worker)
+        threading.Thread(target=self._monitor, name="inference-monitor", daemon=True).start()
+        return self
+
+    def _spawn(self, worker: _Worker) -> None:
+        env = dict(os.environ)
+        env.update(
+            INFERENCE_PROCESSES="0",
+            INFERENCE_WORKER_INDEX=str(worker.index),
+            INFERENCE_WORKER_ADDRESS=self._listener.address,
+            INFERENCE_WORKER_AUTHKEY=self._authkey.hex(),
+            INFERENCE_WORKER_PRELOAD=",".join(n for n in self._preload if self._serves(worker, n)),
+        )
+        worker.process = subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env, cwd=BASE_DIR)
+        worker.started_at = time.time()
+        worker.last_pong = 0.0
+        worker.restarts += 1
+
+    def _accept(self) -> None:
+        while not self._closed:
+            try:
+                conn = self._listener.accept()
+                _, index, _pid = conn.recv()
+            except (OSError, EOFError, connection.AuthenticationError):
+                continue
+            worker = self._workers[index]
+            with self._cond:
+                worker.conn = conn
+            threading.Thread(target=self._read, args=(worker, conn), name=f"inference-worker-{index}", daemon=True).start()
+
+    def _read(self, worker: _Worker, conn: connection.Connection) -> None:
+        try:
+            while True:
+                message = conn.recv()
+                kind = message[0]
+                if kind == "ready":
+                    with self._cond:
+                        worker.ready = True
+                        worker.last_pong = time.time()
+                        self._cond.notify_all()
+                elif kind == "pong":
+                    worker.last_pong = time.time()
+                else:
+                    _, call_id, payload = message
+                    with self._cond:
+                        call = worker.pending.pop(call_id, None)
+                    if call is None:
+                        continue
+                    if kind == "ok":
+                        call.result = payload
+                    else:
+                        worker.errors += 1
+                        call.error = RuntimeError(payload)
+                    call.done.set()
+        except (EOFError, OSError):
+            pass
+        self._mark_down(worker, conn, f"inference worker {worker.index} exited")
+
+    def _mark_down(self, worker: _Worker, conn: connection.Connection, reason: str) -> None:
+        with self._cond:
+            if worker.conn is not conn:
+                return
+            worker.conn = None
+            worker.ready = False
+            pending, worker.pending = worker.pending, {}
+        conn.close()
+        for call in pending.values():
+            call.error = WorkerUnavailableError(reason)
+            call.done.set()
+
+    def _monitor(self) -> None:
+        while not self._closed:
+            time.sleep(HEALTH_INTERVAL_S)
+            for worker in self._workers:
+                if self._closed:
+                    return
+                if worker.process.poll() is not None:
+                    conn = worker.conn
+                    if conn is not None:
+                        self._mark_down(worker, conn, f"inference worker {worker.index} exited")
+                    self._spawn(worker)
+                elif worker.ready:
+                    if time.time() - worker.last_pong > 3 * HEALTH_INTERVAL_S:
+                        worker.process.kill()  # unresponsive; respawned on the next pass
+                        continue
+                    self._send(worker, ("ping", time.time()))
+
+    def _send(self, worker: _Worker, message: tuple) -> bool:
+        conn = worker.conn
+        if conn is None:
+            return False
+        try:
+            with worker.send_lock:
+                conn.send(message)
+            return True
+        except OSError:
+            return False
+
+    def _select(self, name: str) -> _Worker:
+        deadline = time.monotonic() + CALL_TIMEOUT_S
+        with self._cond:
+            while True:
+                ready = [w for w in self._workers if w.ready and self._serves(w, name)]
+                if ready:
+                    return min(ready, key=lambda w: len(w.pending))
+                remaining = deadline - time.monotonic()
+                if self._closed or remaining <= 0:
+                    raise WorkerUnavailableError(f"No inference worker available for '{name}'")
+                self._cond.wait(remaining)
+
+    def run(self, kind: str, name: str, array: np.ndarray) -> Any:
+        """Run `kind` ("classify" or "detect") for `name` on a worker and return its output."""
+        name = self._canonical(name)
+        array = np.ascontiguousarray(array)
+        worker = self._select(name)
+        shm = SharedMemory(create=True, size=max(1, array.nbytes))
+        call_id = next(self._call_ids)
+        call = _Call()
+        try:
+            view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+            view[...] = array
+            del view
+            with self._cond:
+                worker.pending[call_id] = call
+                worker.requests += 1
+            if not self._send(worker, ("run", call_id, kind, name, shm.name, array.shape, array.dtype.str)):
+                raise WorkerUnavailableError(f"inference worker {worker.index} is not connected")
+            if not call.done.wait(CALL_TIMEOUT_S):
+                worker.process.kill()
+                raise TimeoutError(f"inference worker {worker.index} did not answer within {CALL_TIMEOUT_S:.0f}s")
+            if call.error is not None:
+                raise call.error
+            return call.result
+        finally:
+            with self._cond:
+                worker.pending.pop(call_id, None)
+            shm.close()
+            shm.unlink()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._cond:
+            return {
+                "processes": len(self._workers),
+                "routes": dict(self._routes),
+                "workers": [
+                    {
+                        "index": w.index,
+                        "pid": w.process.pid if w.process else None,
+                        "alive": w.process is not None and w.process.poll() is None,
+                        "ready": w.ready,
+                        "in_flight": len(w.pending),
+                        "requests": w.requests,
+                        "errors": w.errors,
+                        "restarts": max(0, w.restarts),
+                        "uptime_s": round(now - w.started_at, 1),
+                        "last_pong_age_s": round(now - w.last_pong, 1) if w.last_pong else None,
+                    }
+                    for w in self._workers
+                ],
+            }
+
+    def close(self) -> None:
+        self._closed = True
+        with self._cond:
+            self._cond.notify_all()
+        for worker in self._workers:
+            self._send(worker, ("stop",))
+        for worker in self._workers:
+            if worker.process is None:
+                continue
+            try:
+                worker.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                worker.process.kill()
+        self._listener.close()
+
+
+_pool: Optional[InferencePool] = None
+
+
+def get_pool() -> Optional[InferencePool]:
+    return _pool
+
+
+def start_pool(preload: List[str]) -> Optional[InferencePool]:
+    """Start the worker pool when INFERENCE_PROCESSES > 0; returns None otherwise."""
+    global _pool
+    if _pool is None and INFERENCE_PROCESSES > 0:
+        _pool = InferencePool(INFERENCE_PROCESSES, parse_routes(INFERENCE_ROUTES), preload).start()
+        atexit.register(_pool.close)
+    return _pool
+
+
+def _worker_main() -> None:
+    index = int(os.environ["INFERENCE_WORKER_INDEX"])
+    conn = connection.Client(
+        os.environ["INFERENCE_WORKER_ADDRESS"], authkey=bytes.fromhex(os.environ["INFERENCE_WORKER_AUTHKEY"])
+    )
+    send_lock = threading.Lock()
+
+    def send(message: tuple) -> None:
+        with send_lock:
+            conn.send(message)
+
+    send(("hello", index, os.getpid()))
+
+    import detector
+    import model
+
+    forwards: Dict[str, Callable[[str, np.ndarray], Any]] = {
+        "classify": lambda name, batch: model.local_forward(name)(batch),
+        "detect": lambda name, batch: detector.local_forward(batch),
+    }
+    for name in [n for n in os.environ.get("INFERENCE_WORKER_PRELOAD", "").split(",") if n]:
+        if name == detector.DETECTOR_NAME:
+            detector.warmup_detector()
+        else:
+            model.warmup_models([name])
+    send(("ready",))
+
+    # Pings are answered from this thread so a long inference does not look like a hang
+    work: "queue.Queue[Optional[tuple]]" = queue.Queue()
+
+    def read() -> None:
+        try:
+            while True:
+                message = conn.recv()
+                if message[0] == "ping":
+                    send(("pong", message[1]))
+                elif message[0] == "stop":
+                    break
+                else:
+                    work.put(message)
+        except (EOFError, OSError):
+            pass
+        work.put(None)
+
+    threading.Thread(target=read, name="inference-worker-reader", daemon=True).start()
+    while True:
+        message = work.get()
+        if message is None:
+            break
+        _, call_id, kind, name, shm_name, shape, dtype = message
+        shm = SharedMemory(name=shm_name)
+        # The front end owns the block and unlinks it; don't let this process's tracker touch it
+        resource_tracker.unregister(shm._name, "shared_memory")
+        batch = None
+        try:
+            batch = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+            send(("ok", call_id, forwards[kind](name, batch)))
+        except Exception as e:
+            send(("error", call_id, f"{type(e).__name__}: {e}"))
+        finally:
+            del batch
+            shm.close()
+
+
+if __name__ == "__main__":
+    _worker_main()
@@ -1,17 +1,26 @@
 import os
 import io
+import sys
 import time
 import json
+import hashlib
 import sqlite3
 from datetime import datetime
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Optional, Tuple
 
-from flask import Flask, request, jsonify, render_template, send_from_directory, url_for
-
-from detector import YOLODetector
+from flask import Flask, Response, request, jsonify, render_template, send_from_directory, stream_with_context, url_for
 
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Shared infrastructure (job queue, data access) lives in the parent project.
+# Appended so this app's own modules (detector.py) still take precedence.
+sys.path.append(os.path.dirname(BASE_DIR))
+from database import get_connection, get_writer  # noqa: E402
+from jobs import JobQueue, QueueFullError, create_jobs_blueprint  # noqa: E402
+import metrics  # noqa: E402
+from detector import YOLODetector  # noqa: E402
+from metrics import collect, current_timings, observe_stage, stage  # noqa: E402
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 STATIC_DIR = os.path.join(BASE_DIR, "static")
 UPLOADS_DIR = os.path.join(BASE_DIR, "uploads")
@@ -25,6 +34,8 @@ os.makedirs(OUTPUTS_DIR, exist_ok=True)
 app = Flask(
     __name__, template_folder=TEMPLATES_DIR, static_folder=STATIC_DIR
 )
+# Per-request stage timings and the Prometheus /metrics endpoint
+metrics.init_app(app)
 
 detector = YOLODetector(model_name=os.environ.get("YOLO_MODEL", "yolov8n.pt"))
 
@@ -33,9 +44,7 @@ detector = YOLODetector(model_name=os.environ.get("YOLO_MODEL", "yolov8n.pt"))
 
 
 def _get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    return get_connection(DB_PATH)
 
 
 def _init_db() -> None:
@@ -57,11 +66,21 @@ def _init_db() -> None:
             )
             """
         )
+        # Keyset pagination walks id DESC, optionally within one model / source type
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_detections_model_id ON detections(model, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_detections_source_type_id ON detections(source_type, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_detections_created_at ON detections(created_at)")
+        cols = {c[1] for c in conn.execute("PRAGMA table_info(detections)").fetchall()}
+        if "timings_json" not in cols:
+            conn.execute("ALTER TABLE detections ADD COLUMN timings_json TEXT")
         conn.commit()
 
 
 _init_db()
 
+HISTORY_DEFAULT_LIMIT = 20
+HISTORY_MAX_LIMIT = 100
+
 
 def _insert_history(
     source_filename: str,
@@ -73,30 +92,30 @@ def _insert_history(
     duration_ms: int,
     conf: float,
     iou: float,
+    timings: Optional[Dict[str, float]] = None,
 ) -> int:
-    with _get_conn() as conn:
-        cur = conn.execute(
-            """
-            INSERT INTO detections (
-                source_filename, source_type, output_relpath, classes_json, confs_json,
-                created_at, model, duration_ms, conf, iou
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                source_filename,
-                source_type,
-                output_relpath,
-                json.dumps(classes),
-                json.dumps(confs),
-                datetime.utcnow().isoformat(timespec="seconds") + "Z",
-                model,
-                duration_ms,
-                conf,
-                iou,
-            ),
-        )
-        conn.commit()
-        return int(cur.lastrowid)
+    row_id = get_writer(DB_PATH).execute(
+        """
+        INSERT INTO detections (
+            source_filename, source_type, output_relpath, classes_json, confs_json,
+            created_at, model, duration_ms, conf, iou, timings_json
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            source_filename,
+            source_type,
+            output_relpath,
+            json.dumps(classes),
+            json.dumps(confs),
+            datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            model,
+            duration_ms,
+            conf,
+            iou,
+            json.dumps(timings) if timings else None,
+        ),
+    )
+    return int(row_id)
 
 
 # ---------- Helpers ----------
@@ -113,6 +132,23 @@ def _allowed_file(filename: str) -> Tuple[bool, str]:
     return False, ""
 
 
+def _save_upload(file) -> str:
+    timestamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S-%f")
+    safe_name = f"{timestamp}_{os.path.basename(file.filename)}"
+    with stage("save"):
+        file.save(os.path.join(UPLOADS_DIR, safe_name))
+    return safe_name
+
+
+# ---------- Background jobs ----------
+
+job_queue = JobQueue(
+    DB_PATH,
+    workers=int(os.environ.get("JOB_WORKERS", "1")),
+    max_pending=int(os.environ.get("JOB_MAX_PENDING", "20")),
+)
+
+
 # ---------- Routes ----------
 
 
@@ -141,53 +177,235 @@ def api_detect():
         conf = 0.35
         iou = 0.45
 
-    # Save upload
-    timestamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S-%f")
-    safe_name = f"{timestamp}_{os.path.basename(file.filename)}"
-    src_path = os.path.join(UPLOADS_DIR, safe_name)
-    file.save(src_path)
+    safe_name = _save_upload(file)
 
-    # Run detection
-    t0 = time.time()
     try:
-        det = detector.predict(src_path, OUTPUTS_DIR, conf=conf, iou=iou)
+        result, det = _detect(safe_name, source_type, conf, iou, tiled=request.form.get("tiled") == "1")
     except Exception as e:
         return jsonify({"error": f"Detection failed: {e}"}), 500
+    if request.form.get("response") == "image" and det.get("image") is not None:
+        # The annotated bytes are already in memory; send them as-is with the entry id alongside
+        return Response(
+            det["image"],
+            mimetype=det["mimetype"],
+            headers={"X-Detection-Id": str(result["id"]), "Content-Location": result["output_url"]},
+        )
+    return jsonify(result)
+
+
+def _detect(
+    safe_name: str, source_type: str, conf: float, iou: float, tiled: bool = False
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    src_path = os.path.join(UPLOADS_DIR, safe_name)
+
+    # Run detection
+    t0 = time.time()
+    det = detector.predict(src_path, OUTPUTS_DIR, conf=conf, iou=iou, tiled=tiled and source_type == "image")
     duration_ms = int((time.time() - t0) * 1000)
+    return _record_detection(safe_name, source_type, det, duration_ms, conf, iou), det
+
+
+def _record_detection(
+    safe_name: str, source_type: str, det: Dict[str, Any], duration_ms: int, conf: float, iou: float
+) -> Dict[str, Any]:
+    model = det.get("model", "unknown")
+    for name, ms in det.get("timings", {}).items():
+        observe_stage(name, ms / 1000.0, model)
+    timings = current_timings()
+    row_timings = timings.as_dict() if timings is not None else None
 
     # Store history
     rel = os.path.relpath(det["output_path"], OUTPUTS_DIR)
-    history_id = _insert_history(
-        source_filename=safe_name,
-        source_type=source_type,
-        output_relpath=rel.replace("\\", "/"),
-        classes=det.get("classes", []),
-        confs=[float(x) for x in det.get("confs", [])],
-        model=det.get("model", "unknown"),
-        duration_ms=duration_ms,
-        conf=conf,
-        iou=iou,
-    )
+    with stage("db_write", model):
+        history_id = _insert_history(
+            source_filename=safe_name,
+            source_type=source_type,
+            output_relpath=rel.replace("\\", "/"),
+            classes=det.get("classes", []),
+            confs=[float(x) for x in det.get("confs", [])],
+            model=model,
+            duration_ms=duration_ms,
+            conf=conf,
+            iou=iou,
+            timings=row_timings,
+        )
+
+    return {
+        "id": history_id,
+        "output_url": url_for("serve_output", filename=rel, _external=False),
+        "classes": det.get("classes", []),
+        "confs": [float(x) for x in det.get("confs", [])],
+        "model": det.get("model", "unknown"),
+        "duration_ms": duration_ms,
+        "timings": row_timings,
+        "source_type": source_type,
+    }
+
+
+@app.post("/api/detect/stream")
+def api_detect_stream():
+    """Video detection with progress as NDJSON: a `start` line, one `frame` line per sampled frame, then `done` or `error`."""
+    if "file" not in request.files:
+        return jsonify({"error": "No file part"}), 400
+
+    file = request.files["file"]
+    if file.filename == "":
+        return jsonify({"error": "No selected file"}), 400
+
+    ok, source_type = _allowed_file(file.filename)
+    if not ok:
+        return jsonify({"error": "Unsupported file type"}), 400
+    if source_type != "video":
+        return jsonify({"error": "Streaming detection needs a video; use /api/detect for images"}), 400
 
+    try:
+        conf = float(request.form.get("conf", 0.35))
+        iou = float(request.form.get("iou", 0.45))
+    except Exception:
+        conf = 0.35
+        iou = 0.45
+    # Missing or malformed values fall back to YOLO_VIDEO_STRIDE / YOLO_VIDEO_MAX_FPS
+    stride = request.form.get("stride", type=int)
+    max_fps = request.form.get("max_fps", type=float)
+
+    safe_name = _save_upload(file)
+    src_path = os.path.join(UPLOADS_DIR, safe_name)
+
+    def generate():
+        t0 = time.time()
+        with collect("api_detect_stream"):
+            try:
+                for event in detector.predict_stream(
+                    src_path, OUTPUTS_DIR, conf=conf, iou=iou, stride=stride, max_fps=max_fps
+                ):
+                    if event["event"] == "done":
+                        duration_ms = int((time.time() - t0) * 1000)
+                        event = {
+                            "event": "done",
+                            "summary": event["summary"],
+                            "frames": event["frames"],
+                            "frames_processed": event["frames_processed"],
+                            "stride": event["stride"],
+                            **_record_detection(safe_name, source_type, event, duration_ms, conf, iou),
+                        }
+                    yield json.dumps(event) + "\n"
+            except Exception as e:
+                yield json.dumps({"event": "error", "error": f"Detection failed: {e}"}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+def _run_detection_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    # Job workers run outside any request; a synthetic one lets url_for build relative URLs
+    with app.test_request_context(), collect("job:detect"):
+        result, _det = _detect(
+            payload["source_filename"], payload["source_type"], payload["conf"], payload["iou"], payload.get("tiled", False)
+        )
+        return result
+
+
+job_queue.register("detect", _run_detection_job)
+app.register_blueprint(create_jobs_blueprint(job_queue))
+job_queue.start()
+
+
+@app.post("/api/jobs/detect")
+def api_jobs_detect():
+    if "file" not in request.files:
+        return jsonify({"error": "No file part"}), 400
+
+    file = request.files["file"]
+    if file.filename == "":
+        return jsonify({"error": "No selected file"}), 400
+
+    ok, source_type = _allowed_file(file.filename)
+    if not ok:
+        return jsonify({"error": "Unsupported file type"}), 400
+
+    try:
+        conf = float(request.form.get("conf", 0.35))
+        iou = float(request.form.get("iou", 0.45))
+    except Exception:
+        conf = 0.35
+        iou = 0.45
+
+    safe_name = _save_upload(file)
+    try:
+        job_id = job_queue.submit(
+            "detect",
+            {
+                "source_filename": safe_name,
+                "source_type": source_type,
+                "conf": conf,
+                "iou": iou,
+                "tiled": request.form.get("tiled") == "1",
+            },
+        )
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 503
     return jsonify(
         {
-            "id": history_id,
-            "output_url": url_for("serve_output", filename=rel, _external=False),
-            "classes": det.get("classes", []),
-            "confs": [float(x) for x in det.get("confs", [])],
-            "model": det.get("model", "unknown"),
-            "duration_ms": duration_ms,
-            "source_type": source_type,
+            "job_id": job_id,
+            "status": "queued",
+            "status_url": url_for("jobs.job_status", job_id=job_id),
+            "events_url": url_for("jobs.job_events", job_id=job_id),
         }
-    )
+    ), 202
+
+
+def _history_etag(args) -> str:
+    # Rows are only ever appended, so the newest id versions every page; read
+    # from the DB so all worker processes agree on it
+    with _get_conn() as conn:
+        version = conn.execute("SELECT MAX(id) FROM detections").fetchone()[0] or 0
+    key = "&".join(f"{k}={v}" for k, v in sorted(args.items(multi=True)))
+    return hashlib.sha1(f"{version}:{key}".encode()).hexdigest()
 
 
 @app.get("/api/history")
 def api_history():
+    """Newest-first history page. Query: limit, cursor (id from next_cursor), model, source_type, since, until."""
+    etag = _history_etag(request.args)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    try:
+        limit = max(1, min(int(request.args.get("limit", HISTORY_DEFAULT_LIMIT)), HISTORY_MAX_LIMIT))
+        cursor = request.args.get("cursor", type=int)
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+
+    clauses: List[str] = []
+    params: List[Any] = []
+    if cursor is not None:
+        clauses.append("id < ?")
+        params.append(cursor)
+    for column in ("model", "source_type"):
+        value = request.args.get(column)
+        if value:
+            clauses.append(f"{column} = ?")
+            params.append(value)
+    # created_at is ISO-8601 text, so dates and timestamps compare lexicographically
+    since = request.args.get("since")
+    if since:
+        clauses.append("created_at >= ?")
+        params.append(since)
+    until = request.args.get("until")
+    if until:
+        clauses.append("created_at < ?")
+        params.append(until)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
     with _get_conn() as conn:
         rows = conn.execute(
-            "SELECT id, source_filename, source_type, output_relpath, created_at, model, duration_ms, conf, iou FROM detections ORDER BY id DESC"
+            "SELECT id, source_filename, source_type, output_relpath, created_at, model, duration_ms, conf, iou "
+            f"FROM detections {where} ORDER BY id DESC LIMIT ?",
+            (*params, limit + 1),
         ).fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
     items = []
     for r in rows:
         rel = r["output_relpath"]
@@ -204,7 +422,10 @@ def api_history():
                 "iou": float(r["iou"]),
             }
         )
-    return jsonify(items)
+    response = jsonify({"items": items, "next_cursor": items[-1]["id"] if has_more else None})
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
 
 
 @app.get("/api/history/<int:det_id>")
@@ -231,6 +452,7 @@ def api_history_item(det_id: int):
             "iou": float(row["iou"]),
             "classes": json.loads(row["classes_json"] or "[]"),
             "confs": [float(x) for x in json.loads(row["confs_json"] or "[]")],
+            "timings": json.loads(row["timings_json"]) if row["timings_json"] else None,
         }
     )
 
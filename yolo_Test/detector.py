@@ -1,10 +1,35 @@
+import math
+import mimetypes
 import os
-import glob
+import time
 from dataclasses import dataclass
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 
+import numpy as np
+from PIL import Image
 from ultralytics import YOLO
 
+# Shared with the parent project, which app.py puts on sys.path
+from boxes import batched, capped_size, nms, tile_grid
+from imaging import decode_for_inference
+
+
+# Video frame sampling defaults; /api/detect/stream can override both per request
+VIDEO_STRIDE = int(os.environ.get("YOLO_VIDEO_STRIDE", "1"))
+VIDEO_MAX_FPS = float(os.environ.get("YOLO_VIDEO_MAX_FPS", "0"))  # 0 = no cap
+VIDEO_EXTS = (".mp4", ".mov", ".avi", ".mkv", ".webm")
+# Annotated image encoding: jpg, png or webp; quality (1-100) applies to jpg and webp
+OUTPUT_FORMAT = os.environ.get("YOLO_OUTPUT_FORMAT", "jpg").lower().lstrip(".")
+OUTPUT_QUALITY = int(os.environ.get("YOLO_OUTPUT_QUALITY", "90"))
+# Tiled mode for large images: overlapping TILE_SIZE windows of the source, decoded at most
+# TILE_MAX_SIDE on its longest side, with TILE_BATCH tiles per ultralytics call
+TILE_SIZE = int(os.environ.get("YOLO_TILE_SIZE", "640"))
+TILE_OVERLAP = float(os.environ.get("YOLO_TILE_OVERLAP", "0.2"))
+TILE_BATCH = int(os.environ.get("YOLO_TILE_BATCH", "8"))
+TILE_MAX_SIDE = int(os.environ.get("YOLO_TILE_MAX_SIDE", "4096"))
+# Only JPEGs decode at reduced size; larger decodes are refused so memory stays bounded
+TILE_MAX_PIXELS = int(os.environ.get("YOLO_TILE_MAX_PIXELS", str(80_000_000)))
+
 
 @dataclass
 class DetectionResult:
@@ -14,6 +39,115 @@ class DetectionResult:
     model: str
 
 
+def sample_stride(fps: float, stride: Optional[int] = None, max_fps: Optional[float] = None) -> int:
+    """Frames to advance per processed frame: at least `stride`, and enough to stay under `max_fps`."""
+    step = max(1, stride if stride is not None else VIDEO_STRIDE)
+    cap = max_fps if max_fps is not None else VIDEO_MAX_FPS
+    if cap and cap > 0 and fps > cap:
+        step = max(step, math.ceil(fps / cap))
+    return step
+
+
+def _output_path(outputs_root: str, source_path: str, ext: str) -> str:
+    # Uploads carry a timestamp prefix, so the source stem is already unique
+    stem = os.path.splitext(os.path.basename(source_path))[0]
+    return os.path.join(outputs_root, f"{stem}.{ext}")
+
+
+def encode_image(bgr, fmt: str = OUTPUT_FORMAT, quality: int = OUTPUT_QUALITY) -> Tuple[bytes, str]:
+    """Encode a BGR frame (as returned by Results.plot()) to `fmt`; returns the bytes and mimetype."""
+    import cv2  # installed with ultralytics
+
+    params = {
+        "jpg": [cv2.IMWRITE_JPEG_QUALITY, quality],
+        "jpeg": [cv2.IMWRITE_JPEG_QUALITY, quality],
+        "webp": [cv2.IMWRITE_WEBP_QUALITY, quality],
+        "png": [],
+    }
+    if fmt not in params:
+        raise ValueError(f"Unsupported output format {fmt!r}; use jpg, png or webp")
+    ok, buf = cv2.imencode(f".{fmt}", bgr, params[fmt])
+    if not ok:
+        raise RuntimeError(f"Could not encode the annotated image as {fmt}.")
+    return buf.tobytes(), mimetypes.guess_type(f"x.{fmt}")[0] or "application/octet-stream"
+
+
+def draw_boxes(bgr: np.ndarray, boxes: np.ndarray, labels: List[str], confs: List[float]) -> np.ndarray:
+    """Draw labelled xyxy boxes onto a BGR frame in place."""
+    import cv2  # installed with ultralytics
+
+    thickness = max(2, round(max(bgr.shape[:2]) / 600))
+    for (x0, y0, x1, y1), label, conf_v in zip(boxes.astype(int).tolist(), labels, confs):
+        cv2.rectangle(bgr, (x0, y0), (x1, y1), (255, 56, 56), thickness)
+        cv2.putText(
+            bgr, f"{label} {conf_v:.2f}", (x0, max(0, y0 - 4)), cv2.FONT_HERSHEY_SIMPLEX,
+            thickness / 3, (255, 255, 255), max(1, thickness // 2), cv2.LINE_AA,
+        )
+    return bgr
+
+
+def _frame_detections(result) -> List[Dict[str, Any]]:
+    """Label, confidence and xyxy box for every detection in one ultralytics result."""
+    boxes = getattr(result, "boxes", None)
+    if boxes is None:
+        return []
+    names = getattr(result, "names", None) or {}
+    try:
+        cls_ids = boxes.cls.tolist() if hasattr(boxes, "cls") else []
+        conf_vals = boxes.conf.tolist() if hasattr(boxes, "conf") else []
+        xyxy = boxes.xyxy.tolist() if hasattr(boxes, "xyxy") else []
+    except Exception:
+        return []
+    detections = []
+    for i, (idx, conf_v) in enumerate(zip(cls_ids, conf_vals)):
+        label = names.get(int(idx), str(int(idx))) if isinstance(names, dict) else str(int(idx))
+        try:
+            conf_f = float(conf_v)
+        except Exception:
+            conf_f = 0.0
+        box = [round(float(v), 1) for v in xyxy[i]] if i < len(xyxy) else None
+        detections.append({"label": label, "conf": conf_f, "box": box})
+    return detections
+
+
+class VideoSummary:
+    """Per-class statistics folded in frame by frame, so memory does not grow with video length."""
+
+    def __init__(self) -> None:
+        self.frames = 0
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def add(self, detections: List[Dict[str, Any]]) -> None:
+        self.frames += 1
+        seen = set()
+        for det in detections:
+            stats = self._stats.setdefault(det["label"], {"frames": 0, "detections": 0, "max_conf": 0.0, "conf_sum": 0.0})
+            stats["detections"] += 1
+            stats["conf_sum"] += det["conf"]
+            stats["max_conf"] = max(stats["max_conf"], det["conf"])
+            if det["label"] not in seen:
+                seen.add(det["label"])
+                stats["frames"] += 1
+
+    def as_dict(self) -> Dict[str, Dict[str, float]]:
+        return {
+            label: {
+                "frames": int(s["frames"]),
+                "detections": int(s["detections"]),
+                "max_conf": round(s["max_conf"], 4),
+                "mean_conf": round(s["conf_sum"] / s["detections"], 4),
+            }
+            for label, s in self._stats.items()
+        }
+
+    def classes(self) -> List[str]:
+        """Labels ordered by how many sampled frames they appear in."""
+        return sorted(self._stats, key=lambda label: (-self._stats[label]["frames"], label))
+
+    def confs(self) -> List[float]:
+        return [self._stats[label]["max_conf"] for label in self.classes()]
+
+
 class YOLODetector:
     def __init__(self, model_name: str = "yolov8n.pt") -> None:
         # Lazy load the model to avoid slow import time on app start
@@ -24,75 +158,249 @@ class YOLODetector:
         if self._model is None:
             self._model = YOLO(self._model_name)
 
-    def predict(self, source_path: str, outputs_root: str, conf: float = 0.35, iou: float = 0.45) -> Dict[str, Any]:
+    def predict(
+        self, source_path: str, outputs_root: str, conf: float = 0.35, iou: float = 0.45, tiled: bool = False
+    ) -> Dict[str, Any]:
         """
-        Run prediction on an image or video. The annotated output is saved under
-        outputs_root/<run_name>/pred/ with the same base filename.
-        Returns a dict with output_path, classes, confs, model.
+        Run prediction on an image or video. The annotated output is written to
+        outputs_root/<source stem>.<ext> (OUTPUT_FORMAT for images, .mp4 for videos).
+        Returns a dict with output_path, classes, confs, model and per-stage timings (ms);
+        for images also `image` (the encoded annotated bytes) and its `mimetype`.
+        Videos go through predict_stream(); their classes/confs are per class over all sampled frames.
+        `tiled` runs images through predict_tiled().
         """
+        if source_path.lower().endswith(VIDEO_EXTS):
+            done: Dict[str, Any] = {}
+            for event in self.predict_stream(source_path, outputs_root, conf=conf, iou=iou):
+                if event["event"] == "done":
+                    done = event
+            return {k: v for k, v in done.items() if k != "event"}
+        if tiled:
+            return self.predict_tiled(source_path, outputs_root, conf=conf, iou=iou)
+
         self._ensure_loaded()
+        t0 = time.perf_counter()
+        results = self._model.predict(source=source_path, conf=conf, iou=iou, imgsz=640, verbose=False)
+        predict_ms = (time.perf_counter() - t0) * 1000.0
+        if len(results) == 0:
+            raise RuntimeError("Prediction returned no result for the image.")
+        result = results[0]
+        # ultralytics reports preprocess / inference / postprocess ms per frame;
+        # the rest of predict() is reading and decoding the source
+        speed = dict(getattr(result, "speed", None) or {})
+        timings = {k: float(speed[k]) for k in ("preprocess", "inference", "postprocess") if speed.get(k) is not None}
+        timings["io"] = max(0.0, predict_ms - sum(timings.values()))
 
-        run_name = os.path.splitext(os.path.basename(source_path))[0]
-        save_project = os.path.join(outputs_root, run_name)
-        os.makedirs(save_project, exist_ok=True)
-
-        results = self._model.predict(
-            source=source_path,
-            conf=conf,
-            iou=iou,
-            imgsz=640,
-            save=True,
-            project=save_project,
-            name="pred",
-            exist_ok=True,
-            verbose=False,
-        )
+        t1 = time.perf_counter()
+        detections = _frame_detections(result)
+        timings["decode_results"] = (time.perf_counter() - t1) * 1000.0
 
-        # Collect classes and confidences from first result
-        classes: List[str] = []
-        confs: List[float] = []
-        if len(results) > 0 and hasattr(results[0], "boxes") and results[0].boxes is not None:
-            names = results[0].names if hasattr(results[0], "names") else {}
-            boxes = results[0].boxes
-            try:
-                cls_ids = boxes.cls.tolist() if hasattr(boxes, "cls") else []
-                conf_vals = boxes.conf.tolist() if hasattr(boxes, "conf") else []
-            except Exception:
-                cls_ids = []
-                conf_vals = []
-            for idx, conf_v in zip(cls_ids, conf_vals):
-                label = names.get(int(idx), str(int(idx))) if isinstance(names, dict) else str(int(idx))
-                classes.append(label)
-                try:
-                    confs.append(float(conf_v))
-                except Exception:
-                    confs.append(0.0)
-
-        # Determine output file path saved by ultralytics
-        pred_dir = os.path.join(save_project, "pred")
-        base = os.path.basename(source_path)
-        stem, _ = os.path.splitext(base)
-
-        # Search for a saved file matching the stem with any extension
-        candidates = glob.glob(os.path.join(pred_dir, f"{stem}.*"))
-        if not candidates:
-            # Fallback: pick any file in pred_dir
-            files = sorted(glob.glob(os.path.join(pred_dir, "*")))
-            if not files:
-                raise RuntimeError("Prediction completed but no output file was found.")
-            output_path = files[0]
-        else:
-            # Prefer common image/video extensions ordering
-            preferred_exts = [".jpg", ".png", ".mp4", ".avi", ".mov", ".mkv", ".webm", ".bmp", ".jpeg", ".webp"]
-            ranked = sorted(
-                candidates,
-                key=lambda p: preferred_exts.index(os.path.splitext(p)[1].lower()) if os.path.splitext(p)[1].lower() in preferred_exts else 999,
-            )
-            output_path = ranked[0]
+        # Boxes are drawn from the result tensors and encoded once, straight to a known path
+        t2 = time.perf_counter()
+        image, mimetype = encode_image(result.plot())
+        timings["render"] = (time.perf_counter() - t2) * 1000.0
+        t3 = time.perf_counter()
+        output_path = _output_path(outputs_root, source_path, OUTPUT_FORMAT)
+        with open(output_path, "wb") as fh:
+            fh.write(image)
+        timings["io"] += (time.perf_counter() - t3) * 1000.0
+
+        return {
+            "output_path": output_path,
+            "classes": [d["label"] for d in detections],
+            "confs": [d["conf"] for d in detections],
+            "model": self._model_name,
+            "timings": timings,
+            "image": image,
+            "mimetype": mimetype,
+        }
+
+    def predict_tiled(self, source_path: str, outputs_root: str, conf: float = 0.35, iou: float = 0.45) -> Dict[str, Any]:
+        """
+        Run prediction on overlapping tiles of a large image so small objects are not lost to
+        the 640px downscale. Same result shape as predict(), plus the number of `tiles`.
+
+        The image is decoded once at no more than TILE_MAX_SIDE on its longest side (ValueError if
+        that still means decoding more than TILE_MAX_PIXELS) and cut into
+        TILE_SIZE windows overlapping by TILE_OVERLAP, plus one whole-image window for objects larger
+        than a tile. Tiles are views of the decoded image passed TILE_BATCH at a time as one
+        ultralytics batch; boxes are shifted back to image coordinates and merged with class-aware NMS.
+        """
+        self._ensure_loaded()
+        t0 = time.perf_counter()
+        with Image.open(source_path) as image:
+            target = capped_size(image.size[0], image.size[1], TILE_MAX_SIDE)
+            rgb = decode_for_inference(image, [target], max_pixels=TILE_MAX_PIXELS)
+        if rgb.size != target:
+            rgb = rgb.resize(target, Image.BILINEAR)
+        bgr = np.ascontiguousarray(np.asarray(rgb)[:, :, ::-1])
+        del rgb
+        height, width = bgr.shape[:2]
+        timings: Dict[str, float] = {"io": (time.perf_counter() - t0) * 1000.0}
+
+        windows = np.array([[0, 0, width, height]])
+        if width > TILE_SIZE or height > TILE_SIZE:
+            windows = np.concatenate([windows, tile_grid(width, height, TILE_SIZE, TILE_OVERLAP)])
+
+        names: Any = {}
+        found_boxes, found_scores, found_classes = [], [], []
+        decode_s = 0.0
+        for batch in batched(windows, TILE_BATCH):
+            crops = [bgr[y0:y1, x0:x1] for x0, y0, x1, y1 in batch.tolist()]
+            results = self._model.predict(source=crops, conf=conf, iou=iou, imgsz=TILE_SIZE, verbose=False)
+            t1 = time.perf_counter()
+            for (x0, y0, _, _), result in zip(batch.tolist(), results):
+                for k, v in (getattr(result, "speed", None) or {}).items():
+                    if k in ("preprocess", "inference", "postprocess") and v is not None:
+                        timings[k] = timings.get(k, 0.0) + float(v)
+                names = getattr(result, "names", None) or names
+                boxes = getattr(result, "boxes", None)
+                if boxes is None:
+                    continue
+                found_boxes.append(np.asarray(boxes.xyxy.tolist(), dtype=np.float64).reshape(-1, 4) + [x0, y0, x0, y0])
+                found_scores.append(np.asarray(boxes.conf.tolist(), dtype=np.float64).reshape(-1))
+                found_classes.append(np.asarray(boxes.cls.tolist(), dtype=np.int64).reshape(-1))
+            decode_s += time.perf_counter() - t1
+            del crops
+
+        t2 = time.perf_counter()
+        boxes_g = np.concatenate(found_boxes) if found_boxes else np.zeros((0, 4))
+        scores = np.concatenate(found_scores) if found_scores else np.zeros(0)
+        classes_g = np.concatenate(found_classes) if found_classes else np.zeros(0, dtype=np.int64)
+        keep = nms(boxes_g, scores, iou, classes=classes_g)
+        labels = [
+            names.get(int(c), str(int(c))) if isinstance(names, dict) else str(int(c)) for c in classes_g[keep].tolist()
+        ]
+        confs = [float(v) for v in scores[keep].tolist()]
+        timings["decode_results"] = (decode_s + time.perf_counter() - t2) * 1000.0
+
+        t3 = time.perf_counter()
+        image_bytes, mimetype = encode_image(draw_boxes(bgr, boxes_g[keep], labels, confs))
+        timings["render"] = (time.perf_counter() - t3) * 1000.0
+        t4 = time.perf_counter()
+        output_path = _output_path(outputs_root, source_path, OUTPUT_FORMAT)
+        with open(output_path, "wb") as fh:
+            fh.write(image_bytes)
+        timings["io"] += (time.perf_counter() - t4) * 1000.0
 
         return {
             "output_path": output_path,
-            "classes": classes,
+            "classes": labels,
             "confs": confs,
             "model": self._model_name,
-        } 
\ No newline at end of file
+            "timings": timings,
+            "image": image_bytes,
+            "mimetype": mimetype,
+            "tiles": len(windows),
+        }
+
+    def predict_stream(
+        self,
+        source_path: str,
+        outputs_root: str,
+        conf: float = 0.35,
+        iou: float = 0.45,
+        stride: Optional[int] = None,
+        max_fps: Optional[float] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Run prediction on a video frame by frame, yielding progress events as frames are processed:
+        one "start" event, a "frame" event with the detections of every sampled frame, and a final
+        "done" event shaped like predict()'s result plus the per-class summary.
+
+        Frames are pulled lazily from ultralytics (stream=True) and annotated frames are written
+        straight to outputs_root/<source stem>.mp4, so nothing is kept per frame.
+        Every `stride`-th frame is processed, raised as needed to stay under `max_fps`.
+        """
+        import cv2  # installed with ultralytics
+
+        self._ensure_loaded()
+        capture = cv2.VideoCapture(source_path)
+        fps = float(capture.get(cv2.CAP_PROP_FPS) or 0.0)
+        total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        capture.release()
+        step = sample_stride(fps, stride, max_fps)
+
+        output_path = _output_path(outputs_root, source_path, "mp4")
+
+        yield {
+            "event": "start",
+            "fps": fps,
+            "frames": total,
+            "stride": step,
+            "expected": math.ceil(total / step) if total else None,
+        }
+
+        summary = VideoSummary()
+        speed_totals: Dict[str, float] = {}
+        decode_s = 0.0
+        busy_s = 0.0  # excludes time spent suspended at yield while the client reads
+        writer = None
+        frames = iter(
+            self._model.predict(
+                source=source_path, conf=conf, iou=iou, imgsz=640, vid_stride=step, stream=True, verbose=False
+            )
+        )
+        try:
+            while True:
+                t0 = time.perf_counter()
+                result = next(frames, None)
+                if result is None:
+                    break
+                for k, v in (getattr(result, "speed", None) or {}).items():
+                    if v is not None:
+                        speed_totals[k] = speed_totals.get(k, 0.0) + float(v)
+                t1 = time.perf_counter()
+                detections = _frame_detections(result)
+                summary.add(detections)
+                decode_s += time.perf_counter() - t1
+
+                annotated = result.plot()
+                if writer is None:
+                    writer = self._open_writer(cv2, output_path, fps / step if fps else 1.0, annotated.shape[1], annotated.shape[0])
+                writer.write(annotated)
+                busy_s += time.perf_counter() - t0
+
+                index = (summary.frames - 1) * step
+                yield {
+                    "event": "frame",
+                    "frame": index,
+                    "time_s": round(index / fps, 3) if fps else None,
+                    "processed": summary.frames,
+                    "detections": detections,
+                }
+        finally:
+            close = getattr(frames, "close", None)
+            if close is not None:
+                close()
+            if writer is not None:
+                writer.release()
+
+        if writer is None:
+            raise RuntimeError("No frames could be read from the video.")
+
+        timings = {k: speed_totals[k] for k in ("preprocess", "inference", "postprocess") if k in speed_totals}
+        timings["decode_results"] = decode_s * 1000.0
+        timings["io"] = max(0.0, busy_s * 1000.0 - sum(timings.values()))
+        yield {
+            "event": "done",
+            "output_path": output_path,
+            "classes": summary.classes(),
+            "confs": summary.confs(),
+            "summary": summary.as_dict(),
+            "frames": total,
+            "frames_processed": summary.frames,
+            "stride": step,
+            "model": self._model_name,
+            "timings": timings,
+        }
+
+    @staticmethod
+    def _open_writer(cv2, path: str, fps: float, width: int, height: int):
+        # H.264 plays in browsers but needs an OpenCV build with an encoder for it; fall back to MPEG-4
+        for codec in ("avc1", "mp4v"):
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps, (width, height))
+            if writer.isOpened():
+                return writer
+            writer.release()
+        raise RuntimeError("Could not open a video writer for the annotated output.")
@@ -18,26 +18,51 @@ function el(tag, attrs = {}, children = []) {
   return e;
 }
 
+let historyCursor = null;
+
+function historyCard(it) {
+  const card = el('div', { class: 'card' });
+  card.appendChild(el('div', { html: `<strong>#${it.id}</strong> — ${it.source_filename}` }));
+  card.appendChild(el('div', { html: `<small>${it.created_at} — ${it.model} — ${it.duration_ms}ms</small>` }));
+  const link = el('a', { href: it.output_url, target: '_blank' }, [document.createTextNode('Open output')]);
+  card.appendChild(link);
+  return card;
+}
+
+async function loadHistoryPage(container) {
+  const url = historyCursor ? `/api/history?cursor=${historyCursor}` : '/api/history';
+  const page = await fetchJSON(url);
+  page.items.forEach((it) => container.appendChild(historyCard(it)));
+  historyCursor = page.next_cursor;
+  return page;
+}
+
 async function refreshHistory() {
   const list = document.getElementById('history');
   list.innerHTML = 'Loading...';
+  historyCursor = null;
   try {
-    const items = await fetchJSON('/api/history');
-    if (!items.length) {
+    const container = el('div', { class: 'list' });
+    const page = await loadHistoryPage(container);
+    if (!page.items.length) {
       list.innerHTML = '<div class="card">No history yet.</div>';
       return;
     }
-    const container = el('div', { class: 'list' });
-    items.forEach((it) => {
-      const card = el('div', { class: 'card' });
-      card.appendChild(el('div', { html: `<strong>#${it.id}</strong> — ${it.source_filename}` }));
-      card.appendChild(el('div', { html: `<small>${it.created_at} — ${it.model} — ${it.duration_ms}ms</small>` }));
-      const link = el('a', { href: it.output_url, target: '_blank' }, [document.createTextNode('Open output')]);
-      card.appendChild(link);
-      container.appendChild(card);
-    });
     list.innerHTML = '';
     list.appendChild(container);
+    if (historyCursor) {
+      const more = el('button', { type: 'button' }, [document.createTextNode('Load more')]);
+      more.addEventListener('click', async () => {
+        more.disabled = true;
+        try {
+          await loadHistoryPage(container);
+        } finally {
+          more.disabled = false;
+          if (!historyCursor) more.remove();
+        }
+      });
+      list.appendChild(more);
+    }
   } catch (e) {
     list.innerHTML = 'Failed to load history.';
   }
@@ -65,6 +90,60 @@ function renderResult(payload) {
   }
 }
 
+function renderProgress(counts, event) {
+  const result = document.getElementById('result');
+  result.innerHTML = '';
+  const info = el('div', { class: 'card' });
+  const at = event.time_s != null ? ` (${event.time_s.toFixed(1)}s)` : '';
+  info.appendChild(el('div', { html: `<strong>Frame:</strong> ${event.frame}${at} — ${event.detections.length} objects` }));
+  const pairs = Object.entries(counts)
+    .sort((a, b) => b[1] - a[1])
+    .map(([label, n]) => `${label} (${n} frames)`)
+    .join(', ');
+  if (pairs) info.appendChild(el('div', { html: `<strong>Seen so far:</strong> ${pairs}` }));
+  result.appendChild(info);
+}
+
+// Reads the NDJSON progress stream from /api/detect/stream and resolves with the final `done` line
+async function streamDetection(fd, status) {
+  const res = await fetch('/api/detect/stream', { method: 'POST', body: fd });
+  if (!res.ok) {
+    const text = await res.text();
+    throw new Error(text || res.statusText);
+  }
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  const counts = {};
+  let expected = null;
+  let buffer = '';
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const lines = buffer.split('\n');
+    buffer = lines.pop();
+    for (const line of lines) {
+      if (!line.trim()) continue;
+      const event = JSON.parse(line);
+      if (event.event === 'start') {
+        expected = event.expected;
+        status.textContent = `Processing every ${event.stride} frame(s)...`;
+      } else if (event.event === 'frame') {
+        new Set(event.detections.map((d) => d.label)).forEach((label) => {
+          counts[label] = (counts[label] || 0) + 1;
+        });
+        status.textContent = expected ? `Processed ${event.processed}/${expected} frames` : `Processed ${event.processed} frames`;
+        renderProgress(counts, event);
+      } else if (event.event === 'done') {
+        return event;
+      } else if (event.event === 'error') {
+        throw new Error(event.error);
+      }
+    }
+  }
+  throw new Error('Stream ended before detection finished');
+}
+
 async function main() {
   const form = document.getElementById('detect-form');
   const status = document.getElementById('status');
@@ -76,8 +155,9 @@ async function main() {
     if (!fd.get('file')) return;
     submit.disabled = true;
     status.textContent = 'Running detection...';
+    const isVideo = (fd.get('file').type || '').startsWith('video/');
     try {
-      const res = await fetchJSON('/api/detect', { method: 'POST', body: fd });
+      const res = isVideo ? await streamDetection(fd, status) : await fetchJSON('/api/detect', { method: 'POST', body: fd });
       renderResult(res);
       status.textContent = '';
       await refreshHistory();